@@ -10,6 +10,7 @@ NOTICE.  This Software was developed under funding from the U.S. Department of E
 from typing import Literal
 import pandas as pd
 import numpy as np
+from numpy import typing as npt
 
 
 class OpportunityEngine:
@@ -35,6 +36,199 @@ class OpportunityEngine:
         self.hdd = self.benchmark_stats['beta_hdd']['site_coefficient']
         self.beth = self.benchmark_stats['beta_beth']['site_coefficient']
 
+    coefficient_types = ['beta_base', 'beta_cdd', 'beta_betc', 'beta_hdd', 'beta_beth']
+
+    # Target = median + sigma * standard deviation, capped at the site coefficient; the other
+    # way around for the cooling change-point, where higher is better
+    target_sigmas = {'conservative': 1.0, 'nominal': 0.0, 'aggressive': -0.5}
+
+    # Conditions measures are diagnosed from: (coefficient, test, threshold, positive only).
+    # 'high': site - target >= threshold * target; 'low': target - site >= threshold * target;
+    # 'above': site > threshold. Positive only conditions also require site > 0.
+    conditions = {'base_high': ('beta_base', 'high', 0.001, True),
+                  'cdd_high': ('beta_cdd', 'high', 0.1, True),
+                  'hdd_high': ('beta_hdd', 'high', 0.1, True),
+                  'beth_high': ('beta_beth', 'high', 0.2, False),
+                  'betc_low': ('beta_betc', 'low', 0.2, False),
+                  # Electric beta_hdd's without electric heating are around 0.004 kWh/m2,
+                  # with electric or fossil heating around 0.04 kWh/m2 (9/20/2013)
+                  'electric_heating': ('beta_hdd', 'above', 0.01, False)}
+    # The relative thresholds above are overridden by override_value when override_threshold
+    override_threshold = True
+    override_value = 0.001
+
+    # Measures in table order: (measure, conditions, how many of them must hold, utility type
+    # (1 electricity, 2 fossil fuel, None any), measures that also trigger it)
+    rules = [
+        ('Increase Cooling Setpoints', ['betc_low'], 1, None, []),
+        ('Decrease Heating Setpoints', ['beth_high'], 1, None, []),
+        # Adjusting schedules also changes the average building temperatures, and so the
+        # break-even temperatures (9/20/13)
+        ('Reduce Equipment Schedules', ['base_high'], 1, 1,
+         ['Increase Cooling Setpoints', 'Decrease Heating Setpoints']),
+        ('Decrease Ventilation', ['cdd_high', 'hdd_high', 'beth_high'], 2, None, []),
+        ('Eliminate Electric Heating', ['electric_heating'], 1, 1, []),
+        ('Decrease Infiltration', ['cdd_high', 'hdd_high', 'beth_high'], 2, None, []),
+        ('Reduce Lighting Load', ['base_high'], 1, 1, []),
+        ('Reduce Plug Loads', ['base_high'], 1, 1, []),
+        ('Add/Fix Economizers', ['betc_low'], 1, None, []),
+        ('Increase Cooling System Efficiency', ['cdd_high'], 1, None, []),
+        ('Increase Heating System Efficiency', ['hdd_high'], 1, None, []),
+        ('Add Wall/Ceiling Insulation', ['cdd_high', 'hdd_high', 'beth_high'], 2, None, []),
+        ('Upgrade Windows', ['cdd_high', 'hdd_high', 'betc_low'], 3, None, []),
+        ('Check Fossil Baseload', ['base_high'], 1, 2, []),
+    ]
+
+    @staticmethod
+    def normalize_utility_type(utility_type) -> int:
+        """1 for electricity (1, 'electric', 'electricity'), 2 for fossil fuel (2, 'fossil_fuel', 'fossil fuel')"""
+        if utility_type in (1, 'electric', 'electricity'):
+            return 1
+        if utility_type in (2, 'fossil_fuel', 'fossil fuel'):
+            return 2
+        raise ValueError("Unknown utility type: " + str(utility_type))
+
+    @staticmethod
+    def normalize_target_level(target_level) -> str:
+        """Target level name, also from the saving targets 1 (conservative), 2 (nominal), 3 (aggressive)"""
+        target_level = {1: 'conservative', 2: 'nominal', 3: 'aggressive'}.get(target_level, target_level)
+        if target_level not in OpportunityEngine.target_sigmas:
+            raise ValueError("Unknown target level: " + str(target_level))
+        return target_level
+
+    @staticmethod
+    def target_sigma(target_level) -> float | np.ndarray:
+        """
+        Standard deviations above the median (below it for the cooling change-point) to aim for:
+        a level name or saving target 1-3, a custom multiplier, or a sequence of these.
+        """
+        if isinstance(target_level, (list, tuple, np.ndarray, pd.Index, pd.Series)):
+            return np.array([OpportunityEngine.target_sigma(level) for level in target_level])
+        if isinstance(target_level, float):
+            return target_level
+        return OpportunityEngine.target_sigmas[OpportunityEngine.normalize_target_level(target_level)]
+
+    @staticmethod
+    def targets(site_coefficients: dict[str, npt.ArrayLike],
+                benchmark_stats: dict[str, dict[str, float]],
+                target_level: Literal['conservative', 'nominal', 'aggressive'] | float | npt.ArrayLike
+                ) -> dict[str, np.ndarray]:
+        """
+        Target coefficients for arrays of site coefficients, by coefficient type. See target_sigma
+        for target_level; several levels broadcast against the site coefficients, e.g. site
+        coefficients of shape (N, 1) and S levels give (N, S) targets. Missing site coefficients
+        get a NaN target.
+        """
+        sigma = OpportunityEngine.target_sigma(target_level)
+        d_targets = {}
+        for coefficient_name, site in site_coefficients.items():
+            site = np.asarray(site, dtype=float)
+            median = benchmark_stats[coefficient_name]['beta_median']
+            standard_deviation = benchmark_stats[coefficient_name]['beta_standard_deviation']
+            if coefficient_name == 'beta_betc':
+                target = np.maximum(median - sigma * standard_deviation, site)
+            else:
+                target = np.minimum(median + sigma * standard_deviation, site)
+            d_targets[coefficient_name] = np.where(np.isnan(site), np.nan, target)
+        return d_targets
+
+    @staticmethod
+    def savings_targets(site_coefficients: dict[str, npt.ArrayLike],
+                        targets: dict[str, npt.ArrayLike]) -> dict[str, np.ndarray]:
+        """
+        Coefficients of the improved building: the target where the site coefficient is worse,
+        the site coefficient otherwise (a higher cooling change-point is better)
+        """
+        d_savings = {}
+        for coefficient_name, site in site_coefficients.items():
+            site = np.asarray(site, dtype=float)
+            target = np.asarray(targets[coefficient_name], dtype=float)
+            with np.errstate(invalid='ignore'):
+                worse = site > target
+            if coefficient_name == 'beta_betc':
+                d_savings[coefficient_name] = np.where(worse, site, target)
+            else:
+                d_savings[coefficient_name] = np.where(worse, target, site)
+        return d_savings
+
+    @staticmethod
+    def model_parameters(coefficients: dict[str, npt.ArrayLike]) -> np.ndarray:
+        """Change-point model parameters (hcp, ccp, base, hsl, csl) on the last axis, see InverseModel.model_p"""
+        hcp, ccp, base, hdd, cdd = np.broadcast_arrays(
+            *(np.asarray(coefficients[k], dtype=float)
+              for k in ('beta_beth', 'beta_betc', 'beta_base', 'beta_hdd', 'beta_cdd')))
+        return np.stack([hcp, ccp, base, -hdd, cdd], axis=-1)
+
+    @staticmethod
+    def evaluate_rules(site_coefficients: dict[str, npt.ArrayLike],
+                       targets: dict[str, npt.ArrayLike],
+                       utility_type: npt.ArrayLike) -> dict[str, np.ndarray]:
+        """
+        Evaluates the rules table for arrays of site coefficients and their targets, one entry
+        per building, with the utility type of each building (1 or 2). Returns a boolean array
+        per measure. Comparisons with missing coefficients are False.
+        """
+        utility_type = np.asarray(utility_type)
+        d_conditions = {}
+        with np.errstate(invalid='ignore'):
+            for condition, (coefficient_name, test, threshold, positive_only) in \
+                    OpportunityEngine.conditions.items():
+                site = np.asarray(site_coefficients[coefficient_name], dtype=float)
+                target = np.asarray(targets[coefficient_name], dtype=float)
+                if test != 'above' and OpportunityEngine.override_threshold:
+                    threshold = OpportunityEngine.override_value
+                if test == 'high':
+                    mask = (site - target) >= threshold * target
+                elif test == 'low':
+                    mask = (target - site) >= threshold * target
+                else:
+                    mask = site > threshold
+                if positive_only:
+                    mask &= site > 0
+                d_conditions[condition] = mask
+
+        d_recommendations = {}
+        for measure, conditions, k, rule_utility_type, triggered_by in OpportunityEngine.rules:
+            mask = np.sum([d_conditions[c] for c in conditions], axis=0) >= k
+            if rule_utility_type is not None:
+                mask &= utility_type == rule_utility_type
+            for trigger in triggered_by:
+                mask |= d_recommendations[trigger]
+            d_recommendations[measure] = mask
+        return d_recommendations
+
+    @staticmethod
+    def assess(df_site_coefficients: pd.DataFrame,
+               benchmark_stats: dict[str, dict[str, float]] | pd.DataFrame,
+               utility_type,
+               target_level: Literal['conservative', 'nominal', 'aggressive'] | float = 'nominal'
+               ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Assesses many buildings at once: df_site_coefficients has one row per building and a
+        column per coefficient type; utility_type is one type for all or one per building.
+        Returns the target coefficients and the recommended measures (booleans), both indexed
+        like df_site_coefficients.
+        """
+        if isinstance(benchmark_stats, pd.DataFrame):
+            benchmark_stats = benchmark_stats.to_dict('index')
+        v_utility_type = np.vectorize(OpportunityEngine.normalize_utility_type, otypes=[int])(
+            np.broadcast_to(np.asarray(utility_type, dtype=object), len(df_site_coefficients)))
+        site_coefficients = {c: df_site_coefficients[c].to_numpy(dtype=float)
+                             for c in OpportunityEngine.coefficient_types}
+        # Same adaptation of the model coefficients as in the constructor
+        v_single_change_point = site_coefficients['beta_betc'] == site_coefficients['beta_beth']
+        for slope, change_point in (('beta_cdd', 'beta_betc'), ('beta_hdd', 'beta_beth')):
+            v_unused = v_single_change_point & (site_coefficients[slope] == 0)
+            site_coefficients[slope] = np.where(v_unused, np.nan, site_coefficients[slope])
+            site_coefficients[change_point] = np.where(v_unused, np.nan, site_coefficients[change_point])
+        d_targets = OpportunityEngine.targets(site_coefficients, benchmark_stats, target_level)
+        d_recommendations = OpportunityEngine.evaluate_rules(site_coefficients, d_targets, v_utility_type)
+        return (pd.DataFrame(d_targets, index=df_site_coefficients.index),
+                pd.DataFrame(d_recommendations, index=df_site_coefficients.index))
+
+    def site_coefficients(self) -> dict[str, np.ndarray]:
+        return {k: np.array([v['site_coefficient']], dtype=float) for k, v in self.benchmark_stats.items()}
+
     def set_targets(self, target_level: Literal['conservative', 'nominal', 'aggressive']):
         """Set Targets for Opportunity Engine"""
 
@@ -44,41 +238,9 @@ class OpportunityEngine:
         [print(k, v['site_coefficient'])
          for k, v in self.benchmark_stats.items()]
 
-        if target_level == 'conservative':
-            # Target is 1 standard deviation above the median for each coefficient
-            for coefficient_name, coefficient_values in self.benchmark_stats.items():
-                if np.isnan(coefficient_values['site_coefficient']):
-                    self.benchmark_stats[coefficient_name]['target'] = np.nan
-                elif coefficient_name == 'beta_betc':
-                    self.benchmark_stats[coefficient_name]['target'] = max(coefficient_values['beta_median'] - coefficient_values['beta_standard_deviation'],
-                                                                           coefficient_values['site_coefficient'])
-                else:
-                    self.benchmark_stats[coefficient_name]['target'] = min(coefficient_values['beta_median'] + coefficient_values['beta_standard_deviation'],
-                                                                           coefficient_values['site_coefficient'])
-
-        elif target_level == 'nominal':
-            # Target is the median for each coefficient
-            for coefficient_name, coefficient_values in self.benchmark_stats.items():
-                if np.isnan(coefficient_values['site_coefficient']):
-                    self.benchmark_stats[coefficient_name]['target'] = np.nan
-                elif coefficient_name == 'beta_betc':
-                    self.benchmark_stats[coefficient_name]['target'] = max(coefficient_values['beta_median'],
-                                                                           coefficient_values['site_coefficient'])
-                else:
-                    self.benchmark_stats[coefficient_name]['target'] = min(coefficient_values['beta_median'],
-                                                                           coefficient_values['site_coefficient'])
-
-        elif target_level == 'aggressive':
-            # Target is half a standard deviation below the median for each coefficient
-            for coefficient_name, coefficient_values in self.benchmark_stats.items():
-                if np.isnan(coefficient_values['site_coefficient']):
-                    self.benchmark_stats[coefficient_name]['target'] = np.nan
-                elif coefficient_name == 'beta_betc':
-                    self.benchmark_stats[coefficient_name]['target'] = max(coefficient_values['beta_median'] + 0.5 * coefficient_values['beta_standard_deviation'],
-                                                                           coefficient_values['site_coefficient'])
-                else:
-                    self.benchmark_stats[coefficient_name]['target'] = min(coefficient_values['beta_median'] - 0.5 * coefficient_values['beta_standard_deviation'],
-                                                                           coefficient_values['site_coefficient'])
+        d_targets = self.targets(self.site_coefficients(), self.benchmark_stats, target_level)
+        for coefficient_name, target in d_targets.items():
+            self.benchmark_stats[coefficient_name]['target'] = float(target[0])
 
         self.base_targ = self.benchmark_stats['beta_base']['target']
         self.cdd_targ = self.benchmark_stats['beta_cdd']['target']
@@ -92,243 +254,19 @@ class OpportunityEngine:
         print('---------------------------------------------------------------')
 
     def calculate_recommendations(self) -> dict:
-        # recs = ['Increase Cooling Setpoints', 'Decrease Heating Setpoints',
-        #         'Reduce Equipment Schedules', 'Decrease Ventilation',
-        #         'Eliminate Electric Heating', 'Decrease Infiltration',
-        #         'Reduce Lighting Load', 'Reduce Plug Loads', 'Add/Fix Economizers',
-        #         'Increase Cooling System Efficiency',
-        #         'Increase Heating System Efficiency', 'Add Wall/Ceiling Insulation',
-        #         'Upgrade Windows', 'Check Fossil Baseload']
-
-        self.recommendations = {}
-
-        override_threshold = True
-        override_value = 0.001
-
-        setpoint_recommendation = False  # used for scheduling measure
-
-        # region Increase Cooling Setpoint (indicated by low betc)
-        recommendation_name = 'Increase Cooling Setpoints'
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.betc_targ - self.betc) >= (threshold * self.betc_targ):
-            # used for scheduling measure
-            self.recommendations[recommendation_name] = True
-            setpoint_recommendation = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Decrease Heating Setpoint (indicated by high beth)
-        recommendation_name = 'Decrease Heating Setpoints'
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.beth - self.beth_targ) >= (threshold * self.beth_targ):
-            self.recommendations[recommendation_name] = True
-            setpoint_recommendation = True
-        else:
-            self.recommendations[recommendation_name] = False
-        # endregion
-
-        # region Tighten Schedules (indicated by high electric baseload)
-        """
-        9/20/13 - Added logic to also recommend schedules if recommending
-        increasing cooling setpoints or decreasing heating setpoints. A
-        building's break-even temperature are affected by the average building
-        temperatures (i.e., occupied & unoccupied). That means that adjusting
-        schedules for switching between an occupied and unoccupied setpoint
-        will also change the average building temperatures.
-        """
-        recommendation_name = 'Reduce Equipment Schedules'
-        threshold = override_value if override_threshold else 0.001
-
-        if self.utility_type == 1 and self.base > 0 and (self.base - self.base_targ) >= (threshold * self.base_targ):
-            self.recommendations[recommendation_name] = True
-        elif setpoint_recommendation:
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Decrease Ventilation (indicated by two of the following three: high cdd, high hdd, high beth)
-        recommendation_name = 'Decrease Ventilation'
-        count = 0
-        threshold = override_value if override_threshold else 0.1
-
-        if self.cdd > 0 and (self.cdd - self.cdd_targ) >= (threshold * self.cdd_targ):
-            count += 1
-        if self.hdd > 0 and (self.hdd - self.hdd_targ) >= (threshold * self.hdd_targ):
-            count += 1
-
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.beth - self.beth_targ) >= (threshold * self.beth_targ):
-            count += 1
-
-        self.recommendations[recommendation_name] = count >= 2
-
-        # endregion
-
-        # region Eliminate Any Electric Heating
-        """
-        Before 9/20/2013, electric heating indicated by electric fuel and HDD>0.
-        Added threshold to improve diagnostic and reduce mis-diagnosis of electric
-        heating. It appears that both electric and fossil heating has beta_hdd's
-        around 0.04 kWh/m2 while electric beta_hdd's without electric heating
-        are around 0.004 kWh/m2.
-        """
-        recommendation_name = 'Eliminate Electric Heating'
-        electric_htg_threshold = 0.01
-
-        if self.utility_type == 'electric' and self.hdd > electric_htg_threshold:
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Decrease Infiltration (indicated by two of the following three: high cdd, high hdd, high beth)
-        recommendation_name = 'Decrease Infiltration'
-        count = 0
-        threshold = override_value if override_threshold else 0.1
-
-        if self.cdd > 0 and (self.cdd - self.cdd_targ) >= (threshold * self.cdd_targ):
-            count += 1
-        if self.hdd > 0 and (self.hdd - self.hdd_targ) >= (threshold * self.hdd_targ):
-            count += 1
-
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.beth - self.beth_targ) >= (threshold * self.beth_targ):
-            count = count + 1
-
-        self.recommendations[recommendation_name] = count >= 2
-
-        # endregion
-
-        # region Reduce Lighting Load (indicated by high baseload)
-        recommendation_name = 'Reduce Lighting Load'
-        threshold = override_value if override_threshold else 0.001
-
-        if self.utility_type == 1 and self.base > 0 and (self.base - self.base_targ) >= (threshold * self.base_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Reduce Plug Load (indicated by high baseload)
-        recommendation_name = 'Reduce Plug Loads'
-        threshold = override_value if override_threshold else 0.001
-
-        if self.utility_type == 1 and self.base > 0 and (self.base - self.base_targ) >= (threshold * self.base_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Add/Fix Economizers (indicated by low betc)
-        recommendation_name = 'Add/Fix Economizers'
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.betc_targ - self.betc) >= (threshold * self.betc_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Increase Cooling Efficiency (indicated by high cdd)
-        recommendation_name = 'Increase Cooling System Efficiency'
-        threshold = override_value if override_threshold else 0.1
-
-        if self.cdd > 0 and (self.cdd - self.cdd_targ) >= (threshold * self.cdd_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Increase Heating Efficiency (indicated by high hdd)
-        recommendation_name = 'Increase Heating System Efficiency'
-        threshold = override_value if override_threshold else 0.1
-
-        if self.hdd > 0 and (self.hdd - self.hdd_targ) >= (threshold * self.hdd_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
-        # region Add Wall/Ceiling Insulation (indicated by two of the following three: high cdd, high hdd, high beth)
-        recommendation_name = 'Add Wall/Ceiling Insulation'
-        count = 0
-        threshold = override_value if override_threshold else 0.1
-
-        if self.cdd > 0 and (self.cdd - self.cdd_targ) >= (threshold * self.cdd_targ):
-            count += 1
-        if self.hdd > 0 and (self.hdd - self.hdd_targ) >= (threshold * self.hdd_targ):
-            count += 1
-
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.beth - self.beth_targ) >= (threshold * self.beth_targ):
-            count = count + 1
-
-        self.recommendations[recommendation_name] = count >= 2
-
-        # endregion
-
-        # region Upgrade Windows (indicated by all of the following: high cdd, low betc, high hdd)
-        recommendation_name = 'Upgrade Windows'
-        count = 0
-        threshold = override_value if override_threshold else 0.1
-
-        if self.cdd > 0 and (self.cdd - self.cdd_targ) >= (threshold * self.cdd_targ):
-            count += 1
-        if self.hdd > 0 and (self.hdd - self.hdd_targ) >= (threshold * self.hdd_targ):
-            count += 1
-
-        threshold = override_value if override_threshold else 0.2
-
-        if (self.betc_targ - self.betc) >= (threshold * self.betc_targ):
-            count += 1
-
-        self.recommendations[recommendation_name] = (count == 3)
-
-        # endregion
-
-        # region Check Excessive Fossil Fuel Baseload
-        recommendation_name = 'Check Fossil Baseload'
-        threshold = override_value if override_threshold else 0.001
-
-        if self.utility_type == 2 and self.base > 0 and (self.base - self.base_targ) >= (threshold * self.base_targ):
-            self.recommendations[recommendation_name] = True
-        else:
-            self.recommendations[recommendation_name] = False
-
-        # endregion
-
+        """Measures recommended for the site, see the rules table"""
+        d_targets = {k: np.array([v['target']], dtype=float) for k, v in self.benchmark_stats.items()}
+        d_recommendations = self.evaluate_rules(self.site_coefficients(), d_targets,
+                                                [self.normalize_utility_type(self.utility_type)])
+        self.recommendations = {measure: bool(mask[0]) for measure, mask in d_recommendations.items()}
         return self.recommendations
 
     def savings_coefficients(self) -> dict:
-
-        for coefficient_name, coefficient_values in self.benchmark_stats.items():
-            site_coefficient = coefficient_values['site_coefficient']
-            target = coefficient_values['target']
-
-            if (site_coefficient > target):
-                if (coefficient_name == 'beta_betc'):
-                    coefficient_values['savings_coefficient'] = site_coefficient
-                else:
-                    coefficient_values['savings_coefficient'] = target
-            else:
-                if (coefficient_name == 'beta_betc'):
-                    coefficient_values['savings_coefficient'] = target
-                else:
-                    coefficient_values['savings_coefficient'] = site_coefficient
+        """Sets the savings_coefficient of each coefficient type, see savings_targets"""
+        d_savings = self.savings_targets(
+            self.site_coefficients(),
+            {k: np.array([v['target']], dtype=float) for k, v in self.benchmark_stats.items()})
+        for coefficient_name, savings in d_savings.items():
+            self.benchmark_stats[coefficient_name]['savings_coefficient'] = float(savings[0])
 
         return self.benchmark_stats
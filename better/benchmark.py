@@ -11,8 +11,7 @@ from typing import Literal
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
-# import scipy.stats as st
-# import copy
+from scipy import special
 
 
 class Benchmark:
@@ -78,49 +77,100 @@ class Benchmark:
     def median_absolute_deviation(v_data: npt.ArrayLike):
         return np.nanmedian(abs(v_data - np.nanmedian(v_data)))  # type: ignore
 
-    # @staticmethod
-    # def standardize_target(benchmark):
-    #     # Standardize the distribution before plotting
-    #     if (benchmark.sample_STD != 0):
-    #         standard_x = (benchmark.sample_median -
-    #                       benchmark.model_coefficient) / benchmark.sample_STD
-    #     else:
-    #         standard_x = benchmark.sample_median
-    #     if (benchmark.model_coefficient_type == 'beta_betc'):
-    #         standard_x *= -1
-    #     # When the target building is extremely high or low in the distribution
-    #     if (standard_x < -3.45):
-    #         standard_x = -3.45
-    #     if (standard_x > 3.45):
-    #         standard_x = 3.45
-    #     return (standard_x)
-
-    # @staticmethod
-    # def generate_benchmark_bar_html(benchmark):
-    #     coeff_str_dict = {'beta_hdd': 'Heating Sensitivity',
-    #                       'beta_beth': 'Heating Change-point',
-    #                       'beta_base': 'Baseload',
-    #                       'beta_betc': 'Cooling Change-point',
-    #                       'beta_cdd': 'Cooling Sensitivity'}
-    #     if (hasattr(benchmark, 'model_coefficient_type') and benchmark.valid):
-    #         coeff_type = coeff_str_dict[benchmark.model_coefficient_type]
-    #         standard_z_score = Benchmark.standardize_target(benchmark)
-    #         percent = int(round(st.norm.cdf(standard_z_score) * 100, 0))
-    #         bench_bar_html = ''
-    #         bench_bar_html += '<div class="w3-row">'
-    #         bench_bar_html += '  <div class="w3-third">'
-    #         bench_bar_html += '    <p style="margin:0px"><b>' + \
-    #             coeff_type + '</b> <br/> (' + benchmark.rating_str + ')</p>'
-    #         bench_bar_html += '  </div>'
-    #         bench_bar_html += '  <div class="w3-twothird">'
-    #         if percent < 85:
-    #             bench_bar_html += '    <div class="benchmark_bar w3-round-xlarge"><div class="vertical_line"style="left:' + str(
-    #                 percent) + '%;"><div class="w3-container w3-padding w3-center">' + str(percent) + '%</div></div></div>'
-    #         else:
-    #             bench_bar_html += '    <div class="benchmark_bar w3-round-xlarge"><div class="vertical_line"style="left:' + str(
-    #                 percent) + '%;"><div class="w3-container w3-padding w3-right">' + str(percent) + '%</div></div></div>'
-    #         bench_bar_html += '  </div>'
-    #         bench_bar_html += '</div>'
-    #     else:
-    #         bench_bar_html = ''
-    #     return bench_bar_html
+    # Coefficient types in the column order of coefficient tables
+    coefficient_types = ['beta_hdd', 'beta_beth', 'beta_base', 'beta_betc', 'beta_cdd']
+    coefficient_names = {'beta_hdd': 'Heating Sensitivity',
+                         'beta_beth': 'Heating Change-point',
+                         'beta_base': 'Baseload',
+                         'beta_betc': 'Cooling Change-point',
+                         'beta_cdd': 'Cooling Sensitivity'}
+    rating_strings = np.array(['Good', 'Typical', 'Poor', ''], dtype=object)
+
+    @staticmethod
+    def rate(model_coefficients: npt.ArrayLike,
+             sample_median: npt.ArrayLike,
+             sample_standard_deviation: npt.ArrayLike,
+             model_coefficient_valid: npt.ArrayLike = True,
+             model_coefficient_types: list[str] = coefficient_types
+             ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Benchmarks any number of coefficients at once. The last axis of model_coefficients
+        follows model_coefficient_types, e.g. (buildings, 5) or (buildings, fuels, 5); the
+        sample statistics and validity broadcast against it.
+
+        Returns, with the shape of model_coefficients:
+        rating: -1 good, 0 typical, 1 poor, as in Benchmark; NaN if invalid or missing
+        rating_str: 'Good', 'Typical', 'Poor'; '' if invalid or missing
+        percentile: share of peers (%) the coefficient does better than, assuming normally
+            distributed peers and capped at z = +/-3.45; NaN if invalid or missing
+        """
+        model_coefficients = np.asarray(model_coefficients, dtype=float)
+        sample_median = np.asarray(sample_median, dtype=float)
+        sample_standard_deviation = np.asarray(sample_standard_deviation, dtype=float)
+        # A higher cooling change-point is better, unlike the other coefficients
+        direction = np.where(np.asarray(model_coefficient_types) == 'beta_betc', -1, 1)
+        valid = (np.asarray(model_coefficient_valid, dtype=bool) & ~np.isnan(model_coefficients) &
+                 ~np.isnan(sample_median) & ~np.isnan(sample_standard_deviation))
+
+        rating = np.where(model_coefficients < sample_median - sample_standard_deviation, -1,
+                          np.where(model_coefficients > sample_median + sample_standard_deviation, 1, 0))
+        rating = np.where(sample_standard_deviation == 0, 0, rating * direction)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z_score = np.where(sample_standard_deviation == 0, 0,
+                               (sample_median - model_coefficients) / sample_standard_deviation)
+        percentile = np.round(special.ndtr(np.clip(z_score * direction, -3.45, 3.45)) * 100)
+
+        rating_str = Benchmark.rating_strings[np.where(valid, rating + 1, 3)]
+        return (np.where(valid, rating, np.nan),
+                rating_str,
+                np.where(valid, percentile, np.nan))
+
+    @staticmethod
+    def benchmark_table(df_coefficients: pd.DataFrame,
+                        df_benchmark_stats: pd.DataFrame,
+                        df_valid: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        Benchmarks a table of coefficients, one row per building and one column per coefficient
+        type, against peer statistics indexed by coefficient type (beta_median and
+        beta_standard_deviation columns, as from Portfolio.generate_benchmark_stats). df_valid
+        flags the coefficients to benchmark, all by default. Returns one row per building and
+        coefficient type with the coefficient, its rating, rating string and percentile.
+        """
+        v_types = [t for t in Benchmark.coefficient_types if t in df_coefficients.columns]
+        model_coefficients = df_coefficients[v_types].to_numpy(dtype=float)
+        valid = True if df_valid is None else df_valid[v_types].to_numpy(dtype=bool)
+        df_stats = df_benchmark_stats.reindex(v_types)
+        rating, rating_str, percentile = Benchmark.rate(
+            model_coefficients,
+            df_stats['beta_median'].to_numpy(dtype=float),
+            df_stats['beta_standard_deviation'].to_numpy(dtype=float),
+            valid, v_types)
+        index = pd.MultiIndex.from_product([df_coefficients.index, v_types],
+                                           names=[df_coefficients.index.name, 'coefficient'])
+        return pd.DataFrame({'model_coefficient': model_coefficients.ravel(),
+                             'rating': rating.ravel(),
+                             'rating_str': rating_str.ravel(),
+                             'percentile': percentile.ravel()}, index=index)
+
+    @staticmethod
+    def generate_benchmark_bar_html(model_coefficient_type: str,
+                                    rating_str: str,
+                                    percentile: float) -> str:
+        """HTML bar of a benchmarked coefficient for the building report; '' if not benchmarked"""
+        if not rating_str or np.isnan(percentile):
+            return ''
+        percent = int(percentile)
+        # Keep the label inside the bar near its right end
+        align = 'w3-center' if percent < 85 else 'w3-right'
+        bench_bar_html = ''
+        bench_bar_html += '<div class="w3-row">'
+        bench_bar_html += '  <div class="w3-third">'
+        bench_bar_html += '    <p style="margin:0px"><b>' + \
+            Benchmark.coefficient_names[model_coefficient_type] + '</b> <br/> (' + rating_str + ')</p>'
+        bench_bar_html += '  </div>'
+        bench_bar_html += '  <div class="w3-twothird">'
+        bench_bar_html += '    <div class="benchmark_bar w3-round-xlarge"><div class="vertical_line"style="left:' + str(
+            percent) + '%;"><div class="w3-container w3-padding ' + align + '">' + str(percent) + '%</div></div></div>'
+        bench_bar_html += '  </div>'
+        bench_bar_html += '</div>'
+        return bench_bar_html
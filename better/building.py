@@ -11,20 +11,33 @@ NOTICE.  This Software was developed under funding from the U.S. Department of E
 
 from typing import Literal
 from better.model import InverseModel
+from better.cache import ModelCache
 from better.benchmark import Benchmark
 from better.constants import Constants
 from better.assessment import OpportunityEngine
-from better.weather import Weather
+from better.weather import Weather, WeatherPrefetch
 from better.utility import Utility
+from better.geocoding import Geocoder
+import better.geocoding as geocoding
 
 import pandas as pd
 import numpy as np
-import geocoder
+from numpy import typing as npt
 import copy
 
 
 class Building:
-    """Saving target 1 is Conservative. 2 is Nominal. 3 is Aggressive."""
+    """
+    Saving target 1 is Conservative. 2 is Nominal. 3 is Aggressive.
+
+    The address is geocoded, and weather added with add_weather or add_nearest_weather is
+    loaded, only when first needed, e.g. by fit_inverse_model. Pass coord to skip geocoding.
+    Note that hasattr(building, 'weather_electricity') loads pending weather, which may geocode
+    and download; has_weather tells whether there is weather without loading it.
+    """
+
+    # Attributes set by geocode_address on first access
+    geocoded_attributes = ('geo_coder', 'coord', 'latitude', 'longitude', 'geo_address')
 
     def __init__(self,
                  bldg_id: str | int,
@@ -33,7 +46,9 @@ class Building:
                  bldg_type: Literal['Office'],
                  bldg_area: float,
                  currency: str = 'US Dollar',
-                 saving_target: int = 2):
+                 saving_target: int = 2,
+                 geocoder: Geocoder | None = None,
+                 coord: list[float] | None = None):
         self.bldg_id: str | int = bldg_id
         self.bldg_name: str = bldg_name
         self.bldg_address: str = bldg_address
@@ -41,7 +56,15 @@ class Building:
         self.bldg_area: float = round(bldg_area, 1)
         self.currency: str = currency
 
-        self.geocode_address()
+        self.geocoder = geocoder
+        # Weather to load on first access by attribute name, see add_weather. Plain
+        # (kind, utility attribute, ...) tuples, so that the building can be pickled.
+        self.weather_sources = {}
+        if coord is not None:
+            self.geo_coder = None
+            self.coord: list[float] = list(coord)
+            self.latitude, self.longitude = self.coord
+            self.geo_address: str = self.bldg_address
 
         self.saving_target = saving_target
         if (saving_target == 1):
@@ -51,19 +74,31 @@ class Building:
         else:
             self.saving_target_str = 'Aggressive'
 
-    def geocode_address(self):
+    def __getattr__(self, name):
+        # Only called for attributes that are not set (yet): resolve the lazy ones
+        d_attributes = self.__dict__
+        if name in Building.geocoded_attributes and 'bldg_address' in d_attributes:
+            self.geocode_address(d_attributes.get('geocoder'))
+            return d_attributes[name]
+        if name in d_attributes.get('weather_sources', {}):
+            try:
+                source = d_attributes['weather_sources'].pop(name)
+                d_attributes[name] = self.load_weather_source(*source)
+            except AttributeError as error:
+                # Do not let hasattr(building, name) mistake a failure for missing weather
+                raise RuntimeError("Loading " + name + " failed") from error
+            return d_attributes[name]
+        raise AttributeError("'Building' object has no attribute '" + name + "'")
+
+    def geocode_address(self, geocoder: Geocoder | None = None):
+        """Resolves the address with geocoder, by default the shared geocoding.default_geocoder"""
         # Note: google API might not be accessible in China
         # Change the geocoder to Baidu or other Chinese search engine for Chinese tool
-        try:
-            # Try different geocoders: Google -> ArcGIS -> Bing -> Baidu
-            self.geo_coder = geocoder.google(self.bldg_address)
-            if (self.geo_coder.latlng is None):
-                self.geo_coder = geocoder.arcgis(self.bldg_address)
-            if (self.geo_coder.latlng is None):
-                self.geo_coder = geocoder.bing(self.bldg_address)
-            if (self.geo_coder.latlng is None):
-                self.geo_coder = geocoder.baidu(self.bldg_address)
-        except:
+        # Geocoder tries Google -> ArcGIS -> Bing -> Baidu, then its offline gazetteer if any
+        if geocoder is None:
+            geocoder = geocoding.default_geocoder
+        self.geo_coder = geocoder.resolve(self.bldg_address)
+        if self.geo_coder is None:
             raise Exception("Try another geocoder provider")
 
         self.coord: list[float] = self.geo_coder.latlng
@@ -75,38 +110,112 @@ class Building:
                     utility_f: Utility | None = None) -> None:
 
         if (utility_e is not None):
-            self.utility_electricity: Utility = copy.deepcopy(utility_e)
+            self.utility_electricity: Utility = self.copy_utility(utility_e)
             if (hasattr(self.utility_electricity, "df_raw_data")):
                 self.utility_electricity.process()
 
         if (utility_f is not None):
-            self.utility_fossil_fuel: Utility = copy.deepcopy(utility_f)
+            self.utility_fossil_fuel: Utility = self.copy_utility(utility_f)
             if (hasattr(self.utility_fossil_fuel, "df_raw_data")):
                 self.utility_fossil_fuel.process()
 
+    @staticmethod
+    def copy_utility(utility: Utility) -> Utility:
+        """Copy that Utility.process can work on without touching the caller's utility"""
+        utility = copy.copy(utility)
+        if hasattr(utility, "df_raw_data"):
+            # process rewrites the bill table in place, the rest is only rebound
+            utility.df_raw_data = utility.df_raw_data.copy()
+        return utility
+
     def add_weather(self,
                     weather_e: Weather | None = None,
                     weather_f: Weather | None = None,
-                    cached: bool = False):
-        """Cached: True ~ pre-downloaded weather dat, False ~ download the weather on the go"""
-
-        if (weather_e is not None and hasattr(self.utility_electricity, "df_raw_data")):
-            self.weather_electricity: Weather = copy.deepcopy(weather_e)
-            self.weather_electricity.process(
-                self.utility_electricity.df_periods)
-            if cached:
-                self.weather_electricity.use_downloaded_weather()
-            else:
-                self.weather_electricity.download_weather_NOAA()
-
-        if (weather_f is not None and hasattr(self.utility_fossil_fuel, "df_raw_data")):
-            self.weather_fossil_fuel: Weather = copy.deepcopy(weather_f)
-            self.weather_fossil_fuel.process(
-                self.utility_fossil_fuel.df_periods)
-            if cached:
-                self.weather_fossil_fuel.use_downloaded_weather()
-            else:
-                self.weather_fossil_fuel.download_weather_NOAA()
+                    cached: bool = False,
+                    temperatures_e_F: npt.ArrayLike | None = None,
+                    temperatures_f_F: npt.ArrayLike | None = None):
+        """
+        Cached: True ~ pre-downloaded weather dat, False ~ download the weather on the go.
+        temperatures_e_F/temperatures_f_F are precomputed billing period temperatures (F), one
+        per processed bill, used instead of weather_e/weather_f. The weather is loaded when
+        weather_electricity/weather_fossil_fuel is first accessed, and only for utilities
+        with data.
+        """
+        for attribute, utility_attribute, weather, temperatures_F in (
+                ('weather_electricity', 'utility_electricity', weather_e, temperatures_e_F),
+                ('weather_fossil_fuel', 'utility_fossil_fuel', weather_f, temperatures_f_F)):
+            utility = self.__dict__.get(utility_attribute)
+            if not hasattr(utility, "df_raw_data"):
+                continue
+            if temperatures_F is not None:
+                self.bind_weather(attribute, ('temperatures', utility_attribute, temperatures_F))
+            elif weather is not None:
+                self.bind_weather(attribute, ('weather', utility_attribute, weather, cached))
+
+    def add_nearest_weather(self,
+                            cached: bool = False,
+                            weather_prefetch: WeatherPrefetch | None = None):
+        """
+        Like add_weather, with the weather of the stations nearest to the building. The address
+        is only geocoded when the weather is loaded.
+        """
+        for attribute, utility_attribute in (('weather_electricity', 'utility_electricity'),
+                                             ('weather_fossil_fuel', 'utility_fossil_fuel')):
+            utility = self.__dict__.get(utility_attribute)
+            if hasattr(utility, "df_raw_data"):
+                self.bind_weather(attribute, ('nearest', utility_attribute, cached, weather_prefetch))
+
+    def plan_nearest_weather(self,
+                             weather_prefetch: WeatherPrefetch) -> None:
+        """
+        Plans the station-years add_nearest_weather(weather_prefetch=weather_prefetch) will
+        load, so that a batch can download them for all its buildings at once
+        """
+        weather = None
+        for utility_attribute in ('utility_electricity', 'utility_fossil_fuel'):
+            utility = self.__dict__.get(utility_attribute)
+            if hasattr(utility, "df_raw_data"):
+                if weather is None:
+                    weather = Weather(self.coord, weather_prefetch=weather_prefetch)
+                weather_prefetch.plan_weather(weather, utility.df_periods)
+
+    def bind_weather(self, attribute: str, source: tuple) -> None:
+        """Sets the weather attribute to be loaded from source when it is first accessed"""
+        self.__dict__.pop(attribute, None)
+        self.weather_sources[attribute] = source
+
+    def has_weather(self, attribute: str) -> bool:
+        """Whether the weather attribute is loaded or pending, without loading it"""
+        return attribute in self.__dict__ or attribute in self.__dict__.get('weather_sources', {})
+
+    def load_weather_source(self,
+                            kind: Literal['temperatures', 'weather', 'nearest'],
+                            utility_attribute: str,
+                            *args) -> Weather:
+        """Loads the weather of a source set by add_weather or add_nearest_weather"""
+        utility = self.__dict__[utility_attribute]
+        if kind == 'temperatures':
+            temperatures_F, = args
+            return Weather.from_temperatures(temperatures_F, utility.df_periods)
+        if kind == 'weather':
+            weather, cached = args
+            # Weather.process only rebinds attributes, so a shallow copy keeps the caller's
+            # weather intact while sharing its station data
+            return self.load_weather(copy.copy(weather), utility, cached)
+        cached, weather_prefetch = args
+        return self.load_weather(Weather(self.coord, weather_prefetch=weather_prefetch),
+                                 utility, cached)
+
+    @staticmethod
+    def load_weather(weather: Weather,
+                     utility: Utility,
+                     cached: bool) -> Weather:
+        weather.process(utility.df_periods)
+        if cached:
+            weather.use_downloaded_weather()
+        else:
+            weather.download_weather_NOAA()
+        return weather
 
     def pre_process(self) -> None:
         """Calculate summary energy, cost, and EUI as well as monthly EUI for utility data"""
@@ -144,8 +253,9 @@ class Building:
             self.annual_eui_fossil_fuel = round(
                 self.eui_daily_all_periods_fossil_fuel * Constants.days_in_year, 2)
 
-    def fit_inverse_model(self):
-        """Fit inverse model for building"""
+    def fit_inverse_model(self,
+                          model_cache: ModelCache | None = None):
+        """Fit inverse model for building, reusing cached fits when a ModelCache is given"""
 
         # Pre-processing
         self.pre_process()
@@ -153,19 +263,27 @@ class Building:
 
         # Fit change-point model for electricity consumption
         print('Fitting electricity model...')
-        if (hasattr(self, "weather_electricity")):
+        if (self.has_weather("weather_electricity")):
             self.im_electricity = InverseModel(self.weather_electricity.v_T_C,
                                                self.eui_daily_electricity)
-            has_fit_e = self.im_electricity.fit_model()
+            if model_cache is not None:
+                self.im_electricity = model_cache.fit_model(self.im_electricity)
+                has_fit_e = self.im_electricity.has_fit
+            else:
+                has_fit_e = self.im_electricity.fit_model()
             # if (has_fit_e):
             #     self.im_electricity.plot_IM(self)
 
         # Fit change-point model for fossil fuel consumption
         print('Fitting fossil fuel model...')
-        if (hasattr(self, "weather_fossil_fuel")):
+        if (self.has_weather("weather_fossil_fuel")):
             self.im_fossil_fuel = InverseModel(self.weather_fossil_fuel.v_T_C,
                                                self.eui_daily_fossil_fuel)
-            has_fit_f = self.im_fossil_fuel.fit_model()
+            if model_cache is not None:
+                self.im_fossil_fuel = model_cache.fit_model(self.im_fossil_fuel)
+                has_fit_f = self.im_fossil_fuel.has_fit
+            else:
+                has_fit_f = self.im_fossil_fuel.fit_model()
             # if (has_fit_f):
             #     self.im_fossil_fuel.plot_IM(self)
 
@@ -174,9 +292,12 @@ class Building:
     def benchmark(self,
                   use_default: bool = True,
                   df_benchmark_stats_electricity: pd.DataFrame | None = None,
-                  df_benchmark_stats_fossil_fuel: pd.DataFrame | None = None) -> None:
+                  df_benchmark_stats_fossil_fuel: pd.DataFrame | None = None,
+                  render_html: bool = True) -> None:
         """
-        Adds Benchmark instances for the current Building instance
+        Benchmarks the fitted model coefficients of the building against the peer statistics.
+        Sets df_benchmark_e/df_benchmark_f (see Benchmark.benchmark_table, None without a model)
+        and, with render_html, the HTML bars of the building report.
         """
 
         print("Start benchamrking")
@@ -187,185 +308,79 @@ class Building:
             df_sample_bench_stats_e = df_benchmark_stats_electricity
             df_sample_bench_stats_f = df_benchmark_stats_fossil_fuel
 
-        if (hasattr(self, "im_electricity") and hasattr(self.im_electricity, "coeffs")):
-            # Electricity
-            self.benchmark_HSL_e = Benchmark('beta_hdd',
-                                             self.im_electricity.coeffs['hsl'],
-                                             df_benchmark_stats=df_sample_bench_stats_e,
-                                             model_coefficient_valid=self.im_electricity.coeff_validation['hsl'])
-            self.benchmark_HCP_e = Benchmark('beta_beth',
-                                             self.im_electricity.coeffs['hcp'],
-                                             df_benchmark_stats=df_sample_bench_stats_e,
-                                             model_coefficient_valid=self.im_electricity.coeff_validation['hcp'])
-            self.benchmark_BASE_e = Benchmark('beta_base',
-                                              self.im_electricity.coeffs['base'],
-                                              df_benchmark_stats=df_sample_bench_stats_e,
-                                              model_coefficient_valid=self.im_electricity.coeff_validation['base'])
-            self.benchmark_CCP_e = Benchmark('beta_betc',
-                                             self.im_electricity.coeffs['ccp'],
-                                             df_benchmark_stats=df_sample_bench_stats_e,
-                                             model_coefficient_valid=self.im_electricity.coeff_validation['ccp'])
-            self.benchmark_CSL_e = Benchmark('beta_cdd',
-                                             self.im_electricity.coeffs['csl'],
-                                             df_benchmark_stats=df_sample_bench_stats_e,
-                                             model_coefficient_valid=self.im_electricity.coeff_validation['csl'])
-            self.benchmark_HSL_e.benchmark(plot=False)
-            self.benchmark_HCP_e.benchmark(plot=False)
-            self.benchmark_BASE_e.benchmark(plot=False)
-            self.benchmark_CCP_e.benchmark(plot=False)
-            self.benchmark_CSL_e.benchmark(plot=False)
-        else:
-            self.benchmark_HSL_e = None
-            self.benchmark_HCP_e = None
-            self.benchmark_BASE_e = None
-            self.benchmark_CCP_e = None
-            self.benchmark_CSL_e = None
-        if (hasattr(self, "im_fossil_fuel") and hasattr(self.im_fossil_fuel, "coeffs")):
-            # Need to add default fossil fuel in the constants module !!!
-            # Default benchmark stats will be used is no specific benchmark stats are provided
-            # Fossil fuel
-            self.benchmark_HSL_f = Benchmark('beta_hdd',
-                                             self.im_fossil_fuel.coeffs['hsl'],
-                                             df_benchmark_stats=df_sample_bench_stats_f,
-                                             model_coefficient_valid=self.im_fossil_fuel.coeff_validation['hsl'])
-            self.benchmark_HCP_f = Benchmark('beta_beth',
-                                             self.im_fossil_fuel.coeffs['hcp'],
-                                             df_benchmark_stats=df_sample_bench_stats_f,
-                                             model_coefficient_valid=self.im_fossil_fuel.coeff_validation['hcp'])
-            self.benchmark_BASE_f = Benchmark('beta_base',
-                                              self.im_fossil_fuel.coeffs['base'],
-                                              df_benchmark_stats=df_sample_bench_stats_f,
-                                              model_coefficient_valid=self.im_fossil_fuel.coeff_validation['base'])
-            self.benchmark_CCP_f = Benchmark('beta_betc',
-                                             self.im_fossil_fuel.coeffs['ccp'],
-                                             df_benchmark_stats=df_sample_bench_stats_f,
-                                             model_coefficient_valid=self.im_fossil_fuel.coeff_validation['ccp'])
-            self.benchmark_CSL_f = Benchmark('beta_cdd',
-                                             self.im_fossil_fuel.coeffs['csl'],
-                                             df_benchmark_stats=df_sample_bench_stats_f,
-                                             model_coefficient_valid=self.im_fossil_fuel.coeff_validation['csl'])
-            self.benchmark_HSL_f.benchmark(plot=False)
-            self.benchmark_HCP_f.benchmark(plot=False)
-            self.benchmark_BASE_f.benchmark(plot=False)
-            self.benchmark_CCP_f.benchmark(plot=False)
-            self.benchmark_CSL_f.benchmark(plot=False)
-        else:
-            self.benchmark_HSL_f = None
-            self.benchmark_HCP_f = None
-            self.benchmark_BASE_f = None
-            self.benchmark_CCP_f = None
-            self.benchmark_CSL_f = None
-
-        # Plot benchmark html sections
-        self.benchmarking_bar_hsl_e_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_HSL_e)
-        self.benchmarking_bar_hcp_e_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_HCP_e)
-        self.benchmarking_bar_base_e_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_BASE_e)
-        self.benchmarking_bar_ccp_e_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_CCP_e)
-        self.benchmarking_bar_csl_e_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_CSL_e)
-
-        self.benchmarking_bar_hsl_f_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_HSL_f)
-        self.benchmarking_bar_hcp_f_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_HCP_f)
-        self.benchmarking_bar_base_f_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_BASE_f)
-        self.benchmarking_bar_ccp_f_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_CCP_f)
-        self.benchmarking_bar_csl_f_html = Benchmark.generate_benchmark_bar_html(
-            self.benchmark_CSL_f)
+        self.df_benchmark_e = self.benchmark_model(
+            self.__dict__.get('im_electricity'), df_sample_bench_stats_e)
+        # Need to add default fossil fuel in the constants module !!!
+        # Default benchmark stats will be used is no specific benchmark stats are provided
+        self.df_benchmark_f = self.benchmark_model(
+            self.__dict__.get('im_fossil_fuel'), df_sample_bench_stats_f)
+
+        if render_html:
+            self.render_benchmark_html()
+
+    # Benchmark coefficient type of each model coefficient
+    benchmark_coefficient_types = {'hsl': 'beta_hdd', 'hcp': 'beta_beth', 'base': 'beta_base',
+                                   'ccp': 'beta_betc', 'csl': 'beta_cdd'}
+
+    def benchmark_model(self,
+                        im: InverseModel | None,
+                        df_benchmark_stats: pd.DataFrame) -> pd.DataFrame | None:
+        """Benchmark.benchmark_table of a fitted model's coefficients, None without a model"""
+        if not hasattr(im, "coeffs"):
+            return None
+        d_types = Building.benchmark_coefficient_types
+        df_coefficients = pd.DataFrame({d_types[k]: [im.coeffs[k]] for k in d_types},
+                                       index=pd.Index([self.bldg_id], name='bldg_id'))
+        df_valid = pd.DataFrame({d_types[k]: [im.coeff_validation[k]] for k in d_types},
+                                index=df_coefficients.index)
+        return Benchmark.benchmark_table(df_coefficients, df_benchmark_stats, df_valid).loc[self.bldg_id]
+
+    def render_benchmark_html(self) -> None:
+        """HTML bars of the benchmarked coefficients for the building report"""
+        for suffix, df_benchmark in (('e', self.df_benchmark_e), ('f', self.df_benchmark_f)):
+            for k, coefficient_type in Building.benchmark_coefficient_types.items():
+                bench_bar_html = ''
+                if df_benchmark is not None:
+                    row = df_benchmark.loc[coefficient_type]
+                    bench_bar_html = Benchmark.generate_benchmark_bar_html(
+                        coefficient_type, row['rating_str'], row['percentile'])
+                setattr(self, 'benchmarking_bar_' + k + '_' + suffix + '_html', bench_bar_html)
 
     def ee_assess(self,
                   use_default: bool = True,
                   df_benchmark_stats_electricity: pd.DataFrame | None = None,
                   df_benchmark_stats_fossil_fuel: pd.DataFrame | None = None):
         """"Assess a building for EE"""
-        # Current building model coefficients
-        if (hasattr(self, "im_electricity") and hasattr(self.im_electricity, "coeffs")):
-            building_coeffs_e = [
-                self.im_electricity.coeffs['base'],
-                self.im_electricity.coeffs['csl'],
-                self.im_electricity.coeffs['ccp'],
-                self.im_electricity.coeffs['hsl'],
-                self.im_electricity.coeffs['hcp']
-            ]
-        else:
-            building_coeffs_e = None
-
-        if (hasattr(self, "im_fossil_fuel") and hasattr(self.im_fossil_fuel, "coeffs")):
-            building_coeffs_f = [
-                self.im_fossil_fuel.coeffs['base'],
-                self.im_fossil_fuel.coeffs['csl'],
-                self.im_fossil_fuel.coeffs['ccp'],
-                self.im_fossil_fuel.coeffs['hsl'],
-                self.im_fossil_fuel.coeffs['hcp']
-            ]
-        else:
-            building_coeffs_f = None
-
         if use_default:
             # Use default benchmarking stats
-            df_assessment_e = copy.deepcopy(
-                Constants.df_sample_benchmark_stats_e)
-            df_assessment_f = copy.deepcopy(
-                Constants.df_sample_benchmark_stats_f)
-        else:
-            df_assessment_e = copy.deepcopy(df_benchmark_stats_electricity)
-            df_assessment_f = copy.deepcopy(df_benchmark_stats_fossil_fuel)
-
-        df_assessment_e["site_coefficients"] = building_coeffs_e
-        df_assessment_f["site_coefficients"] = building_coeffs_f
-
-        # Assess energy efficiency measures
-        if (not pd.isna(df_assessment_e['site_coefficients']).all()):
-            # Assess only if there is an electricity change-point model
-            # (electricity = 1, fossil fuel = 2)
-            FIM_analysis_e = OpportunityEngine(df_assessment_e, 1)
-            # conservative = 1, nominal = 2, aggressive = 3
-            FIM_analysis_e.set_targets(self.saving_target)
-            self.FIM_table_e = FIM_analysis_e.calculate_recommendations(
-                save_file=False)
-            self.coeff_out_e = FIM_analysis_e.savings_coefficients(
-                save_file=False)
-            # Save the suggested new model coefficients
-            df_new_coeffs_e = FIM_analysis_e.savings_coefficients()[
-                'savings_coefficients']
-            self.base_new_e = df_new_coeffs_e['beta_base']
-            self.hsl_new_e = -df_new_coeffs_e['beta_hdd']
-            self.hcp_new_e = df_new_coeffs_e['beta_beth']
-            self.csl_new_e = df_new_coeffs_e['beta_cdd']
-            self.ccp_new_e = df_new_coeffs_e['beta_betc']
-            self.p_new_e = self.hcp_new_e, self.ccp_new_e, self.base_new_e, self.hsl_new_e, self.csl_new_e
-
-            # print(self.p_new_e)
-
-            ls_p = FIM_analysis_e.benchmark_medians.tolist()
-            self.p_typical_e = ls_p[4], ls_p[2], ls_p[0], -ls_p[3], ls_p[1]
-
-        if (not pd.isna(df_assessment_f['site_coefficients']).all()):
-            # Assess only if there is a fossil fuel change-point model
-            # (electricity = 1, fossil fuel = 2)
-            FIM_analysis_f = OpportunityEngine(df_assessment_f, 2)
+            df_benchmark_stats_electricity = Constants.df_sample_benchmark_stats_e
+            df_benchmark_stats_fossil_fuel = Constants.df_sample_benchmark_stats_f
+
+        for suffix, fuel, df_benchmark_stats, utility_type in (
+                ('e', 'electricity', df_benchmark_stats_electricity, 'electric'),
+                ('f', 'fossil_fuel', df_benchmark_stats_fossil_fuel, 'fossil_fuel')):
+            benchmark_stats = self.assessment_stats(self.__dict__.get('im_' + fuel), df_benchmark_stats)
+            # Assess only if there is a change-point model
+            if benchmark_stats is None:
+                continue
+            FIM_analysis = OpportunityEngine(benchmark_stats, utility_type)
             # conservative = 1, nominal = 2, aggressive = 3
-            FIM_analysis_f.set_targets(self.saving_target)
-            self.FIM_table_f = FIM_analysis_f.calculate_recommendations(
-                save_file=False)
-            self.coeff_out_f = FIM_analysis_f.savings_coefficients(
-                save_file=False)
-            df_new_coeffs_f = FIM_analysis_f.savings_coefficients()[
-                'savings_coefficients']
-            self.base_new_f = df_new_coeffs_f['beta_base']
-            self.hsl_new_f = -df_new_coeffs_f['beta_hdd']
-            self.hcp_new_f = df_new_coeffs_f['beta_beth']
-            self.csl_new_f = df_new_coeffs_f['beta_cdd']
-            self.ccp_new_f = df_new_coeffs_f['beta_betc']
-            self.p_new_f = self.hcp_new_f, self.ccp_new_f, self.base_new_f, self.hsl_new_f, self.csl_new_f
-            ls_p = FIM_analysis_f.benchmark_medians.tolist()
-            self.p_typical_f = ls_p[4], ls_p[2], ls_p[0], -ls_p[3], ls_p[1]
+            FIM_analysis.set_targets(self.saving_target)
+            recommendations = FIM_analysis.calculate_recommendations()
+            setattr(self, 'FIM_table_' + suffix, pd.DataFrame(
+                {'FIM Recommendations': ['X' if v else '' for v in recommendations.values()]},
+                index=list(recommendations)))
+            d_coeffs = FIM_analysis.savings_coefficients()
+            setattr(self, 'coeff_out_' + suffix, pd.DataFrame(d_coeffs).T)
+
+            # Save the suggested new model coefficients, and those of a typical building
+            p_new = OpportunityEngine.model_parameters(
+                {k: v['savings_coefficient'] for k, v in d_coeffs.items()})
+            for name, value in zip(('hcp', 'ccp', 'base', 'hsl', 'csl'), p_new):
+                setattr(self, name + '_new_' + suffix, value)
+            setattr(self, 'p_new_' + suffix, tuple(p_new))
+            setattr(self, 'p_typical_' + suffix, tuple(OpportunityEngine.model_parameters(
+                {k: v['beta_median'] for k, v in d_coeffs.items()})))
 
         # Get final fim list
         if (hasattr(self, 'FIM_table_e') and not hasattr(self, 'FIM_table_f')):
@@ -379,9 +394,109 @@ class Building:
             df_FIM.columns = ['FIM Electricity', 'FIM Fossil Fuel']
             df_FIM = df_FIM[(df_FIM['FIM Electricity'] == 'X')
                             | (df_FIM['FIM Fossil Fuel'] == 'X')]
+        else:
+            df_FIM = pd.DataFrame()
 
         self.FIM_list = list(df_FIM.index)
 
+    @staticmethod
+    def assessment_stats(im: InverseModel | None,
+                         df_benchmark_stats: pd.DataFrame) -> dict | None:
+        """OpportunityEngine input: the benchmark stats with the coefficients of a fitted model, None without one"""
+        if not hasattr(im, "coeffs"):
+            return None
+        benchmark_stats = df_benchmark_stats[['beta_median', 'beta_standard_deviation']].astype(float).to_dict('index')
+        for k, coefficient_type in Building.benchmark_coefficient_types.items():
+            benchmark_stats[coefficient_type]['site_coefficient'] = float(im.coeffs[k])
+        return benchmark_stats
+
+    def savings_scenarios(self,
+                          target_levels=('conservative', 'nominal', 'aggressive'),
+                          use_default: bool = True,
+                          df_benchmark_stats_electricity: pd.DataFrame | None = None,
+                          df_benchmark_stats_fossil_fuel: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        Savings of the fitted models for several saving targets at once, without refitting. One
+        row per target level: a level name, saving target 1-3 or custom standard deviation
+        multiplier (see OpportunityEngine.target_sigma). Columns are named after the attributes
+        ee_assess, calculate_savings and disaggregate_consumption_wrapper set for a single target,
+        e.g. total_energy_savings or heating_new_cost, plus the savings coefficients by fuel,
+        e.g. beta_base_e.
+        """
+        if use_default:
+            df_benchmark_stats_electricity = Constants.df_sample_benchmark_stats_e
+            df_benchmark_stats_fossil_fuel = Constants.df_sample_benchmark_stats_f
+
+        v_sigma = OpportunityEngine.target_sigma(list(target_levels))
+        df_scenarios = pd.DataFrame({'sigma': v_sigma}, index=pd.Index(list(target_levels), dtype=object, name='target_level'))
+        v_zero = np.zeros(len(v_sigma))
+        d_totals = {'total_energy_consumption_old': 0.0, 'total_energy_savings': v_zero, 'total_cost_savings': v_zero,
+                    'base_new': v_zero, 'heating_new': v_zero, 'cooling_new': v_zero,
+                    'base_new_cost': v_zero, 'heating_new_cost': v_zero, 'cooling_new_cost': v_zero}
+        has_model = False
+        for suffix, fuel, df_benchmark_stats, utility_type, default_unit_price in (
+                ('e', 'electricity', df_benchmark_stats_electricity, 'electric', Constants.electricity_unit_price),
+                ('f', 'fossil_fuel', df_benchmark_stats_fossil_fuel, 'fossil_fuel', Constants.fossil_fuel_unit_price)):
+            im = self.__dict__.get('im_' + fuel)
+            benchmark_stats = self.assessment_stats(im, df_benchmark_stats)
+            if benchmark_stats is None:
+                continue
+            has_model = True
+            # The constructor adapts the coefficients of single change-point models
+            site_coefficients = OpportunityEngine(benchmark_stats, utility_type).site_coefficients()
+            d_targets = OpportunityEngine.targets(site_coefficients, benchmark_stats, v_sigma)
+            d_savings = OpportunityEngine.savings_targets(site_coefficients, d_targets)
+            p_new = OpportunityEngine.model_parameters(d_savings)
+
+            weather = getattr(self, 'weather_' + fuel)
+            utility = getattr(self, 'utility_' + fuel)
+            unit_price = getattr(utility, 'utility_unit_price', default_unit_price)
+            old_consumption_last_year = self.predict_consumption(
+                weather.v_T_C, utility.days, im.model_p, self.bldg_area)[-12:].sum()
+            new_consumption_last_year = self.predict_consumption(
+                weather.v_T_C, utility.days, p_new, self.bldg_area)[:, -12:].sum(axis=-1)
+            energy_savings = old_consumption_last_year - new_consumption_last_year
+            cost_savings = np.round(unit_price * energy_savings, 1)
+            df_scenarios['total_energy_savings_last_year_' + suffix] = energy_savings
+            df_scenarios['total_energy_savings_pct_last_year_' + suffix] = np.round(
+                energy_savings / old_consumption_last_year * 100, 2)
+            df_scenarios['total_cost_savings_' + suffix] = cost_savings
+            for coefficient_name, v_savings in d_savings.items():
+                df_scenarios[coefficient_name + '_' + suffix] = v_savings
+
+            d_totals['total_energy_consumption_old'] += old_consumption_last_year
+            d_totals['total_energy_savings'] = d_totals['total_energy_savings'] + energy_savings
+            d_totals['total_cost_savings'] = d_totals['total_cost_savings'] + cost_savings
+            d_consumption = self.disaggregate_consumption_stack(
+                weather.v_T_C[np.newaxis, -12:], utility.days[np.newaxis, -12:], p_new[np.newaxis],
+                self.bldg_area, unit_price)
+            for name, m_consumption in d_consumption.items():
+                end_use, _, cost = name.partition('_')
+                name = end_use + '_new' + ('_cost' if cost else '')
+                d_totals[name] = d_totals[name] + m_consumption[0]
+
+        if not has_model:
+            raise ValueError("No change-point model to assess for building " + str(self.bldg_id))
+        for name, value in d_totals.items():
+            if name != 'total_energy_consumption_old':
+                df_scenarios[name] = value
+        df_scenarios['total_energy_savings_pct'] = np.round(
+            df_scenarios['total_energy_savings'] / d_totals['total_energy_consumption_old'] * 100, 1)
+        df_scenarios['total_cost_savings'] = np.round(df_scenarios['total_cost_savings'], 0)
+        return df_scenarios
+
+    @staticmethod
+    def predict_consumption(v_T: npt.ArrayLike,
+                            v_days: npt.ArrayLike,
+                            model_p: npt.ArrayLike,
+                            area: float) -> np.ndarray:
+        """
+        Consumption per billing period (kWh, rounded to 0.1) of model parameters (hcp, ccp, base,
+        hsl, csl), or of a (K, 5) stack of them as a (K, len(v_T)) array
+        """
+        v_daily_eui = InverseModel.piecewise_linear(v_T, *np.asarray(model_p, dtype=float).T)
+        return np.round(area * np.multiply(v_daily_eui, v_days), 1)
+
     def calculate_savings(self):
         self.total_energy_consumption_old = 0
         if (not hasattr(self, "p_new_e")):
@@ -572,133 +687,85 @@ class Building:
 
     @staticmethod
     def disaggregate_consumption(v_T, v_days, model_p, area):
-        # Get model coefficients
-        hcp, ccp, base, hsl, csl = model_p
-        # Mask the temperature and number of days vectors
-        v_T_heating = v_T[v_T < hcp] if (not np.isnan(hcp)) else [-1]
-        v_T_cooling = v_T[v_T > ccp] if (not np.isnan(ccp)) else [-1]
-        v_days_heating = v_days[v_T < hcp] if (not np.isnan(hcp)) else [-1]
-        v_days_cooling = v_days[v_T > ccp] if (not np.isnan(ccp)) else [-1]
-        # Calculate the disaggregated energy consumption
-        v_base_consumption = base * v_days * area
-
-        if (len(v_T_heating) > 1):
-            v_heating_consumption = (InverseModel.piecewise_linear(v_T_heating,
-                                                                   *model_p) - base) * v_days_heating * area
-        else:
-            v_heating_consumption = [0]
-        if (len(v_T_cooling) > 1):
-            v_cooling_consumption = (InverseModel.piecewise_linear(v_T_cooling,
-                                                                   *model_p) - base) * v_days_cooling * area
-        else:
-            v_cooling_consumption = [0]
-        return sum(v_base_consumption), sum(v_heating_consumption), sum(v_cooling_consumption)
+        """Base, heating and cooling consumption (kWh) of one set of model parameters (hcp, ccp, base, hsl, csl)"""
+        d_consumption = Building.disaggregate_consumption_stack(
+            np.asarray(v_T, dtype=float)[np.newaxis], np.asarray(v_days, dtype=float)[np.newaxis],
+            np.asarray(model_p, dtype=float)[np.newaxis, np.newaxis], area)
+        return tuple(d_consumption[end_use][0, 0] for end_use in Building.end_uses)
+
+    # End uses of the disaggregated consumption, see disaggregate_consumption_stack
+    end_uses = ('base', 'heating', 'cooling')
+
+    @staticmethod
+    def disaggregate_consumption_stack(m_T: npt.ArrayLike,
+                                       m_days: npt.ArrayLike,
+                                       model_p: npt.ArrayLike,
+                                       area: npt.ArrayLike,
+                                       unit_price: npt.ArrayLike = 1.0) -> dict[str, np.ndarray]:
+        """
+        Disaggregates the consumption of B buildings (or fuels) under K sets of model parameters
+        each, in one evaluation.
+
+        m_T and m_days are (B, n) billing period temperatures (C) and days; pad buildings with
+        fewer periods with NaN. model_p is a (B, K, 5) stack of (hcp, ccp, base, hsl, csl), area
+        and unit_price are scalars or of length B. Returns (B, K) arrays of the base, heating
+        and cooling consumption (kWh) and of their costs, e.g. 'heating' and 'heating_cost'.
+        Periods below hcp count as heating, periods above ccp as cooling.
+        """
+        m_T = np.asarray(m_T, dtype=float)[:, np.newaxis, :]
+        m_days = np.asarray(m_days, dtype=float)[:, np.newaxis, :]
+        model_p = np.asarray(model_p, dtype=float)
+        m_area = np.broadcast_to(np.asarray(area, dtype=float), model_p.shape[:1])[:, np.newaxis]
+        m_unit_price = np.broadcast_to(np.asarray(unit_price, dtype=float), model_p.shape[:1])[:, np.newaxis]
+        hcp, ccp, base = (model_p[..., [i]] for i in range(3))
+
+        m_valid = ~(np.isnan(m_T) | np.isnan(m_days))
+        m_days = np.where(m_valid, m_days, 0)
+        # (B, K, n) consumption above the baseload of every period
+        m_weather = (InverseModel.piecewise_linear(m_T, *np.moveaxis(model_p, -1, 0)) - base) * m_days
+        with np.errstate(invalid='ignore'):
+            m_heating = m_valid & (m_T < hcp)
+            m_cooling = m_valid & (m_T > ccp)
+        d_consumption = {
+            'base': base[..., 0] * m_days.sum(axis=-1) * m_area,
+            'heating': np.where(m_heating, m_weather, 0).sum(axis=-1) * m_area,
+            'cooling': np.where(m_cooling, m_weather, 0).sum(axis=-1) * m_area}
+        for end_use in Building.end_uses:
+            d_consumption[end_use + '_cost'] = d_consumption[end_use] * m_unit_price
+        return d_consumption
+
+    @staticmethod
+    def stack_periods(v_arrays: list[npt.ArrayLike]) -> np.ndarray:
+        """(len(v_arrays), longest) array of the billing period arrays, padded with NaN at the end"""
+        m_stack = np.full((len(v_arrays), max((len(v) for v in v_arrays), default=0)), np.nan)
+        for i, v in enumerate(v_arrays):
+            m_stack[i, :len(v)] = v
+        return m_stack
 
     def disaggregate_consumption_wrapper(self):
         # All the consumption terms are in kWh in this function
-        # Consumption (kWh)
-        self.base_old = 0
-        self.heating_old = 0
-        self.cooling_old = 0
-        self.base_typical = 0
-        self.heating_typical = 0
-        self.cooling_typical = 0
-        self.base_new = 0
-        self.heating_new = 0
-        self.cooling_new = 0
-
-        # Cost
-        self.base_old_cost = 0
-        self.heating_old_cost = 0
-        self.cooling_old_cost = 0
-        self.base_typical_cost = 0
-        self.heating_typical_cost = 0
-        self.cooling_typical_cost = 0
-        self.base_new_cost = 0
-        self.heating_new_cost = 0
-        self.cooling_new_cost = 0
-
-        # Annualize the consumption (How?)
-        # Calculate the diaggregated consumption
-        if (hasattr(self, "v_new_consumption_last_year_e")):
-            unit_price_e = self.utility_electricity.utility_unit_price
-            base_old_e, heating_old_e, cooling_old_e = self.disaggregate_consumption(
-                self.weather_electricity.v_T_C[-12:],
-                self.utility_electricity.days[-12:],
-                self.im_electricity.model_p,
-                self.bldg_area
-            )
-            base_typical_e, heating_typical_e, cooling_typical_e = self.disaggregate_consumption(
-                self.weather_electricity.v_T_C[-12:],
-                self.utility_electricity.days[-12:],
-                self.p_typical_e,
-                self.bldg_area
-            )
-            base_new_e, heating_new_e, cooling_new_e = self.disaggregate_consumption(
-                self.weather_electricity.v_T_C[-12:],
-                self.utility_electricity.days[-12:],
-                self.p_new_e,
-                self.bldg_area
-            )
-
-            self.base_old += base_old_e
-            self.base_typical += base_typical_e
-            self.base_new += base_new_e
-            self.heating_old += heating_old_e
-            self.heating_typical += heating_typical_e
-            self.heating_new += heating_new_e
-            self.cooling_old += cooling_old_e
-            self.cooling_typical += cooling_typical_e
-            self.cooling_new += cooling_new_e
-
-            self.base_old_cost += base_old_e * unit_price_e
-            self.base_typical_cost += base_typical_e * unit_price_e
-            self.base_new_cost += base_new_e * unit_price_e
-            self.heating_old_cost += heating_old_e * unit_price_e
-            self.heating_typical_cost += heating_typical_e * unit_price_e
-            self.heating_new_cost += heating_new_e * unit_price_e
-            self.cooling_old_cost += cooling_old_e * unit_price_e
-            self.cooling_typical_cost += cooling_typical_e * unit_price_e
-            self.cooling_new_cost += cooling_new_e * unit_price_e
-
-        if (hasattr(self, "v_new_consumption_last_year_f")):
-            unit_price_f = self.utility_fossil_fuel.utility_unit_price
-            base_old_f, heating_old_f, cooling_old_f = self.disaggregate_consumption(
-                self.weather_fossil_fuel.v_T_C[-12:],
-                self.utility_fossil_fuel.days[-12:],
-                self.im_fossil_fuel.model_p,
-                self.bldg_area
-            )
-
-            base_typical_f, heating_typical_f, cooling_typical_f = self.disaggregate_consumption(
-                self.weather_fossil_fuel.v_T_C[-12:],
-                self.utility_fossil_fuel.days[-12:],
-                self.p_typical_f,
-                self.bldg_area
-            )
-
-            base_new_f, heating_new_f, cooling_new_f = self.disaggregate_consumption(
-                self.weather_fossil_fuel.v_T_C[-12:],
-                self.utility_fossil_fuel.days[-12:],
-                self.p_new_f,
-                self.bldg_area
-            )
-            self.base_old += base_old_f
-            self.base_typical += base_typical_f
-            self.base_new += base_new_f
-            self.heating_old += heating_old_f
-            self.heating_typical += heating_typical_f
-            self.heating_new += heating_new_f
-            self.cooling_old += cooling_old_f
-            self.cooling_typical += cooling_typical_f
-            self.cooling_new += cooling_new_f
-
-            self.base_old_cost += base_old_f * unit_price_f
-            self.base_typical_cost += base_typical_f * unit_price_f
-            self.base_new_cost += base_new_f * unit_price_f
-            self.heating_old_cost += heating_old_f * unit_price_f
-            self.heating_typical_cost += heating_typical_f * unit_price_f
-            self.heating_new_cost += heating_new_f * unit_price_f
-            self.cooling_old_cost += cooling_old_f * unit_price_f
-            self.cooling_typical_cost += cooling_typical_f * unit_price_f
-            self.cooling_new_cost += cooling_new_f * unit_price_f
+        # Consumption (kWh) and cost of the current (old), typical and improved (new) building,
+        # summed over the fuels, e.g. heating_new and heating_new_cost
+        parameter_sets = ('old', 'typical', 'new')
+        for end_use in Building.end_uses:
+            for parameter_set in parameter_sets:
+                setattr(self, end_use + '_' + parameter_set, 0)
+                setattr(self, end_use + '_' + parameter_set + '_cost', 0)
+
+        # Calculate the diaggregated consumption of the most recent year, all fuels at once
+        v_fuels = [(fuel, suffix) for fuel, suffix in (('electricity', 'e'), ('fossil_fuel', 'f'))
+                   if hasattr(self, 'v_new_consumption_last_year_' + suffix)]
+        if not v_fuels:
+            return
+        d_consumption = self.disaggregate_consumption_stack(
+            self.stack_periods([getattr(self, 'weather_' + fuel).v_T_C[-12:] for fuel, _ in v_fuels]),
+            self.stack_periods([getattr(self, 'utility_' + fuel).days[-12:] for fuel, _ in v_fuels]),
+            [[getattr(self, 'im_' + fuel).model_p,
+              getattr(self, 'p_typical_' + suffix),
+              getattr(self, 'p_new_' + suffix)] for fuel, suffix in v_fuels],
+            self.bldg_area,
+            [getattr(self, 'utility_' + fuel).utility_unit_price for fuel, _ in v_fuels])
+        for name, m_consumption in d_consumption.items():
+            end_use, _, cost = name.partition('_')
+            for k, parameter_set in enumerate(parameter_sets):
+                setattr(self, end_use + '_' + parameter_set + ('_cost' if cost else ''), m_consumption[:, k].sum())
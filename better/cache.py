@@ -0,0 +1,160 @@
+'''
+
+Energy Efficiency Targeting Tool Copyright (c) 2018, The Regents of the University of California, through Lawrence Berkeley National Laboratory (subject to receipt of any required approvals from the U.S. Dept. of Energy). All rights reserved.
+
+If you have questions about your rights to use or distribute this software, please contact Berkeley Lab's Intellectual Property Office at  IPO@lbl.gov.
+
+NOTICE.  This Software was developed under funding from the U.S. Department of Energy and the U.S. Government consequently retains certain rights. As such, the U.S. Government has been granted for itself and others acting on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in the Software to reproduce, distribute copies to the public, prepare derivative works, and perform publicly and display publicly, and to permit other to do so. 
+
+'''
+
+import os
+import pathlib
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+from better.model import InverseModel
+
+
+class ModelCache:
+    """
+    Content-addressed cache of fitted inverse models.
+
+    A fit is keyed by a hash of the temperature and EUI vectors, the model settings and the
+    engine version, so a building whose bills have not changed is never fitted twice. Fitted
+    models are kept pickled in an in-memory LRU tier and, when cache_dir is given, on disk.
+    The disk tier is trimmed to max_disk_bytes by removing the least recently used files.
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self,
+                 cache_dir: pathlib.Path | str | None = None,
+                 max_memory_items: int = 256,
+                 max_disk_bytes: int = 256 * 2 ** 20):
+        self.cache_dir = None if cache_dir is None else pathlib.Path(cache_dir)
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk_bytes = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.disk_bytes = sum(f.stat().st_size for f in self.files())
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'memory_items': len(self.memory), 'disk_bytes': self.disk_bytes}
+
+    @staticmethod
+    def key(model: InverseModel,
+            r_squared_threshold: float = 0.1) -> str:
+        """Hash of everything fit_model depends on"""
+        h = hashlib.sha256()
+        for v in (model.temperature, model.eui):
+            h.update(np.ascontiguousarray(v, dtype=np.float64).tobytes())
+            h.update(b'|')
+        settings = model.fit_settings()
+        settings['r_squared_threshold'] = r_squared_threshold
+        h.update(repr(sorted(settings.items())).encode())
+        return h.hexdigest()
+
+    def files(self) -> list[pathlib.Path]:
+        return list(self.cache_dir.glob('*' + self.suffix)) if self.cache_dir is not None else []
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / (key + self.suffix)
+
+    def get(self, key: str) -> InverseModel | None:
+        """Returns an independent copy of the cached model, or None"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return pickle.loads(self.memory[key])
+
+        if self.cache_dir is not None:
+            try:
+                data = self.path(key).read_bytes()
+                model = pickle.loads(data)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                # Missing, evicted by another process or partially written
+                model = None
+            if model is not None:
+                os.utime(self.path(key))  # Mark as recently used
+                self.remember(key, data)
+                self.disk_hits += 1
+                return model
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, model: InverseModel) -> None:
+        data = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        self.remember(key, data)
+
+        if self.cache_dir is not None:
+            # Write to a temporary file first so that concurrent readers never see a partial fit
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                # Overwriting a key replaces its file rather than adding one
+                previous_bytes = self.path(key).stat().st_size
+            except OSError:
+                previous_bytes = 0
+            os.replace(tmp, self.path(key))
+            self.disk_bytes += len(data) - previous_bytes
+            if self.disk_bytes > self.max_disk_bytes:
+                self.evict()
+
+    def remember(self, key: str, data: bytes) -> None:
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def evict(self) -> None:
+        """Removes least recently used files until the disk tier fits max_disk_bytes"""
+        entries = []
+        for f in self.files():
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        entries.sort()
+        self.disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, f in entries:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            f.unlink(missing_ok=True)
+            self.disk_bytes -= size
+
+    def clear(self) -> None:
+        self.memory.clear()
+        for f in self.files():
+            f.unlink(missing_ok=True)
+        self.disk_bytes = 0
+
+    def fit_model(self,
+                  model: InverseModel,
+                  r_squared_threshold: float = 0.1) -> InverseModel:
+        """Returns the fitted model for model's data and settings, fitting it only on a miss"""
+        key = self.key(model, r_squared_threshold)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        model.fit_model(r_squared_threshold)
+        self.put(key, model)
+        return model
@@ -22,6 +22,18 @@ class Constants:
     MMBtu_to_kWh = 293.071
     Therms_to_kWh = 29.307
     Decatherms_to_kWh = 293.071
+    # Factors to kWh by energy unit, as spelled in the portfolio spreadsheet
+    energy_unit_to_kWh = {
+        'kWh': 1,
+        'MWh': MWH_to_kWh,
+        'MJ': MJ_to_kWh,
+        'GJ': GJ_to_kWh,
+        'Btu': Btu_to_kWh,
+        'MMBtu': MMBtu_to_kWh,
+        'Cubic Meters': M3_to_kWh,
+        'Therms': Therms_to_kWh,
+        'Decatherms': Decatherms_to_kWh,
+    }
 
     # Default fuel price
     electricity_unit_price = 0.1  # USD/kWh EIA
@@ -12,11 +12,22 @@ from typing import Literal
 import better.utility as utility
 import better.weather as weather
 import better.building as building
+import better.geocoding as geocoding
 from better.portfolio import Portfolio
+from better.cache import ModelCache
 import better.report as report
 
 import os
 import pathlib
+import traceback
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import sys
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 
 def run_single(
@@ -30,46 +41,48 @@ def run_single(
     return_data=False,
     use_default_benchmark_data=True,
     df_user_bench_stats_e=None,
-    df_user_bench_stats_f=None
+    df_user_bench_stats_f=None,
+    model_cache: ModelCache | None = None,
+    portfolio: Portfolio | None = None,
+    building_data=None,
+    weather_prefetch: weather.WeatherPrefetch | None = None
 ):
+    """
+    Analyzes one building of the portfolio in data_path / 'portfolio.xlsx'.
+
+    Pass a portfolio that has already been read, or the building's slice of it from
+    Portfolio.get_building_data_by_id, to avoid parsing the workbook on every call.
+    Downloaded weather goes through weather_prefetch, so that it can be shared with other
+    buildings; by default the electricity and fossil fuel analyses share one download.
+    """
     # Set paths
     report_path = data_path / 'outputs/'
 
-    # Create an outputs directoty if there isn't one.
-    if not os.path.exists(report_path):
-        os.makedirs(report_path)
+    # Create an outputs directoty if there isn't one. Pool workers may race to create it.
+    os.makedirs(report_path, exist_ok=True)
 
-    # Initialize a portfolio instance
-    p = Portfolio('Test')
-    # p.read_raw_data_from_xlsx(data_path + 'portfolio.xlsx')
-    p.read_raw_data_from_xlsx(data_path / 'portfolio.xlsx')
+    def get_portfolio():
+        nonlocal portfolio
+        if portfolio is None:
+            # Initialize a portfolio instance
+            portfolio = Portfolio('Test')
+            portfolio.read_raw_data_from_xlsx(data_path / 'portfolio.xlsx')
+        return portfolio
 
     # Get building data from the portfolio
     building_id = bldg_id
-    building_info = p.get_building_info_by_id(building_id)
-    if (building_info == None):
+    if building_data is None:
+        building_data = get_portfolio().get_building_data_by_id(building_id)
+    if (building_data == None):
         return False, None
     else:
-        # Initialize a building instance
-        building_test = building.Building(
-            building_id, *building_info, saving_target)
-        # Get utility data from portfolio
-        df_raw_electricity = p.get_utility_by_building_id_and_energy_type(
-            building_id=building_id, energy_type=1)
-        df_raw_fossil_fuel = p.get_utility_by_building_id_and_energy_type(
-            building_id=building_id, energy_type=2)
-        df_raw_utility_e = df_raw_electricity
-        df_raw_utility_f = df_raw_fossil_fuel
-        utility_test_e = utility.Utility('electricity', df_raw_utility_e)
-        utility_test_f = utility.Utility('fossil fuel', df_raw_utility_f)
-        building_test.add_utility(utility_test_e, utility_test_f)
-        weather_test_e = weather.Weather(building_test.coord)
-        weather_test_f = weather.Weather(building_test.coord)
-        building_test.add_weather(
-            weather_test_e, weather_test_f, use_cached_weather)
+        building_test = make_building(building_id, building_data, saving_target)
+        if not use_cached_weather and weather_prefetch is None:
+            weather_prefetch = weather.WeatherPrefetch()
+        building_test.add_nearest_weather(use_cached_weather, weather_prefetch)
 
         # Fit inverse model and benchmark
-        has_fit = building_test.fit_inverse_model()
+        has_fit = building_test.fit_inverse_model(model_cache)
         # Continue only if there is at least one change-point model fit.
         if has_fit:
             if (use_default_benchmark_data):
@@ -78,18 +91,19 @@ def run_single(
             else:
                 # Note: the benchmark data sets are generated from the portfolio spreadsheet.
                 # 1 ~ electricity; 2 ~ fossil fuel
-                dict_raw_electricity = p.get_portfolio_raw_data_by_spaceType_and_utilityType(
-                    space_type, utility_type=1)
-                dict_raw_fossil_fuel = p.get_portfolio_raw_data_by_spaceType_and_utilityType(
-                    space_type, utility_type=2)
-
                 # Generate the benchmark stats from the user provided data in the portfolio spreadsheet
                 if df_user_bench_stats_e is None:
-                    df_user_bench_stats_e = p.generate_benchmark_stats_wrapper(
-                        dict_raw_electricity, use_cached_weather)
+                    dict_raw_electricity = get_portfolio().get_portfolio_raw_data_by_spaceType_and_utilityType(
+                        space_type, utility_type=1)
+                    df_user_bench_stats_e = Portfolio.generate_benchmark_stats_wrapper(
+                        dict_raw_electricity, use_cached_weather, model_cache=model_cache,
+                        weather_prefetch=weather_prefetch)
                 if df_user_bench_stats_f is None:
-                    df_user_bench_stats_f = p.generate_benchmark_stats_wrapper(
-                        dict_raw_fossil_fuel, use_cached_weather)
+                    dict_raw_fossil_fuel = get_portfolio().get_portfolio_raw_data_by_spaceType_and_utilityType(
+                        space_type, utility_type=2)
+                    df_user_bench_stats_f = Portfolio.generate_benchmark_stats_wrapper(
+                        dict_raw_fossil_fuel, use_cached_weather, model_cache=model_cache,
+                        weather_prefetch=weather_prefetch)
 
                 building_test.benchmark(use_default=False,
                                         df_benchmark_stats_electricity=df_user_bench_stats_e,
@@ -128,6 +142,20 @@ def run_single(
             return False, None
 
 
+def make_building(bldg_id,
+                  building_data,
+                  saving_target=2) -> building.Building:
+    """Building with the utility data of its slice of the portfolio, see Portfolio.get_building_data_by_id"""
+    building_info, df_raw_electricity, df_raw_fossil_fuel = building_data
+    # Initialize a building instance
+    building_test = building.Building(bldg_id, *building_info, saving_target)
+    # Get utility data from portfolio
+    utility_test_e = utility.Utility('electricity', df_raw_electricity)
+    utility_test_f = utility.Utility('fossil fuel', df_raw_fossil_fuel)
+    building_test.add_utility(utility_test_e, utility_test_f)
+    return building_test
+
+
 def summary_html(report_path, start_id, end_id):
     report_file = report_path + '/summary_report.html'
     with open(report_file, 'w', encoding="utf-8") as report_html:
@@ -141,6 +169,72 @@ def summary_html(report_path, start_id, end_id):
         report_html.write('</html>\n')
 
 
+# Building attributes used by Portfolio.prepare_portfolio_report_data
+REPORT_ATTRIBUTES = ['bldg_id', 'bldg_name', 'bldg_address', 'bldg_area',
+                     'recent_annual_electricity_kWh', 'recent_annual_fossil_fuel_kWh',
+                     'recent_annual_electricity_cost', 'recent_annual_fossil_fuel_cost',
+                     'recent_annual_electricity_EUI', 'recent_annual_fossil_fuel_EUI',
+                     'total_cost_savings', 'total_energy_savings_pct']
+
+# Per-process model cache and downloaded weather for pool workers, see init_worker
+worker_model_cache = None
+worker_weather_prefetch = None
+
+
+def peak_rss_MB() -> tuple[float, float] | None:
+    """
+    Peak resident set size (MB) of this process and of its largest finished child process, e.g.
+    a pool worker; None where the resource module is not available
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 / 1024 ** 2 if sys.platform == 'darwin' else 1 / 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def building_record(building_test) -> SimpleNamespace:
+    """Compact, picklable summary of an analyzed building for the portfolio report"""
+    return SimpleNamespace(**{a: getattr(building_test, a) for a in REPORT_ATTRIBUTES
+                              if hasattr(building_test, a)})
+
+
+def init_worker(model_cache_dir: pathlib.Path | None,
+                station_coverage_path: pathlib.Path | None = None,
+                geocoder: geocoding.Geocoder | None = None,
+                weather_prefetch: weather.WeatherPrefetch | None = None) -> None:
+    global worker_model_cache, worker_weather_prefetch
+    worker_model_cache = ModelCache(model_cache_dir)
+    worker_weather_prefetch = weather_prefetch
+    if station_coverage_path is not None:
+        weather.Weather.default_station_coverage = weather.StationCoverage(station_coverage_path)
+    if geocoder is not None:
+        geocoding.default_geocoder = geocoder
+
+
+def run_single_record(bldg_id,
+                      model_cache: ModelCache | None = None,
+                      weather_prefetch: weather.WeatherPrefetch | None = None,
+                      **kwargs):
+    """
+    Runs run_single and returns (bldg_id, record, error). record is None when the building has
+    no fit or fails; error holds the traceback of a failure so that a batch can carry on.
+    In a pool worker, the model cache and weather default to the ones given to init_worker.
+    """
+    if model_cache is None:
+        model_cache = worker_model_cache
+    if weather_prefetch is None:
+        weather_prefetch = worker_weather_prefetch
+    try:
+        building_test = run_single(bldg_id=bldg_id, model_cache=model_cache,
+                                   weather_prefetch=weather_prefetch, **kwargs)[1]
+    except Exception:
+        return bldg_id, None, traceback.format_exc()
+    record = None if building_test is None else building_record(building_test)
+    return bldg_id, record, None
+
+
 def run_batch(
     start_id: int,
     end_id: int,
@@ -150,44 +244,141 @@ def run_batch(
     saving_target: int = 2,
     cached_weather: bool = True,
     batch_report: bool = False,
-    use_default_benchmark_data: bool = True
+    use_default_benchmark_data: bool = True,
+    model_cache_dir: pathlib.Path | None = None,
+    workers: int = 1,
+    station_coverage_path: pathlib.Path | None = None,
+    geocode_cache_path: pathlib.Path | None = None,
+    gazetteer_path: pathlib.Path | None = None,
+    geocode_online: bool = True
 ):
-    """Creates a portfolio and ..."""
+    """Creates a portfolio and ...
+
+    Fitted models are cached in memory for the run and, when model_cache_dir is given,
+    on disk, so that buildings whose bills have not changed are not refitted on later runs.
+
+    With workers > 1 the buildings are analyzed in a process pool. At most 2 * workers
+    buildings are in flight at a time, results are collected in building ID order and a
+    building that fails is reported without aborting the batch.
+
+    With station_coverage_path, the weather station-years found available or missing are kept
+    in that JSON file, so that later runs go straight to a station that has the data.
+
+    Without cached_weather, the weather of all the buildings is downloaded before the analysis,
+    each station-year once, and handed to the workers.
+
+    Building addresses are geocoded once per distinct address before the analysis. With
+    geocode_cache_path the answers are kept in that JSON file across runs; with gazetteer_path,
+    a US Census gazetteer file, addresses no online geocoder resolves fall back to it. Without
+    geocode_online only the cache and the gazetteer are consulted.
+
+    Returns the buildings' records (see building_record) in building ID order, None for a
+    building without a model fit or that failed.
+    """
+
+    model_cache = ModelCache(model_cache_dir)
+    if station_coverage_path is not None:
+        weather.Weather.default_station_coverage = weather.StationCoverage(station_coverage_path)
+    # The workbook is parsed once and shared by the benchmark stats and every building
+    portfolio = Portfolio(portfolio_name)
+    portfolio.read_raw_data_from_xlsx(portfolio_path)
+    if geocode_cache_path is not None or gazetteer_path is not None:
+        geocoding.default_geocoder = geocoding.Geocoder(
+            geocode_cache_path,
+            None if gazetteer_path is None else geocoding.Gazetteer([gazetteer_path]),
+            online=geocode_online)
+    elif not geocode_online:
+        geocoding.default_geocoder.online = False
+    v_building_ids = list(range(start_id, end_id+1))
+    # Buildings without utility data are never geocoded
+    v_building_data = [portfolio.get_building_data_by_id(i) for i in v_building_ids]
+    geocoding.default_geocoder.resolve_many(
+        data[0][1] for data in v_building_data
+        if data is not None and (data[1] is not None or data[2] is not None))
+    # The station-years every analyzed building needs are downloaded once, up front, and shared
+    # by the benchmark stats, the buildings and the pool workers
+    weather_prefetch = None if cached_weather else weather.WeatherPrefetch()
+    if weather_prefetch is not None:
+        for i, building_data in zip(v_building_ids, v_building_data):
+            if building_data is None:
+                continue
+            try:
+                make_building(i, building_data, saving_target).plan_nearest_weather(weather_prefetch)
+            except Exception:
+                # The analysis of the building reports the error
+                continue
+        weather_prefetch.fetch()
 
     # Conditionally generate the benchmark stats for the porfolio
     if use_default_benchmark_data:
         df_user_bench_stats_e, df_user_bench_stats_f = None, None
     else:
-        # Initialize a portfolio instance
-        # s_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-        # data_path = s_path + '/Data/'
-        portfolio = Portfolio(portfolio_name)
-        portfolio.read_raw_data_from_xlsx(portfolio_path)
-
         # 1 ~ electricity; 2 ~ fossil fuel
         dict_raw_electricity = portfolio.get_portfolio_raw_data_by_spaceType_and_utilityType(
             space_type, utility_type=1)
         dict_raw_fossil_fuel = portfolio.get_portfolio_raw_data_by_spaceType_and_utilityType(
             space_type, utility_type=2)
         df_user_bench_stats_e = portfolio.generate_benchmark_stats_wrapper(
-            dict_raw_electricity, cached_weather)
+            dict_raw_electricity, cached_weather, model_cache=model_cache,
+            weather_prefetch=weather_prefetch)
         df_user_bench_stats_f = portfolio.generate_benchmark_stats_wrapper(
-            dict_raw_fossil_fuel, cached_weather)
+            dict_raw_fossil_fuel, cached_weather, model_cache=model_cache,
+            weather_prefetch=weather_prefetch)
+
+    run_kwargs = dict(
+        data_path=pathlib.Path(portfolio_path).parent,
+        saving_target=saving_target,
+        use_cached_weather=cached_weather,
+        use_default_benchmark_data=use_default_benchmark_data,
+        df_user_bench_stats_e=df_user_bench_stats_e,
+        df_user_bench_stats_f=df_user_bench_stats_f
+    )
+    results = {}
+    if workers > 1:
+        def collect(done):
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception:
+                    # e.g. a worker process died or the result could not be pickled
+                    results[i] = i, None, traceback.format_exc()
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(model_cache_dir, station_coverage_path,
+                                           geocoding.default_geocoder, weather_prefetch)) as pool:
+            pending = {}
+            for i, building_data in zip(v_building_ids, v_building_data):
+                if len(pending) >= 2 * workers:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                print('Analyzing building ' + str(i))
+                # Workers only receive their building's slice of the portfolio
+                if building_data is None:
+                    results[i] = i, None, None
+                    continue
+                pending[pool.submit(run_single_record, i,
+                                    building_data=building_data,
+                                    **run_kwargs)] = i
+            collect(wait(pending).done)
+    else:
+        for i in v_building_ids:
+            print('--------------------------------------------------')
+            print('Analyzing building ' + str(i))
+            results[i] = run_single_record(i, model_cache, portfolio=portfolio,
+                                           weather_prefetch=weather_prefetch, **run_kwargs)
+        print('Model cache: ' + str(model_cache.stats()))
+
+    peak_rss = peak_rss_MB()
+    if peak_rss is not None:
+        print('Peak RSS: {:.0f} MB, largest worker: {:.0f} MB'.format(*peak_rss))
 
     v_single_buildings = []
-    v_single_building_reports = []
-    for i in range(start_id, end_id+1):
-        print('--------------------------------------------------')
-        print('Analyzing building ' + str(i))
-        single_building = run_single(
-            bldg_id=i,
-            saving_target=saving_target,
-            use_cached_weather=cached_weather,
-            use_default_benchmark_data=use_default_benchmark_data,
-            df_user_bench_stats_e=df_user_bench_stats_e,
-            df_user_bench_stats_f=df_user_bench_stats_f
-        )[1]
-        v_single_buildings.append(single_building)
+    for i in v_building_ids:
+        _, record, error = results[i]
+        if error is not None:
+            print('Building ' + str(i) + ' failed:\n' + error)
+        v_single_buildings.append(record)
 
     if batch_report:
         report_path = os.path.dirname(os.path.dirname(
@@ -197,6 +388,7 @@ def run_batch(
             v_single_buildings, report_path)
         report_portfolio = report.Report(portfolio=portfolio_out)
         report_portfolio.generate_portfolio_report(report_path)
+    return v_single_buildings
 
 
 def main():
@@ -0,0 +1,229 @@
+'''
+
+Building Efficiency Targeting Tool for Energy Retrofits (BETTER) Copyright (c) 2018, The Regents of the University of California, through Lawrence Berkeley National Laboratory (subject to receipt of any required approvals from the U.S. Dept. of Energy). All rights reserved.
+
+If you have questions about your rights to use or distribute this software, please contact Berkeley Lab's Intellectual Property Office at  IPO@lbl.gov.
+
+NOTICE.  This Software was developed
+under funding from the U.S. Department of Energy and the U.S. Government consequently retains certain rights. As such, the U.S. Government has been granted for itself and others acting on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in the Software to reproduce, distribute copies to the public, prepare derivative works, and perform publicly and display publicly, and to permit other to do so.
+
+'''
+
+import os
+import re
+import json
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Iterable, NamedTuple
+import pandas as pd
+
+
+class GeocodeResult(NamedTuple):
+    latitude: float
+    longitude: float
+    address: str  # Address as resolved by the provider
+    provider: str
+
+    @property
+    def latlng(self) -> list[float]:
+        return [self.latitude, self.longitude]
+
+
+# Common street suffixes and directions, so that '1 Main Street' and '1 main st.' share a key
+address_abbreviations = {'street': 'st', 'avenue': 'ave', 'road': 'rd', 'boulevard': 'blvd',
+                         'drive': 'dr', 'lane': 'ln', 'court': 'ct', 'place': 'pl',
+                         'square': 'sq', 'parkway': 'pkwy', 'highway': 'hwy', 'suite': 'ste',
+                         'north': 'n', 'south': 's', 'east': 'e', 'west': 'w'}
+
+
+def normalize_address(address: str) -> str:
+    """Cache key of an address: lower case words without punctuation, with common abbreviations"""
+    words = re.sub(r'[^\w#\s]', ' ', str(address).casefold()).split()
+    return ' '.join(address_abbreviations.get(word, word) for word in words)
+
+
+class Gazetteer:
+    """
+    Offline place lookup from US Census gazetteer files, no network needed. Accepts the place
+    file (USPS, NAME, INTPTLAT, INTPTLONG columns), the ZIP code tabulation area file (GEOID,
+    INTPTLAT, INTPTLONG) or a plain city, state, latitude, longitude table. An address is looked
+    up by its ZIP code first and then by its city and state, e.g. '1 Main St, Berkeley, CA 94720'.
+    """
+
+    # Legal/statistical area descriptions the Census appends to place names
+    place_suffixes = re.compile(r'\s+(city|town|village|borough|municipality|cdp|city and borough|'
+                                r'(unified|consolidated|metropolitan) government.*|'
+                                r'\(balance\))$')
+
+    def __init__(self, paths: Iterable[os.PathLike | str] = ()):
+        self.places: dict[tuple[str, str], tuple[float, float]] = {}
+        self.zip_codes: dict[str, tuple[float, float]] = {}
+        for path in paths:
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self.places) + len(self.zip_codes)
+
+    def load(self, path: os.PathLike | str) -> None:
+        sep = '\t' if str(path).endswith('.txt') else ','
+        df = pd.read_csv(path, sep=sep, dtype=str)
+        df.columns = df.columns.str.strip().str.upper()
+        if 'INTPTLAT' in df.columns:
+            df = df.rename(columns={'INTPTLAT': 'LATITUDE', 'INTPTLONG': 'LONGITUDE',
+                                    'USPS': 'STATE', 'NAME': 'CITY'})
+        latitude = pd.to_numeric(df['LATITUDE'], errors='coerce')
+        longitude = pd.to_numeric(df['LONGITUDE'], errors='coerce')
+        if 'CITY' in df.columns:
+            v_city = df['CITY'].str.casefold().str.replace(self.place_suffixes, '', regex=True)
+            for city, state, lat, lon in zip(v_city, df['STATE'].str.casefold(), latitude, longitude):
+                self.places.setdefault((normalize_address(city), state), (lat, lon))
+        else:
+            for zip_code, lat, lon in zip(df['GEOID'].str.zfill(5), latitude, longitude):
+                self.zip_codes[zip_code] = (lat, lon)
+
+    def lookup(self, address: str) -> GeocodeResult | None:
+        parts = [normalize_address(part) for part in str(address).split(',')]
+        match = re.search(r'\b(\d{5})(?:\s*\d{4})?\s*$', parts[-1])
+        if match and match.group(1) in self.zip_codes:
+            return GeocodeResult(*self.zip_codes[match.group(1)], match.group(1), 'gazetteer')
+        # '..., <city>, <state> [zip]' or '..., <city> <state> [zip]'
+        state_match = re.search(r'\b([a-z]{2})(?:\s+\d{5}(?:\s*\d{4})?)?$', parts[-1])
+        if state_match is None:
+            return None
+        state = state_match.group(1)
+        before_state = parts[-1][:state_match.start()].strip()
+        v_candidates = [before_state] if before_state else []
+        if len(parts) > 1:
+            v_candidates.append(parts[-2])
+        for city in v_candidates:
+            # The city may follow a street address in the same part, try its trailing words
+            words = city.split()
+            for i in range(len(words)):
+                key = (' '.join(words[i:]), state)
+                if key in self.places:
+                    return GeocodeResult(*self.places[key], key[0] + ', ' + state, 'gazetteer')
+        return None
+
+
+class Geocoder:
+    """
+    Resolves building addresses to coordinates. Answers come from, in order: the cache keyed by
+    normalize_address; the online providers, unless online is False; the offline gazetteer.
+    Online answers are kept in the cache, which persists to a JSON file when cache_path is given.
+    Addresses no provider knows are not looked up online again for miss_ttl seconds.
+    """
+
+    default_providers = ('google', 'arcgis', 'bing', 'baidu')
+
+    def __init__(self,
+                 cache_path: os.PathLike | str | None = None,
+                 gazetteer: Gazetteer | None = None,
+                 providers: Iterable[str] = default_providers,
+                 online: bool = True,
+                 miss_ttl: float = 7 * 24 * 3600):
+        self.cache_path = None if cache_path is None else pathlib.Path(cache_path)
+        self.gazetteer = gazetteer
+        self.providers = tuple(providers)
+        self.online = online
+        self.miss_ttl = miss_ttl
+        self.cache: dict[str, GeocodeResult] = {}
+        self.misses: dict[str, float] = {}  # When the online lookup of an address last failed
+        self.changed = False
+        self.lock = threading.Lock()
+        if self.cache_path is not None and self.cache_path.exists():
+            cache, misses = self.read(self.cache_path)
+            self.cache.update(cache)
+            self.misses.update(misses)
+
+    def __getstate__(self):
+        # Sent to worker processes with the answers found so far, without the lock
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def read(path: pathlib.Path) -> tuple[dict[str, GeocodeResult], dict[str, float]]:
+        """The answers and the times of the failed lookups in a cache file"""
+        with open(path, encoding='utf-8') as infile:
+            d_values = json.load(infile)
+        cache = {key: GeocodeResult(*value) for key, value in d_values.items() if isinstance(value, list)}
+        misses = {key: value for key, value in d_values.items() if not isinstance(value, list)}
+        return cache, misses
+
+    def save(self) -> None:
+        """Writes the cache to its JSON file, if it has one and anything changed"""
+        if self.cache_path is None or not self.changed:
+            return
+        with self.lock:
+            if self.cache_path.exists():
+                # Keep what other processes found in the meantime
+                cache, misses = self.read(self.cache_path)
+                self.cache = {**cache, **self.cache}
+                self.misses = {key: max(misses.get(key, 0), self.misses.get(key, 0))
+                               for key in {**misses, **self.misses} if key not in self.cache}
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write next to the target and swap it in, so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=self.cache_path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as outfile:
+                json.dump({**self.misses, **{key: list(value) for key, value in self.cache.items()}}, outfile)
+            os.replace(tmp, self.cache_path)
+            self.changed = False
+
+    def geocode_online(self, address: str) -> GeocodeResult | None:
+        """Tries the providers in turn; any failure, including no network or no geocoder package,
+        counts as no answer"""
+        for provider in self.providers:
+            try:
+                import geocoder
+                geo_coder = getattr(geocoder, provider)(address)
+            except Exception:
+                continue
+            if geo_coder.latlng is not None:
+                return GeocodeResult(*geo_coder.latlng, geo_coder.address, provider)
+        return None
+
+    def resolve(self, address: str, save: bool = True) -> GeocodeResult | None:
+        """Returns the coordinates of address, None if no source knows it"""
+        key = normalize_address(address)
+        result = self.cache.get(key)
+        if result is None and self.online and not self.missed_recently(key):
+            result = self.geocode_online(address)
+            with self.lock:
+                if result is not None:
+                    self.cache[key] = result
+                    self.misses.pop(key, None)
+                else:
+                    self.misses[key] = time.time()
+                self.changed = True
+            if save:
+                self.save()
+        if result is None and self.gazetteer is not None:
+            result = self.gazetteer.lookup(address)
+        return result
+
+    def missed_recently(self, key: str) -> bool:
+        """Whether the online lookup of the normalized address key failed less than miss_ttl ago"""
+        return time.time() - self.misses.get(key, -float('inf')) < self.miss_ttl
+
+    def resolve_many(self, addresses: Iterable[str]) -> dict[str, GeocodeResult | None]:
+        """Resolves each distinct address once and saves the cache once at the end"""
+        d_key_result = {}
+        d_results = {}
+        for address in addresses:
+            key = normalize_address(address)
+            if key not in d_key_result:
+                d_key_result[key] = self.resolve(address, save=False)
+            d_results[address] = d_key_result[key]
+        self.save()
+        return d_results
+
+
+# Geocoder shared by the buildings of this process, replace it with e.g.
+# Geocoder(cache_path, Gazetteer([path])) to keep answers across runs or to work offline
+default_geocoder = Geocoder()
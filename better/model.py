@@ -13,15 +13,22 @@ from scipy import optimize, stats
 import numpy as np
 import numpy.typing as npt
 import math
+import warnings
 
 
 class InverseModel:
     """A class to hold an inverse model for a facility"""
 
+    # Bump whenever a change to the fitting code can change fitted coefficients,
+    # so that persisted fits (see better.cache) are not reused across versions
+    engine_version = 2
+
     def __init__(self,
                  temperature: npt.ArrayLike,
                  eui: npt.ArrayLike,
-                 significance_threshold: float = 0.1):
+                 significance_threshold: float = 0.1,
+                 engine: Literal['curve_fit', 'segmented'] = 'curve_fit',
+                 cp_search: Literal['sweep', 'coarse_to_fine'] = 'sweep'):
 
         if (np.size(eui) != np.size(temperature)):
             raise Exception(
@@ -59,33 +66,92 @@ class InverseModel:
         self.csl_insignificant = False  # assume significant cooling slope
         self.best_model = None
 
+        # Change-point search settings for the segmented engine, which searches the same
+        # change-point bounds and percentile windows as curve_fit
+        self.engine = engine
+        self.cp_grid_size = 40  # Evenly spaced candidates added to the data points
+        self.cp_grid_refinements = 2  # Zoom passes around the best candidate
+        self.cp_statistics_grid_size = 100  # Grid candidates kept for incremental refits
+        self.cp_statistics = None  # Per-candidate sufficient statistics, see build_cp_statistics
+
+        # Change-point limit search settings for the curve_fit engine
+        self.cp_search = cp_search
+        self.cp_search_stride = 3  # Windows skipped between coarse evaluations
+        self.r2_tolerance = 1e-4  # Minimum R-squared gain to keep refining
+        self.n_fits = 0  # Nonlinear solves performed
+        self.fits_saved = 0  # Solves skipped relative to a full sweep
+
+    def fit_settings(self) -> dict:
+        """Returns the settings that, together with the data, determine the fitted model"""
+        names = ['hcp_bound_percentile', 'ccp_bound_percentile',
+                 'base_min', 'base_max', 'hsl_min', 'hsl_max', 'csl_min', 'csl_max',
+                 'significance_threshold', 'engine',
+                 'cp_grid_size', 'cp_grid_refinements',
+                 'cp_search', 'cp_search_stride', 'r2_tolerance']
+        settings = {name: getattr(self, name) for name in names}
+        settings['engine_version'] = self.engine_version
+        return settings
+
     @staticmethod
     def piecewise_linear(x: npt.ArrayLike,
-                         hcp: float,
-                         ccp: float,
-                         base: float,
-                         hsl: float,
-                         csl: float):
+                         hcp: npt.ArrayLike,
+                         ccp: npt.ArrayLike,
+                         base: npt.ArrayLike,
+                         hsl: npt.ArrayLike,
+                         csl: npt.ArrayLike):
         #  hsl \              / csl
         #       \            /
         # base   \__________/
         #        hcp       ccp
+        #
+        # Scalar coefficients return an array shaped like x. Coefficients given as arrays
+        # of length K (e.g. *params.T for a (K, 5) array) return a (K, len(x)) array.
+        x = np.asarray(x, dtype=float)
+        hcp, ccp, base, hsl, csl = InverseModel.broadcast_coefficients(
+            hcp, ccp, base, hsl, csl)
+
+        # The heating leg is dropped where it would overlap the cooling leg (hcp > ccp)
+        heating = np.minimum(x - hcp, 0) * (x <= ccp)
+        cooling = np.maximum(x - ccp, 0)
+        return base + hsl * heating + csl * cooling
 
-        # Handle 3P models when use this function to predict.
-        if np.isnan(hcp) and np.isnan(hsl):
-            hcp = ccp
-            hsl = 0
-        if np.isnan(csl) and np.isnan(csl):
-            ccp = hcp
-            csl = 0
+    @staticmethod
+    def piecewise_linear_jacobian(x: npt.ArrayLike,
+                                  hcp: float,
+                                  ccp: float,
+                                  base: float,
+                                  hsl: float,
+                                  csl: float) -> np.ndarray:
+        """Partial derivatives of piecewise_linear with respect to (hcp, ccp, base, hsl, csl)"""
+        x = np.asarray(x, dtype=float)
+        hcp, ccp, base, hsl, csl = InverseModel.broadcast_coefficients(
+            hcp, ccp, base, hsl, csl)
+
+        below = (x < hcp) & (x <= ccp)
+        above = x > ccp
+        heating = np.minimum(x - hcp, 0) * (x <= ccp)
+        cooling = np.maximum(x - ccp, 0)
+        return np.stack([-hsl * below,
+                         -csl * above,
+                         np.ones_like(heating),
+                         heating,
+                         cooling], axis=-1)
 
-        conds = [x < hcp, (x >= hcp) & (x <= ccp), x > ccp]
+    @staticmethod
+    def broadcast_coefficients(hcp, ccp, base, hsl, csl) -> list[np.ndarray]:
+        """Fills in missing 3P legs and shapes coefficient arrays to broadcast against x"""
+        hcp, ccp, base, hsl, csl = (np.asarray(c, dtype=float)
+                                    for c in (hcp, ccp, base, hsl, csl))
 
-        funcs = [lambda x: hsl * x + base - hsl * hcp,
-                 lambda x: base,
-                 lambda x: csl * x + base - csl * ccp]
+        # Handle 3P models when use this function to predict.
+        no_heating = np.isnan(hcp) & np.isnan(hsl)
+        hcp = np.where(no_heating, ccp, hcp)
+        hsl = np.where(no_heating, 0, hsl)
+        no_cooling = np.isnan(csl)
+        ccp = np.where(no_cooling, hcp, ccp)
+        csl = np.where(no_cooling, 0, csl)
 
-        return np.piecewise(x, conds, funcs)
+        return [c[..., np.newaxis] for c in (hcp, ccp, base, hsl, csl)]
 
     def rmse(self):
         yp = self.piecewise_linear(self.temperature, *self.p)
@@ -112,55 +178,595 @@ class InverseModel:
 
         return r2_result
 
-    def fit(self) -> None:
-        """Creates an initial fit to of the changepoint model"""
+    def fit(self,
+            p0: npt.ArrayLike | None = None) -> None:
+        """Creates an initial fit to of the changepoint model, optionally warm-started from p0"""
+        if self.engine == 'segmented':
+            if self.cp_statistics is not None:
+                self.fit_cp_statistics()
+            else:
+                self.fit_segmented()
+            return
+
+        lower = [self.hcp_min, self.ccp_min, self.base_min, self.hsl_min, self.csl_min]
+        upper = [self.hcp_max, self.ccp_max, self.base_max, self.hsl_max, self.csl_max]
+        if p0 is not None:
+            # curve_fit rejects starting points outside the bounds
+            p0 = np.clip(p0, lower, upper)
+
+        self.n_fits += 1
         try:
             self.p, self.e = optimize.curve_fit(
                 self.piecewise_linear,
                 self.temperature,
                 self.eui,
-                bounds=([self.hcp_min, self.ccp_min, self.base_min, self.hsl_min, self.csl_min],
-                        [self.hcp_max, self.ccp_max, self.base_max,
-                            self.hsl_max, self.csl_max]
-                        )
+                p0=p0,
+                bounds=(lower, upper),
+                jac=self.piecewise_linear_jacobian
             )
             # Model coefficients
             self.hcp, self.ccp, self.base, self.hsl, self.csl = self.p
-
-            # Get p-value from t-test for the model coefficients
-            n = len(self.temperature)
-            self.p_base = stats.t.sf(
-                self.base / np.sqrt(np.diag(self.e)[2] / n), df=n - 2)
-            self.p_hsl = stats.t.cdf(
-                self.hsl / np.sqrt(np.diag(self.e)[3] / n), df=n - 2)
-            self.p_csl = stats.t.sf(
-                self.csl / np.sqrt(np.diag(self.e)[4] / n), df=n - 2)
-            # self.p_hcp = stats.t.cdf(abs(self.hcp - self.hcp_min) / np.sqrt(np.diag(self.e)[0]/n), df = n-2)
-            # self.p_ccp = stats.t.cdf(abs(self.ccp - self.ccp_max) / np.sqrt(np.diag(self.e)[1]/n), df = n-2)
+            self.calculate_p_values()
         except:
             self.has_fit = False
 
+    def calculate_p_values(self) -> None:
+        """Get p-value from t-test for the model coefficients"""
+        n = len(self.temperature)
+        self.p_base = stats.t.sf(
+            self.base / np.sqrt(np.diag(self.e)[2] / n), df=n - 2)
+        self.p_hsl = stats.t.cdf(
+            self.hsl / np.sqrt(np.diag(self.e)[3] / n), df=n - 2)
+        self.p_csl = stats.t.sf(
+            self.csl / np.sqrt(np.diag(self.e)[4] / n), df=n - 2)
+        # self.p_hcp = stats.t.cdf(abs(self.hcp - self.hcp_min) / np.sqrt(np.diag(self.e)[0]/n), df = n-2)
+        # self.p_ccp = stats.t.cdf(abs(self.ccp - self.ccp_max) / np.sqrt(np.diag(self.e)[1]/n), df = n-2)
+
+    @staticmethod
+    def prepare_segments(temperature: npt.ArrayLike,
+                         eui: npt.ArrayLike,
+                         mask: npt.ArrayLike | None = None) -> dict:
+        """Sorts each building's (row's) temperatures and builds the prefix sums the segmented
+        engine reads its candidate statistics from. Rows may be NaN padded or masked."""
+        x = np.atleast_2d(np.asarray(temperature, dtype=float))
+        y = np.atleast_2d(np.asarray(eui, dtype=float))
+        valid = np.isfinite(x) & np.isfinite(y)
+        if mask is not None:
+            valid &= np.atleast_2d(np.asarray(mask, dtype=bool))
+        x, y = np.where(valid, x, np.nan), np.where(valid, y, np.nan)
+
+        # Padding sorts to the end of each row
+        order = np.argsort(x, axis=1)
+        x = np.take_along_axis(x, order, axis=1)
+        y = np.take_along_axis(y, order, axis=1)
+        valid = np.take_along_axis(valid, order, axis=1)
+        n = valid.sum(axis=1)
+
+        # The temperature midpoint used for flat models
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(x, axis=1)
+            # Hinge terms are shift invariant, so center the temperatures to keep the sums well conditioned
+            shift = np.nan_to_num(np.nanmean(x, axis=1))
+        x = np.where(valid, x - shift[:, None], 0)
+        y = np.where(valid, y, 0)
+        columns = np.stack([valid.astype(float), x, x ** 2, y, x * y], axis=1)
+        prefix = np.concatenate([np.zeros(columns.shape[:2] + (1,)),
+                                 np.cumsum(columns, axis=2)], axis=2)
+
+        return {'x': np.where(valid, x, np.inf), 'valid': valid, 'shift': shift, 'n': n,
+                'prefix': prefix, 'sum_yy': np.sum(y ** 2, axis=1), 'median': median}
+
+    @staticmethod
+    def searchsorted_rows(x: np.ndarray,
+                          c: np.ndarray,
+                          side: Literal['left', 'right']) -> np.ndarray:
+        """np.searchsorted of each row of c into the same (sorted) row of x, in one call. As
+        row + 1j * value, complex numbers sort by row first and value second, so the flattened
+        rows stay sorted without shifting any value. Missing candidates come out as 0."""
+        def row_keys(values):
+            # Set the parts directly, 1j * inf would make the real part NaN
+            keys = np.empty(values.shape, dtype=complex)
+            keys.real = np.arange(len(values))[:, None]
+            keys.imag = values
+            return keys.ravel()
+
+        k = np.searchsorted(row_keys(x), row_keys(np.where(np.isnan(c), -np.inf, c)), side=side)
+        return k.reshape(c.shape) - np.arange(len(x))[:, None] * x.shape[1]
+
+    @staticmethod
+    def segment_statistics(segments: dict,
+                           candidates: np.ndarray) -> dict:
+        """The count, sum, sum of squares, sum of EUI and cross-product with EUI of the
+        (centered) temperatures at or below every candidate change-point, read off prefix sums
+        over the sorted temperatures, together with the totals they are completed from"""
+        x, prefix = segments['x'], segments['prefix']
+        k = InverseModel.searchsorted_rows(x, candidates - segments['shift'][:, None], 'right')
+        statistics = dict(zip(['count', 's_x', 's_xx', 's_y', 's_xy'], np.moveaxis(
+            np.take_along_axis(prefix, k[:, None, :], axis=2), 1, 0)))
+        statistics.update(zip(['n', 'sum_x', 'sum_xx', 'sum_y', 'sum_xy'],
+                              np.moveaxis(prefix[:, :, -1:], 1, 0)))
+        statistics.update({'sum_yy': segments['sum_yy'][:, None],
+                           'median': segments['median'][:, None],
+                           'shift': segments['shift'][:, None]})
+        return statistics
+
+    @staticmethod
+    def solve_segments(segments: dict,
+                       hcp_candidates: np.ndarray,
+                       ccp_candidates: np.ndarray,
+                       hcp_limits: np.ndarray,
+                       ccp_limits: np.ndarray,
+                       hsl_limits: np.ndarray,
+                       csl_limits: np.ndarray,
+                       base_min: float = 0) -> dict:
+        """Solves the linear least squares problem for base, hsl and csl at every candidate
+        change-point (pair) within the (B, 2) change-point limits and returns, per building, the
+        best solution with the slopes within the (B, 2) slope limits and base at least
+        base_min"""
+        statistics = InverseModel.segment_statistics(
+            segments, np.concatenate([hcp_candidates, ccp_candidates], axis=1))
+        return InverseModel.solve_statistics(statistics, hcp_candidates, ccp_candidates,
+                                             hcp_limits, ccp_limits,
+                                             hsl_limits, csl_limits, base_min)
+
+    @staticmethod
+    def solve_statistics(statistics: dict,
+                         hcp_candidates: np.ndarray,
+                         ccp_candidates: np.ndarray,
+                         hcp_limits: np.ndarray,
+                         ccp_limits: np.ndarray,
+                         hsl_limits: np.ndarray,
+                         csl_limits: np.ndarray,
+                         base_min: float = 0) -> dict:
+        """
+        solve_segments from precomputed sufficient statistics (see segment_statistics): totals
+        n, sum_x, sum_xx, sum_y, sum_yy, sum_xy, median and shift of shape (B, 1), and sums at
+        or below each candidate count, s_x, s_xx, s_y, s_xy of shape (B, C) over the heating
+        candidates followed by the cooling candidates.
+
+        As with the curve_fit bounds, a heating change-point must lie within hcp_limits and a
+        cooling one within ccp_limits. A slope is either solved for or held at one of its
+        limits, which together with the change-points on the candidates covers every solution
+        curve_fit can reach within its bounds.
+        """
+        n, sum_y, sum_yy = statistics['n'], statistics['sum_y'], statistics['sum_yy']
+        count, s_x, s_xx, s_y, s_xy = (statistics[key] for key in ['count', 's_x', 's_xx', 's_y', 's_xy'])
+        candidates = np.concatenate([hcp_candidates, ccp_candidates], axis=1)
+        c = candidates - statistics['shift']
+        m = hcp_candidates.shape[1]
+        hcp_valid = InverseModel.within(hcp_candidates, hcp_limits)
+        ccp_valid = InverseModel.within(ccp_candidates, ccp_limits)
+        both_valid = (InverseModel.within(candidates, hcp_limits) &
+                      InverseModel.within(candidates, ccp_limits))
+
+        # Heating term min(x - hcp, 0) is non-zero for points below the change-point
+        h = s_x - count * c
+        hh = s_xx - 2 * c * s_x + count * c ** 2
+        hy = s_xy - c * s_y
+        # Cooling term max(x - ccp, 0) is non-zero for points above the change-point
+        g = (statistics['sum_x'] - s_x) - (n - count) * c
+        gg = (statistics['sum_xx'] - s_xx) - 2 * c * (statistics['sum_x'] - s_x) + (n - count) * c ** 2
+        gy = (statistics['sum_xy'] - s_xy) - c * (sum_y - s_y)
+
+        def fixed_slopes(limits):
+            # Non-zero finite slope limits a solution can be held at, a zero slope is its own model
+            return [np.where(np.isfinite(limit) & (limit != 0), limit, np.nan)[:, None]
+                    for limit in limits.T if np.any(np.isfinite(limit) & (limit != 0))]
+
+        def solve(a, p, hy_, b, q, gy_, n_, sum_y_, sum_yy_, hsl=None, csl=None):
+            # The heating and cooling terms never overlap, so the normal equations have a
+            # closed-form solution. Slopes that are given are held fixed.
+            valid = n_ > 0
+            if hsl is not None:
+                sum_y_, sum_yy_ = sum_y_ - hsl * a, sum_yy_ - 2 * hsl * hy_ + hsl ** 2 * p
+                valid = valid & np.isfinite(hsl)
+            if csl is not None:
+                sum_y_, sum_yy_ = sum_y_ - csl * b, sum_yy_ - 2 * csl * gy_ + csl ** 2 * q
+                valid = valid & np.isfinite(csl)
+            if hsl is None and csl is None:
+                det = n_ * p * q - a ** 2 * q - b ** 2 * p
+                base = (sum_y_ * p * q - a * q * hy_ - b * p * gy_) / det
+                hsl, csl = (hy_ - a * base) / p, (gy_ - b * base) / q
+                sse = sum_yy_ - base * sum_y_ - hsl * hy_ - csl * gy_
+                valid = valid & (det > 0) & (p > 0) & (q > 0)
+            elif hsl is None:
+                det = n_ * p - a ** 2
+                hsl = (n_ * hy_ - a * sum_y_) / det
+                base = (sum_y_ - hsl * a) / n_
+                sse = sum_yy_ - base * sum_y_ - hsl * hy_
+                valid = valid & (det > 0) & (p > 0)
+            elif csl is None:
+                det = n_ * q - b ** 2
+                csl = (n_ * gy_ - b * sum_y_) / det
+                base = (sum_y_ - csl * b) / n_
+                sse = sum_yy_ - base * sum_y_ - csl * gy_
+                valid = valid & (det > 0) & (q > 0)
+            else:
+                base = sum_y_ / n_
+                sse = sum_yy_ - sum_y_ ** 2 / n_
+            return sse, valid, base, hsl, csl
+
+        faces = []
+        heating_slopes = [None] + fixed_slopes(hsl_limits)
+        cooling_slopes = [None] + fixed_slopes(csl_limits)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            hcp, ccp = np.broadcast_arrays(hcp_candidates[:, :, None], ccp_candidates[:, None, :])
+            pair_valid = hcp_valid[:, :, None] & ccp_valid[:, None, :]
+            n3, sum_y3, sum_yy3 = n[:, :, None], sum_y[:, :, None], sum_yy[:, :, None]
+            c_h, c_c = c[:, :m, None], c[:, None, m:]
+            # hcp > ccp: piecewise_linear drops the heating term above ccp, so it covers the
+            # points at or below ccp. inverse_cp turns such a fit into a 4P model.
+            crossed = [s_x[:, None, m:] - count[:, None, m:] * c_h,
+                       s_xx[:, None, m:] - 2 * c_h * s_x[:, None, m:] + count[:, None, m:] * c_h ** 2,
+                       s_xy[:, None, m:] - c_h * s_y[:, None, m:]]
+            for hsl_fixed in heating_slopes:
+                hsl_pair = None if hsl_fixed is None else hsl_fixed[:, :, None]
+                for csl_fixed in cooling_slopes:
+                    csl_pair = None if csl_fixed is None else csl_fixed[:, :, None]
+                    # 5P: every hcp < ccp pair
+                    sse, valid, base, hsl, csl = solve(
+                        h[:, :m, None], hh[:, :m, None], hy[:, :m, None],
+                        g[:, None, m:], gg[:, None, m:], gy[:, None, m:],
+                        n3, sum_y3, sum_yy3, hsl_pair, csl_pair)
+                    faces.append([sse, valid & pair_valid & (c_h < c_c), hcp, ccp, base, hsl, csl])
+                    # hcp > ccp
+                    sse, valid, base, hsl, csl = solve(
+                        *crossed, g[:, None, m:], gg[:, None, m:], gy[:, None, m:],
+                        n3, sum_y3, sum_yy3, hsl_pair, csl_pair)
+                    faces.append([sse, valid & pair_valid & (c_h > c_c), hcp, ccp, base, hsl, csl])
+                    # 4P: both change-points at the same candidate
+                    sse, valid, base, hsl, csl = solve(h, hh, hy, g, gg, gy, n, sum_y, sum_yy,
+                                                       hsl_fixed, csl_fixed)
+                    faces.append([sse, valid & both_valid, candidates, candidates, base, hsl, csl])
+
+            zeros = np.zeros_like(n)
+            for hsl_fixed in heating_slopes:
+                # 3P heating: cooling slope at zero
+                sse, valid, base, hsl, _ = solve(h[:, :m], hh[:, :m], hy[:, :m], zeros, zeros, zeros,
+                                                 n, sum_y, sum_yy, hsl_fixed, zeros)
+                faces.append([sse, valid & hcp_valid, hcp_candidates, hcp_candidates,
+                              base, hsl, np.zeros_like(sse)])
+            for csl_fixed in cooling_slopes:
+                # 3P cooling: heating slope at zero
+                sse, valid, base, _, csl = solve(zeros, zeros, zeros, g[:, m:], gg[:, m:], gy[:, m:],
+                                                 n, sum_y, sum_yy, zeros, csl_fixed)
+                faces.append([sse, valid & ccp_valid, ccp_candidates, ccp_candidates,
+                              base, np.zeros_like(sse), csl])
+
+            # Constant model: no temperature dependency
+            cp = statistics['median']
+            faces.append([sum_yy - sum_y ** 2 / n, n > 0, cp, cp, sum_y / n, zeros, zeros])
+
+        # Flatten every face per building and keep the best feasible candidate.
+        # Ties go to the earlier face (5P, hcp > ccp, 4P, 3P heating, 3P cooling, constant).
+        keys = ['sse', 'valid', 'hcp', 'ccp', 'base', 'hsl', 'csl']
+        stacked = {key: np.concatenate([np.reshape(np.broadcast_to(face[i], np.shape(face[0])),
+                                                   (len(n), -1)) for face in faces], axis=1)
+                   for i, key in enumerate(keys)}
+        with np.errstate(invalid='ignore'):
+            feasible = (stacked['valid'] & (stacked['base'] >= base_min) &
+                        InverseModel.within(stacked['hsl'], hsl_limits) &
+                        InverseModel.within(stacked['csl'], csl_limits))
+        sse = np.where(feasible, stacked['sse'], np.inf)
+        i = np.argmin(sse, axis=1)[:, None]
+        best = {key: np.take_along_axis(value, i, axis=1)[:, 0]
+                for key, value in stacked.items() if key != 'valid'}
+        best['sse'] = np.take_along_axis(sse, i, axis=1)[:, 0]
+        return best
+
+    @staticmethod
+    def within(candidates: np.ndarray,
+               limits: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid='ignore'):
+            return (candidates >= limits[:, :1]) & (candidates <= limits[:, 1:])
+
+    @staticmethod
+    def search_change_points(segments: dict,
+                             hcp_limits: np.ndarray,
+                             ccp_limits: np.ndarray,
+                             hsl_limits: np.ndarray,
+                             csl_limits: np.ndarray,
+                             cp_grid_size: int = 40,
+                             cp_grid_refinements: int = 2,
+                             base_min: float = 0) -> dict:
+        """Exhaustive change-point search within the (B, 2) heating and cooling change-point
+        limits: data points plus an even grid over each range, followed by zoom passes around
+        the best candidate"""
+        t = np.linspace(0, 1, cp_grid_size)
+
+        def grid(limits):
+            return limits[:, :1] + (limits[:, 1:] - limits[:, :1]) * t
+
+        def search(hcp_candidates, ccp_candidates):
+            return InverseModel.solve_segments(segments, hcp_candidates, ccp_candidates,
+                                               hcp_limits, ccp_limits,
+                                               hsl_limits, csl_limits, base_min)
+
+        points = np.where(segments['valid'], segments['x'] + segments['shift'][:, None], np.nan)
+        best = search(np.concatenate([grid(hcp_limits), points], axis=1),
+                      np.concatenate([grid(ccp_limits), points], axis=1))
+
+        # Zoom in around the best change-points
+        step_h = (hcp_limits[:, 1] - hcp_limits[:, 0]) / (cp_grid_size - 1)
+        step_c = (ccp_limits[:, 1] - ccp_limits[:, 0]) / (cp_grid_size - 1)
+        for _ in range(cp_grid_refinements):
+            hcp_range = np.clip(np.stack([best['hcp'] - step_h, best['hcp'] + step_h], axis=1),
+                                hcp_limits[:, :1], hcp_limits[:, 1:])
+            ccp_range = np.clip(np.stack([best['ccp'] - step_c, best['ccp'] + step_c], axis=1),
+                                ccp_limits[:, :1], ccp_limits[:, 1:])
+            refined = search(np.concatenate([grid(hcp_range), best['hcp'][:, None]], axis=1),
+                             np.concatenate([grid(ccp_range), best['ccp'][:, None]], axis=1))
+            improved = refined['sse'] <= best['sse']
+            best = {key: np.where(improved, refined[key], best[key]) for key in best}
+            step_h, step_c = 2 * step_h / (cp_grid_size - 1), 2 * step_c / (cp_grid_size - 1)
+
+        return best
+
+    @staticmethod
+    def parameter_covariance(temperature: np.ndarray,
+                             p: np.ndarray,
+                             sse: np.ndarray) -> np.ndarray:
+        """
+        Covariance of all five coefficients, change-points included, estimated as curve_fit
+        does: the pseudo-inverse of JᵀJ, with J the piecewise_linear_jacobian at p and zero
+        singular values dropped, scaled by sse / (n - 5). Takes (B, N) NaN padded temperatures,
+        (B, 5) coefficients and (B,) sums of squared residuals, returns (B, 5, 5).
+        """
+        valid = np.isfinite(temperature)
+        n = valid.sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            jacobian = InverseModel.piecewise_linear_jacobian(np.where(valid, temperature, 0), *p.T)
+        jacobian = np.where(valid[..., None] & np.isfinite(jacobian), jacobian, 0)
+        _, s, VT = np.linalg.svd(jacobian, full_matrices=False)
+        threshold = np.finfo(float).eps * np.maximum(n, 5)[:, None] * s[:, :1]
+        with np.errstate(divide='ignore'):
+            inverse_s2 = np.where(s > threshold, 1 / s ** 2, 0)
+        covariance = np.einsum('bki,bk,bkj->bij', VT, inverse_s2, VT)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(n > 5, sse / (n - 5), np.inf)
+            return covariance * scale[:, None, None]
+
+    def fit_segmented(self) -> None:
+        """Fits the changepoint model by an exhaustive search over a grid of candidate
+        change-points within the change-point bounds, solving each candidate by linear least
+        squares"""
+        x = np.asarray(self.temperature, dtype=float)
+        segments = self.prepare_segments(x, self.eui)
+        best = self.search_change_points(segments,
+                                         np.array([[self.hcp_min, self.hcp_max]]),
+                                         np.array([[self.ccp_min, self.ccp_max]]),
+                                         np.array([[self.hsl_min, self.hsl_max]]),
+                                         np.array([[self.csl_min, self.csl_max]]),
+                                         self.cp_grid_size,
+                                         self.cp_grid_refinements,
+                                         self.base_min)
+        self.set_segmented_solution({key: value[0] for key, value in best.items()})
+
+    def set_segmented_solution(self,
+                               best: dict) -> None:
+        """Stores one building's solve_segments result as the current fit"""
+        self.p = np.array([best['hcp'], best['ccp'], best['base'], best['hsl'], best['csl']])
+        self.hcp, self.ccp, self.base, self.hsl, self.csl = self.p
+        self.e = self.parameter_covariance(np.asarray(self.temperature, dtype=float)[None, :],
+                                           self.p[None, :], np.array([best['sse']]))[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.calculate_p_values()
+
+    def search_cp_window(self,
+                         point: Literal['L', 'R'],
+                         percentiles: list[list[float]]) -> list[float]:
+        """
+        optimize_cp_limit for the segmented engine. One search over all the percentile windows
+        finds the best change-point, which the window holding it (the first one if two do) then
+        bounds, as curve_fit's best window would.
+        """
+        self.set_cp_limit(point, [percentiles[0][0], percentiles[-1][1]])
+        self.fit()
+        cp = self.hcp if point == "L" else self.ccp
+        upper = np.percentile(self.temperature, [per[1] for per in percentiles])
+        optimum_limits = percentiles[min(np.searchsorted(upper, cp), len(percentiles) - 1)]
+        self.set_cp_limit(point, optimum_limits)
+        self.fit()
+        return optimum_limits
+
+    @staticmethod
+    def cp_limit_windows(point: Literal['L', 'R']) -> list[list[float]]:
+        """The percentile windows optimize_cp_limit tries for the heating (L) or cooling (R) change-point"""
+        if point == "R":
+            return [[i, i + 5] for i in np.arange(30, 90, 5)]
+        return [[i, i + 5] for i in np.arange(10, 70, 5)]
+
+    @staticmethod
+    def fit_batch(temperature: npt.ArrayLike | list,
+                  eui: npt.ArrayLike | list,
+                  mask: npt.ArrayLike | None = None,
+                  r_squared_threshold: float = 0.1,
+                  cp_grid_size: int = 40,
+                  cp_grid_refinements: int = 2,
+                  chunk_size: int = 128) -> pd.DataFrame:
+        """Fits the change-point models of many buildings at once with the segmented engine.
+
+        Takes (buildings x periods) temperature and EUI matrices, NaN padded or masked for
+        unequal bill counts (a list of 1-D arrays is padded automatically), and follows the
+        same steps as fit_model. Returns one row per building with the model coefficients
+        (hsl keeps its sign, as in model_p), R-squared, p-values and model type string."""
+        if isinstance(temperature, list) or isinstance(eui, list):
+            width = max([np.size(v) for v in temperature] + [0])
+
+            def pad(rows):
+                padded = np.full((len(rows), width), np.nan)
+                for i, v in enumerate(rows):
+                    padded[i, :np.size(v)] = v
+                return padded
+
+            temperature, eui = pad(temperature), pad(eui)
+        temperature, eui = np.atleast_2d(temperature), np.atleast_2d(eui)
+        if temperature.shape != eui.shape:
+            raise Exception(
+                "EUI and Temperature arrays must have the same shape")
+        if mask is not None:
+            mask = np.atleast_2d(mask)
+
+        tables = []
+        for start in range(0, len(temperature), chunk_size):
+            rows = slice(start, start + chunk_size)
+            tables.append(InverseModel._fit_batch_chunk(
+                temperature[rows], eui[rows], None if mask is None else mask[rows],
+                r_squared_threshold, cp_grid_size, cp_grid_refinements))
+        if not tables:
+            return pd.DataFrame(columns=['hcp', 'ccp', 'base', 'hsl', 'csl', 'r2', 'p_base',
+                                         'p_hsl', 'p_csl', 'n', 'has_fit', 'model_type'])
+        return pd.concat(tables, ignore_index=True)
+
+    @staticmethod
+    def _fit_batch_chunk(temperature, eui, mask, r_squared_threshold,
+                         cp_grid_size, cp_grid_refinements) -> pd.DataFrame:
+        segments = InverseModel.prepare_segments(temperature, eui, mask)
+        n = segments['n']
+        has_data = n > 0
+        x = np.where(np.isfinite(temperature) & np.isfinite(eui) &
+                     (True if mask is None else mask), temperature, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sum_y = segments['prefix'][:, 3, -1]
+            ss_tot = segments['sum_yy'] - sum_y ** 2 / n
+
+        def percentiles(q):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                return np.nanpercentile(x, q, axis=1).T
+
+        # Change-point limits as in a new InverseModel, see set_cp_limit
+        hcp_limits = ccp_limits = percentiles([45, 55])
+        fit_heating, fit_cooling = has_data.copy(), has_data.copy()
+        best = {}
+
+        def search(rows):
+            subset = {key: value[rows] for key, value in segments.items()}
+            # Insignificant slopes are bounded near zero, see update_slope_significance
+            hsl_limits = np.stack([np.where(fit_heating[rows], -np.inf, -10 ** -3),
+                                   np.zeros(len(rows))], axis=1)
+            csl_limits = np.stack([np.zeros(len(rows)),
+                                   np.where(fit_cooling[rows], np.inf, 10 ** -3)], axis=1)
+            result = InverseModel.search_change_points(subset, hcp_limits[rows], ccp_limits[rows],
+                                                       hsl_limits, csl_limits,
+                                                       cp_grid_size, cp_grid_refinements)
+            for key, value in result.items():
+                best.setdefault(key, np.full(len(n), np.nan))[rows] = value
+
+        def p_values():
+            p = np.stack([best[key] for key in ['hcp', 'ccp', 'base', 'hsl', 'csl']], axis=1)
+            variance = np.diagonal(InverseModel.parameter_covariance(x, p, best['sse']),
+                                   axis1=1, axis2=2)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (stats.t.sf(best['base'] / np.sqrt(variance[:, 2] / n), df=n - 2),
+                        stats.t.cdf(best['hsl'] / np.sqrt(variance[:, 3] / n), df=n - 2),
+                        stats.t.sf(best['csl'] / np.sqrt(variance[:, 4] / n), df=n - 2))
+
+        def optimize_slopes():
+            # Only buildings whose slopes changed are searched again
+            nonlocal fit_heating, fit_cooling
+            _, p_hsl, p_csl = p_values()
+            heating, cooling = fit_heating & (p_hsl < 0.05), fit_cooling & (p_csl < 0.05)
+            changed = np.flatnonzero(has_fit & ((heating != fit_heating) | (cooling != fit_cooling)))
+            fit_heating, fit_cooling = heating, cooling
+            if len(changed):
+                search(changed)
+
+        def optimize_cp_limit(point):
+            # One search over all the windows, then a refit within the window holding the
+            # best change-point, as in search_cp_window
+            nonlocal hcp_limits, ccp_limits
+            windows = InverseModel.cp_limit_windows(point)
+            union = percentiles([windows[0][0], windows[-1][1]])
+            if point == "L":
+                hcp_limits = np.where(has_fit[:, None], union, hcp_limits)
+            else:
+                ccp_limits = np.where(has_fit[:, None], union, ccp_limits)
+            search(rows)
+            upper = percentiles([per[1] for per in windows])
+            cp = best['hcp'] if point == "L" else best['ccp']
+            with np.errstate(invalid='ignore'):
+                i = np.minimum(np.sum(upper < cp[:, None], axis=1), len(windows) - 1)
+            limits = percentiles(np.ravel(windows)).reshape(len(n), len(windows), 2)
+            limits = np.take_along_axis(limits, i[:, None, None], axis=1)[:, 0]
+            if point == "L":
+                hcp_limits = np.where(has_fit[:, None], limits, hcp_limits)
+            else:
+                ccp_limits = np.where(has_fit[:, None], limits, ccp_limits)
+            search(rows)
+
+        # Same sequence as fit_model: initial fit, a slope significance pass, the heating and
+        # cooling change-point windows and a second slope significance pass. Insignificant
+        # slopes stay bounded for good.
+        search(np.arange(len(n)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_fit = has_data & (1 - best['sse'] / ss_tot >= r_squared_threshold)
+        rows = np.flatnonzero(has_fit)
+        optimize_slopes()
+        if len(rows):
+            optimize_cp_limit("L")
+            optimize_cp_limit("R")
+        optimize_slopes()
+
+        hcp, ccp, base, hsl, csl = best['hcp'], best['ccp'], best['base'], best['hsl'], best['csl']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r2 = 1 - best['sse'] / ss_tot
+        p_base, p_hsl, p_csl = p_values()
+        # As in clean_insignificant_slopes and inverse_cp
+        hcp, hsl = np.where(fit_heating, hcp, ccp), np.where(fit_heating, hsl, 0)
+        ccp, csl = np.where(fit_cooling, ccp, hcp), np.where(fit_cooling, csl, 0)
+        flat = ~fit_heating & ~fit_cooling
+        hcp, ccp = np.where(flat, 0, hcp), np.where(flat, 0, ccp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossed = fit_heating & fit_cooling & (hcp > ccp)
+            cp = (hsl * hcp - csl * ccp) / (hsl - csl)
+        hcp, ccp = np.where(crossed, cp, hcp), np.where(crossed, cp, ccp)
+
+        same_cp = hcp == ccp
+        model_type = np.select([~has_fit,
+                                same_cp & (hsl == 0),
+                                same_cp & (csl == 0),
+                                same_cp & (hsl != 0) & (csl != 0),
+                                ~same_cp & (hsl != 0) & (csl != 0)],
+                               ['No fit', '3P Cooling', '3P Heating', '4P', '5P'],
+                               default='No fit')
+        has_fit &= model_type != 'No fit'
+
+        table = pd.DataFrame({'hcp': hcp, 'ccp': ccp, 'base': base, 'hsl': hsl, 'csl': csl,
+                              'r2': r2, 'p_base': p_base, 'p_hsl': p_hsl, 'p_csl': p_csl,
+                              'n': n, 'has_fit': has_fit, 'model_type': model_type})
+        table.loc[~has_fit, ['hcp', 'ccp', 'base', 'hsl', 'csl']] = np.nan
+        return table
+
+    def set_cp_limit(self,
+                     point: Literal['L', 'R'],
+                     percentiles: list[float]) -> None:
+        """Sets the heating (L) or cooling (R) change-point bounds to a percentile window"""
+        cp_limit_min, cp_limit_max = np.percentile(self.temperature, percentiles)
+        if point == "L":
+            self.hcp_min = cp_limit_min  # Heating change-point minimum
+            self.hcp_max = cp_limit_max  # Heating change-point maximum
+        elif point == "R":
+            self.ccp_min = cp_limit_min  # Cooling change-point minimum
+            self.ccp_max = cp_limit_max  # Cooling change-point maximum
+
     def optimize_cp_limit(self,
                           point: Literal['L', 'R']) -> list[float]:
         """Finds the optimum range for heating and cooling change-points bounds"""
 
-        if point == "R":
-            percentiles = [[i, i + 5] for i in np.arange(30, 90, 5)]
-        else:
-            percentiles = [[i, i + 5] for i in np.arange(10, 70, 5)]
+        percentiles = self.cp_limit_windows(point)
+
+        if self.engine == 'segmented':
+            return self.search_cp_window(point, percentiles)
+        if self.cp_search == 'coarse_to_fine':
+            return self.search_cp_limit(point, percentiles)
 
         var = []
         # print('optimize cp limits')
         for per in percentiles:
-            cp_limit_min, cp_limit_max = np.percentile(self.temperature, per)
             # print('Percentile = {}, search range: {:04.2f} - {:04.2f}, rmse = {:04.3f}'.format( per, cp_limit_min, cp_limit_max, self.rmse()))
-
-            if point == "L":
-                self.hcp_min = cp_limit_min  # Heating change-point minimum
-                self.hcp_max = cp_limit_max  # Heating change-point maximum
-            elif point == "R":
-                self.ccp_min = cp_limit_min  # Cooling change-point minimum
-                self.ccp_max = cp_limit_max  # Cooling change-point maximum
+            self.set_cp_limit(point, per)
 
             self.fit()
             # print(self.p)
@@ -169,23 +775,70 @@ class InverseModel:
             var.append(r2)
 
         optimum_limits = percentiles[var.index(max(var))]
-        cp_limit_min, cp_limit_max = np.percentile(
-            self.temperature, optimum_limits)
-        if point == "L":
-            self.hcp_min = cp_limit_min  # Heating change-point minimum
-            self.hcp_max = cp_limit_max  # Heating change-point maximum
-        elif point == "R":
-            self.ccp_min = cp_limit_min  # Cooling change-point minimum
-            self.ccp_max = cp_limit_max  # Cooling change-point maximum
+        self.set_cp_limit(point, optimum_limits)
 
         self.fit()
         return optimum_limits
 
+    def search_cp_limit(self,
+                        point: Literal['L', 'R'],
+                        percentiles: list[list[float]]) -> list[float]:
+        """Coarse-to-fine version of optimize_cp_limit.
+
+        Every cp_search_stride-th window is fitted first, then the search walks from the
+        best coarse window towards its better neighbour until R-squared improves by less
+        than r2_tolerance. Each fit is seeded with the previous solution, and the best
+        window's fit is restored instead of being solved again.
+        """
+        fitted = {}
+        p0 = getattr(self, 'p', None)
+        attributes = ['p', 'e', 'hcp', 'ccp', 'base', 'hsl', 'csl',
+                      'p_base', 'p_hsl', 'p_csl', 'has_fit']
+
+        def evaluate(i: int) -> float:
+            nonlocal p0
+            if i not in fitted:
+                self.set_cp_limit(point, percentiles[i])
+                self.fit(p0)
+                p0 = self.p
+                r2 = self.calcuate_r_squared()
+                fitted[i] = r2, {a: getattr(self, a, None) for a in attributes}
+            return fitted[i][0]
+
+        coarse = list(range(0, len(percentiles), self.cp_search_stride))
+        if coarse[-1] != len(percentiles) - 1:
+            coarse.append(len(percentiles) - 1)
+        best = max(coarse, key=evaluate)
+
+        while True:
+            neighbours = [i for i in (best - 1, best + 1)
+                          if 0 <= i < len(percentiles)]
+            candidate = max(neighbours, key=evaluate)
+            if evaluate(candidate) - evaluate(best) <= self.r2_tolerance:
+                break
+            best = candidate
+
+        optimum_limits = percentiles[best]
+        self.set_cp_limit(point, optimum_limits)
+        for attribute, value in fitted[best][1].items():
+            setattr(self, attribute, value)
+        self.r2 = fitted[best][0]
+
+        # A full sweep solves every window plus a final refit at the optimum
+        self.fits_saved += len(percentiles) + 1 - len(fitted)
+        return optimum_limits
+
     def fit_model(self,
                   r_squared_threshold: float = 0.1):
         # Handle outliers (TBD)
 
         # Fit change-point model
+        self.cp_statistics = None  # Incremental refits start over from this fit
+        return self.fit_change_points(r_squared_threshold)
+
+    def fit_change_points(self,
+                          r_squared_threshold: float = 0.1):
+        """The fit_model steps, from the current bounds"""
         self.fit()  # Initial guess
         self.p_init = self.p
 
@@ -204,9 +857,133 @@ class InverseModel:
         # Save final model coefficients
         return self.has_fit
 
+    def build_cp_statistics(self) -> None:
+        """
+        Builds the per-candidate sufficient statistics used by add_periods and remove_periods.
+
+        The candidate change-points are fixed here: an even grid of cp_statistics_grid_size
+        points over the temperature span, the current temperatures and the fitted change-points.
+        For every candidate the count, sum, sum of squares, sum of EUI and cross-product with
+        EUI of the temperatures at or below it are kept (see segment_statistics), so adding or
+        removing periods only updates sums.
+        """
+        x = np.asarray(self.temperature, dtype=float)
+        y = np.asarray(self.eui, dtype=float)
+        fitted = self.p[:2] if hasattr(self, 'p') else []
+        candidates = np.concatenate([np.linspace(np.nanmin(x), np.nanmax(x), self.cp_statistics_grid_size),
+                                     x, fitted])
+        candidates = np.unique(candidates[np.isfinite(candidates)])
+
+        self.cp_statistics = {'shift': np.nanmean(x), 'candidates': candidates}
+        for key in ['n', 'sum_x', 'sum_xx', 'sum_y', 'sum_yy', 'sum_xy']:
+            self.cp_statistics[key] = 0.0
+        for key in ['count', 's_x', 's_xx', 's_y', 's_xy']:
+            self.cp_statistics[key] = np.zeros(len(candidates))
+        self.accumulate_cp_statistics(x, y, 1)
+
+    def accumulate_cp_statistics(self,
+                                 temperature: np.ndarray,
+                                 eui: np.ndarray,
+                                 sign: Literal[1, -1]) -> None:
+        """Adds (sign=1) or subtracts (sign=-1) the contribution of some periods"""
+        st = self.cp_statistics
+        x, y = temperature - st['shift'], eui
+        below = (x[None, :] <= (st['candidates'] - st['shift'])[:, None]).astype(float)
+        for key, value in zip(['n', 'sum_x', 'sum_xx', 'sum_y', 'sum_yy', 'sum_xy'],
+                              [np.ones_like(x), x, x ** 2, y, y ** 2, x * y]):
+            st[key] += sign * np.sum(value)
+        for key, value in zip(['count', 's_x', 's_xx', 's_y', 's_xy'],
+                              [np.ones_like(x), x, x ** 2, y, x * y]):
+            st[key] += sign * (below @ value)
+
+    def fit_cp_statistics(self) -> None:
+        """Re-picks the best candidate change-points from the sufficient statistics, within
+        the change-point bounds"""
+        st = self.cp_statistics
+        hcp_limits = np.array([[self.hcp_min, self.hcp_max]])
+        ccp_limits = np.array([[self.ccp_min, self.ccp_max]])
+        # Only the candidates inside the bounds take part in the solve
+        heating = np.flatnonzero(self.within(st['candidates'][None, :], hcp_limits)[0])
+        cooling = np.flatnonzero(self.within(st['candidates'][None, :], ccp_limits)[0])
+        columns, m = np.concatenate([heating, cooling]), len(heating)
+
+        statistics = {key: np.reshape(st[key], (1, 1))
+                      for key in ['n', 'sum_x', 'sum_xx', 'sum_y', 'sum_yy', 'sum_xy', 'shift']}
+        statistics.update({key: st[key][None, columns] for key in ['count', 's_x', 's_xx', 's_y', 's_xy']})
+        statistics['median'] = np.reshape(np.median(self.temperature), (1, 1))
+        candidates = st['candidates'][None, columns]
+        best = self.solve_statistics(statistics,
+                                     candidates[:, :m], candidates[:, m:],
+                                     hcp_limits, ccp_limits,
+                                     np.array([[self.hsl_min, self.hsl_max]]),
+                                     np.array([[self.csl_min, self.csl_max]]),
+                                     self.base_min)
+        self.set_segmented_solution({key: value[0] for key, value in best.items()})
+
+    def add_periods(self,
+                    temperature: npt.ArrayLike,
+                    eui: npt.ArrayLike,
+                    r_squared_threshold: float = 0.1) -> bool:
+        """Adds billing periods to a fitted model and refits it incrementally"""
+        temperature = np.atleast_1d(np.asarray(temperature, dtype=float))
+        eui = np.atleast_1d(np.asarray(eui, dtype=float))
+        if (np.size(eui) != np.size(temperature)):
+            raise Exception(
+                "EUI and Temperature arrays must have the same length")
+
+        self.require_cp_statistics()
+        self.accumulate_cp_statistics(temperature, eui, 1)
+        self.temperature = np.concatenate([np.asarray(self.temperature, dtype=float), temperature])
+        self.eui = np.concatenate([np.asarray(self.eui, dtype=float), eui])
+        return self.refit_incremental(r_squared_threshold)
+
+    def remove_periods(self,
+                       index: npt.ArrayLike | slice,
+                       r_squared_threshold: float = 0.1) -> bool:
+        """Removes billing periods by position (e.g. [0] for the oldest) and refits incrementally"""
+        x = np.asarray(self.temperature, dtype=float)
+        y = np.asarray(self.eui, dtype=float)
+        keep = np.ones(len(x), dtype=bool)
+        keep[index] = False
+
+        self.require_cp_statistics()
+        self.accumulate_cp_statistics(x[~keep], y[~keep], -1)
+        self.temperature, self.eui = x[keep], y[keep]
+        return self.refit_incremental(r_squared_threshold)
+
+    def require_cp_statistics(self) -> None:
+        if self.engine != 'segmented':
+            raise Exception("Incremental refits require the segmented engine")
+        if self.cp_statistics is None:
+            if not hasattr(self, 'p'):
+                raise Exception("Fit the model before adding or removing periods")
+            self.build_cp_statistics()
+
+    def refit_incremental(self,
+                          r_squared_threshold: float = 0.1) -> bool:
+        """
+        Repeats the fit_model steps against the sufficient statistics instead of searching
+        again. Change-points are limited to the candidates fixed by build_cp_statistics, so a
+        full fit_model now and then lets the candidates follow a drifting temperature range.
+        """
+        # Start over from the bounds of a new model on the current temperatures
+        self.hsl_insignificant = self.csl_insignificant = False
+        self.hsl_min, self.csl_max = -np.inf, np.inf
+        for point in ["L", "R"]:
+            self.set_cp_limit(point, [self.hcp_bound_percentile, self.ccp_bound_percentile])
+        self.has_fit = False
+        return self.fit_change_points(r_squared_threshold)
+
     def optimize_slopes(self):
         """Optimize the slopes of the changepoint model"""
 
+        self.update_slope_significance()
+        self.fit()
+        self.clean_insignificant_slopes()
+
+    def update_slope_significance(self):
+        """Flags (and bounds) slopes that are not significant in the current fit"""
+
         if (not (self.significant(self.p_hsl)) or math.isnan(self.p_hsl)):
             # print("--->Left slope is not significant! - P=", self.p_hsl)
             self.hsl_min = -10 ** -3
@@ -217,7 +994,8 @@ class InverseModel:
             self.csl_max = 10 ** -3
             self.csl_insignificant = True
 
-        self.fit()
+    def clean_insignificant_slopes(self):
+        """Zeroes the slopes flagged as not significant and collapses their change-points"""
 
         if self.hsl_insignificant:
             self.hcp = self.ccp
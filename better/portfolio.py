@@ -15,11 +15,12 @@ import pandas as pd
 import numpy as np
 from collections import OrderedDict
 
-from better.constants import Constants
 from better.building import Building
 from better.utility import Utility
-from better.weather import Weather
+from better.weather import Weather, WeatherPrefetch
 from better.benchmark import Benchmark
+from better.cache import ModelCache
+import better.geocoding as geocoding
 
 
 class Portfolio:
@@ -53,6 +54,37 @@ class Portfolio:
         self.df_detail = self.df_detail[np.isfinite(
             self.df_detail['building_ID'])]
 
+        self.build_index()
+
+    def build_index(self) -> None:
+        """
+        Indexes df_meta by building ID and splits df_detail by (building ID, energy type) in one
+        groupby pass, converting consumption to kWh along the way. Units that could not be
+        converted are listed in unknown_units. Call again after changing df_meta or df_detail.
+        """
+        # Warning: duplicate building ID will be droped!
+        self.df_meta_by_id = self.df_meta.drop_duplicates(
+            'building_ID', keep='first').set_index('building_ID', drop=False)
+
+        # Convert the energy unit to kwh for all bills at once
+        self.df_detail['energy_unit'] = self.df_detail['energy_unit'].astype('category')
+        df_temp = self.df_detail[['bill_start_dates', 'bill_end_dates', 'energy_consumption',
+                                  'energy_cost']].copy()
+        df_temp['energy_consumption'], self.unknown_units = Utility.convert_to_kWh(
+            df_temp['energy_consumption'], self.df_detail['energy_unit'])
+        # Format the dataframe to match the raw utility data frame
+        df_temp.columns = ["Monthly Billing Start Date", "Monthly Billing End Date",
+                           "kWh", "Cost"]
+
+        # energy_type: 1 ~ electricity; 2 ~ fossil fuel
+        # All fossil fuels of a building are grouped together here.
+        # Need to address how to combine multiple fossil fuel with different billing periods
+        # Current solution: proportionally allocate the by the number of days in each calendar month
+        energy_type = np.where(
+            self.df_detail['energy_type'] == 'Electricity - Grid Purchased', 1, 2)
+        self.utility_index = {key: df_group for key, df_group in
+                              df_temp.groupby([self.df_detail['building_ID'].to_numpy(), energy_type])}
+
     def get_utility_by_building_id_and_energy_type(self,
                                                    # Should change building_id to a string throughout to make it more flexible
                                                    building_id: str | int,
@@ -62,65 +94,39 @@ class Portfolio:
         """
 
         # energy_type: 1 ~ electricity; 2 ~ fossil fuel
-        df_temp = self.df_detail.loc[self.df_detail['building_ID']
-                                     == building_id]
-        df_temp = df_temp[['bill_start_dates', 'bill_end_dates', 'energy_type',
-                           'energy_unit', 'energy_consumption', 'energy_cost']]
-        if (energy_type == 1):
-            df_temp = df_temp.loc[df_temp['energy_type']
-                                  == 'Electricity - Grid Purchased']
-            if df_temp.empty:
-                return None
-        else:
-            df_temp = df_temp.loc[df_temp['energy_type']
-                                  != 'Electricity - Grid Purchased']
-            if df_temp.empty:
-                return None
-
-            '''
-            Need to address how to combine multiple fossil fuel with different billing periods
-            Current solution: proportionally allocate the by the number of days in each calendar month
-            '''
-        # Convert the energy unit to kwh
-        df_temp.loc[df_temp['energy_unit'] == 'MJ',
-                    'energy_consumption'] *= Constants.MJ_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'GJ',
-                    'energy_consumption'] *= Constants.GJ_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'MWh',
-                    'energy_consumption'] *= Constants.MWH_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'Btu',
-                    'energy_consumption'] *= Constants.Btu_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'MMBtu',
-                    'energy_consumption'] *= Constants.MMBtu_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'Cubic Meters',
-                    'energy_consumption'] *= Constants.M3_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'Therms',
-                    'energy_consumption'] *= Constants.Therms_to_kWh
-        df_temp.loc[df_temp['energy_unit'] == 'Decatherms',
-                    'energy_consumption'] *= Constants.Decatherms_to_kWh
-
-        # Format the dataframe to match the raw utility data frame
-        df_temp = df_temp[['bill_start_dates', 'bill_end_dates',
-                           'energy_consumption', 'energy_cost']]
-        df_temp.columns = ["Monthly Billing Start Date", "Monthly Billing End Date",
-                           "kWh", "Cost"]
-
-        return df_temp
+        # The returned frame is shared with the index, so copy it before modifying it.
+        if not hasattr(self, 'utility_index'):
+            self.build_index()
+        return self.utility_index.get((building_id, 1 if energy_type == 1 else 2))
 
     def get_building_info_by_id(self, building_ID):
+        if not hasattr(self, 'df_meta_by_id'):
+            self.build_index()
         try:
-            df_temp = self.df_meta.loc[self.df_meta['building_ID']
-                                       == building_ID]
-            building_info = df_temp.iloc[0]['building_name'], \
-                df_temp.iloc[0]['building_address'], \
-                df_temp.iloc[0]['building_space_type_1st'], \
-                df_temp.iloc[0]['building_area'], \
-                df_temp.iloc[0]['currency']
-        except:
+            row = self.df_meta_by_id.loc[building_ID]
+            building_info = row['building_name'], \
+                row['building_address'], \
+                row['building_space_type_1st'], \
+                row['building_area'], \
+                row['currency']
+        except KeyError:
             building_info = None
             print('Cannot find the building with ID: ' + str(building_ID))
         return building_info
 
+    def get_building_data_by_id(self, building_id):
+        """
+        Returns the data run_single needs for one building: (building_info, electricity
+        utility data, fossil fuel utility data), or None if the building is not found.
+        Slicing a portfolio that has been read once avoids re-parsing the workbook per building.
+        """
+        building_info = self.get_building_info_by_id(building_id)
+        if building_info is None:
+            return None
+        return (building_info,
+                self.get_utility_by_building_id_and_energy_type(building_id, 1),
+                self.get_utility_by_building_id_and_energy_type(building_id, 2))
+
     def fit_model_for_buildings(self):
         # Fit change-point model for all buildings by default
         return 42
@@ -144,19 +150,19 @@ class Portfolio:
 
         # Save the raw utility data in dictionaries
         dict_raw_utility = {}
-        dict_raw_fossil_fuel = {}
-        df_temp_meta = self.df_meta
+        if not hasattr(self, 'df_meta_by_id'):
+            self.build_index()
 
         # Warning: duplicate building ID will be droped!
-        df_temp_meta = df_temp_meta.drop_duplicates(
-            'building_ID', keep='first')
+        df_temp_meta = self.df_meta_by_id
         df_temp_meta = df_temp_meta[(df_temp_meta['building_space_type_1st'] == space_type) &
                                     (df_temp_meta['building_ID'].notnull()) &
                                     (df_temp_meta['building_address'].notnull()) &
                                     (df_temp_meta['building_area'].notnull())]
 
         # Add raw utility data into the dictionaries
-        for i in df_temp_meta['building_ID']:
+        for row in df_temp_meta.itertuples(index=False):
+            i = row.building_ID
             if (utility_type == 1):
                 df_temp_detail_utility = (
                     self.get_utility_by_building_id_and_energy_type(i, 1))
@@ -168,13 +174,10 @@ class Portfolio:
                 utility_temp = Utility(
                     'fossil fuel', df_temp_detail_utility)
 
-            index = df_temp_meta[df_temp_meta['building_ID'] == i].index.tolist()[
-                0]
-
-            dict_temp_utility = {i: (df_temp_meta.iloc[index]['building_address'],
-                                     df_temp_meta.iloc[index]['building_area'],
+            dict_temp_utility = {i: (row.building_address,
+                                     row.building_area,
                                      space_type,
-                                     df_temp_meta.iloc[index]['currency'],
+                                     row.currency,
                                      utility_type,
                                      utility_temp
                                      )}
@@ -183,7 +186,9 @@ class Portfolio:
 
     @staticmethod
     def generate_building_models(dict_raw_utility: dict,
-                                 use_cached_weather: bool = True):
+                                 use_cached_weather: bool = True,
+                                 model_cache: ModelCache | None = None,
+                                 weather_prefetch: WeatherPrefetch | None = None):
         # This function may take several minutes, print the progress
         v_building_ID = list(dict_raw_utility.keys())
         v_EUI = np.empty(0)
@@ -193,14 +198,17 @@ class Portfolio:
         v_beta_beth = np.empty(0)
         v_beta_cdd = np.empty(0)
         v_beta_hdd = np.empty(0)
-        i = 0
 
-        for bldg_id in v_building_ID:
-            i += 1
-            print('----------------------------------------------------')
-            print("Fitting change-point model for all buildings.")
-            print("Building ID: " + str(bldg_id))
+        # Resolve each distinct address once, the buildings then find theirs in the geocode cache
+        geocoding.default_geocoder.resolve_many(
+            dict_raw_utility[bldg_id][0] for bldg_id in v_building_ID
+            if hasattr(dict_raw_utility[bldg_id][5], "df_raw_data"))
 
+        # Set up the buildings first, so that the weather they need is downloaded in one go
+        if not use_cached_weather and weather_prefetch is None:
+            weather_prefetch = WeatherPrefetch()
+        v_buildings = []
+        for i, bldg_id in enumerate(v_building_ID, 1):
             bldg_name = str(bldg_id) + '_dummy_name'
             bldg_address = dict_raw_utility[bldg_id][0]
             bldg_area = dict_raw_utility[bldg_id][1]
@@ -213,28 +221,39 @@ class Portfolio:
                 # Proceed only if there is utility data for the current building
                 building_temp = Building(
                     bldg_id, bldg_name, bldg_address, bldg_type, bldg_area, currency)
-                weather_temp = Weather(building_temp.coord)
+                weather_temp = Weather(building_temp.coord, weather_prefetch=weather_prefetch)
                 building_temp.add_utility(utility_temp)
-                building_temp.add_weather(
-                    weather_e=weather_temp, cached=use_cached_weather)
-                has_fit = building_temp.fit_inverse_model()
-                if (has_fit):
-                    v_EUI = np.append(v_EUI, np.nan)
-                    v_Model = np.append(v_Model, str(bldg_id))
-                    v_beta_base = np.append(
-                        v_beta_base, building_temp.im_electricity.coeffs['base'])
-                    v_beta_betc = np.append(
-                        v_beta_betc, building_temp.im_electricity.coeffs['ccp'])
-                    v_beta_beth = np.append(
-                        v_beta_beth, building_temp.im_electricity.coeffs['hcp'])
-                    v_beta_cdd = np.append(
-                        v_beta_cdd, building_temp.im_electricity.coeffs['csl'])
-                    v_beta_hdd = np.append(
-                        v_beta_hdd, building_temp.im_electricity.coeffs['hsl'])
-                print(str(i) + '/' + str(len(v_building_ID)) + " completed.")
+                if not use_cached_weather:
+                    weather_prefetch.plan_weather(
+                        weather_temp, building_temp.utility_electricity.df_periods)
+                v_buildings.append((i, bldg_id, building_temp, weather_temp))
             else:
-                print("No " + utility_type + " utility data found for current building, ",
+                print("No " + utility_type + " utility data found for building " + str(bldg_id) + ", ",
                       str(i) + '/' + str(len(v_building_ID)) + " completed.")
+        if not use_cached_weather:
+            weather_prefetch.fetch()
+
+        for i, bldg_id, building_temp, weather_temp in v_buildings:
+            print('----------------------------------------------------')
+            print("Fitting change-point model for all buildings.")
+            print("Building ID: " + str(bldg_id))
+            building_temp.add_weather(
+                weather_e=weather_temp, cached=use_cached_weather)
+            has_fit = building_temp.fit_inverse_model(model_cache)
+            if (has_fit):
+                v_EUI = np.append(v_EUI, np.nan)
+                v_Model = np.append(v_Model, str(bldg_id))
+                v_beta_base = np.append(
+                    v_beta_base, building_temp.im_electricity.coeffs['base'])
+                v_beta_betc = np.append(
+                    v_beta_betc, building_temp.im_electricity.coeffs['ccp'])
+                v_beta_beth = np.append(
+                    v_beta_beth, building_temp.im_electricity.coeffs['hcp'])
+                v_beta_cdd = np.append(
+                    v_beta_cdd, building_temp.im_electricity.coeffs['csl'])
+                v_beta_hdd = np.append(
+                    v_beta_hdd, building_temp.im_electricity.coeffs['hsl'])
+            print(str(i) + '/' + str(len(v_building_ID)) + " completed.")
 
         d_bench_coeffs = {'EUI': v_EUI,
                           'Model': v_Model,
@@ -246,6 +265,18 @@ class Portfolio:
         df_bench_coeffs = pd.DataFrame(d_bench_coeffs)
         return df_bench_coeffs
 
+    @staticmethod
+    def benchmark_building_models(df_building_models: pd.DataFrame,
+                                  df_bench_stats: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        Benchmarks every building of generate_building_models against the peer statistics, by
+        default those of the same buildings. Returns Benchmark.benchmark_table indexed by
+        building (the Model column) and coefficient type.
+        """
+        if df_bench_stats is None:
+            df_bench_stats = Portfolio.generate_benchmark_stats(df_building_models)
+        return Benchmark.benchmark_table(df_building_models.set_index('Model'), df_bench_stats)
+
     @staticmethod
     def generate_benchmark_stats(df_building_models):
         df_bench_stats = pd.DataFrame(
@@ -275,9 +306,11 @@ class Portfolio:
 
     @staticmethod
     def generate_benchmark_stats_wrapper(dict_raw_utility: dict,
-                                         use_cached_weather: bool):
+                                         use_cached_weather: bool,
+                                         model_cache: ModelCache | None = None,
+                                         weather_prefetch: WeatherPrefetch | None = None):
         df_building_models = Portfolio.generate_building_models(
-            dict_raw_utility, use_cached_weather)
+            dict_raw_utility, use_cached_weather, model_cache, weather_prefetch)
         df_bench_stats = Portfolio.generate_benchmark_stats(df_building_models)
         return df_bench_stats
 
@@ -25,26 +25,37 @@ class Utility:
         if (df_raw_data is not None):
             self.df_raw_data = df_raw_data.copy()
 
+    @staticmethod
+    def convert_to_kWh(consumption: pd.Series,
+                       energy_unit: pd.Series) -> tuple[pd.Series, list[str]]:
+        """
+        Converts consumption to kWh by looking up every row's unit in Constants.energy_unit_to_kWh.
+        The unit column is made categorical, so the lookup is done once per distinct unit.
+        Returns the converted consumption and the units that were not recognized; rows with
+        unknown (or missing) units are left unconverted.
+        """
+        factors = {unit.casefold(): factor
+                   for unit, factor in constants.Constants.energy_unit_to_kWh.items()}
+        units = pd.Series(energy_unit, copy=False).astype('category')
+        category_factors = np.array([factors.get(str(unit).strip().casefold(), np.nan)
+                                     for unit in units.cat.categories] + [np.nan])
+        # Code -1 (missing unit) picks the trailing NaN
+        row_factors = category_factors[units.cat.codes.to_numpy()]
+
+        unknown = [str(unit) for unit, factor in zip(units.cat.categories, category_factors)
+                   if np.isnan(factor)]
+        if units.isna().any():
+            unknown.append('<missing>')
+        if unknown:
+            print('Warning: unknown energy units left unconverted: ' + ', '.join(unknown))
+
+        return consumption * np.nan_to_num(row_factors, nan=1.0), unknown
+
     def process(self):
-        # Convert energy consumption unit to kWh
-        if (self.df_raw_data.columns[2] == 'MWh' and
-                self.utility_type == 'electricity'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.MWH_to_kWh
-        elif (self.df_raw_data.columns[2] == 'Cubic Meters' and
-              self.utility_type == 'natural gas'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.M3_to_kWh
-        elif (self.df_raw_data.columns[2] == 'GJ'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.GJ_to_kWh
-        elif (self.df_raw_data.columns[2] == 'MJ'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.MJ_to_kWh
-        elif (self.df_raw_data.columns[2] == 'Btu'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.Btu_to_kWh
-        elif (self.df_raw_data.columns[2] == 'MMBtu'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.MMBtu_to_kWh
-        elif (self.df_raw_data.columns[2] == 'Therms'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.Therms_to_kWh
-        elif (self.df_raw_data.columns[2] == 'Decatherms'):
-            self.df_raw_data.ix[:, 2] *= constants.Constants.Decatherms_to_kWh
+        # Convert energy consumption unit to kWh, the unit is given by the consumption column header
+        self.df_raw_data.iloc[:, 2], self.unknown_units = self.convert_to_kWh(
+            self.df_raw_data.iloc[:, 2],
+            pd.Series(self.df_raw_data.columns[2], index=self.df_raw_data.index))
 
         # Get date-related vectors
         self.df_raw_data.columns = ['start_dates', 'end_dates', 'kWh', 'Cost']
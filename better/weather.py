@@ -10,24 +10,249 @@ under funding from the U.S. Department of Energy and the U.S. Government consequ
 '''
 
 from better.constants import Constants
+from better.weather_store import WeatherStore
 import pandas as pd
 import numpy as np
 from numpy import typing as npt
 import os
-from ish_parser import ish_report, ish_reportException
-from ftplib import FTP
-import gzip
+from scipy.spatial import cKDTree
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP, error_perm
+import json
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import urlopen
+import zlib
+
+
+class StationIndex:
+    """
+    Nearest weather station lookup. Stations are stored as unit vectors on the sphere in a
+    KD-tree, so the nearest stations by straight-line (chord) distance are also the nearest
+    by great-circle distance. Build it once per station list, see StationIndex.get.
+    """
+
+    # Indexes built so far, keyed by the id of their station list
+    indexes: dict = {}
+
+    def __init__(self,
+                 df_weather_station_list: pd.DataFrame):
+        self.df_weather_station_list = df_weather_station_list.reset_index(drop=True)
+        self.v_station_ID = self.df_weather_station_list['station_ID'].to_numpy()
+        self.v_station_name = self.df_weather_station_list['station_name'].to_numpy()
+        self.tree = cKDTree(self.unit_vectors(self.df_weather_station_list['latitude'],
+                                              self.df_weather_station_list['longitude']))
+
+    @classmethod
+    def get(cls,
+            df_weather_station_list: pd.DataFrame = Constants.df_us_weather_station) -> 'StationIndex':
+        """Returns the index for a station list, building it on first use"""
+        entry = cls.indexes.get(id(df_weather_station_list))
+        if entry is None or entry[0] is not df_weather_station_list:
+            entry = df_weather_station_list, cls(df_weather_station_list)
+            cls.indexes[id(df_weather_station_list)] = entry
+        return entry[1]
+
+    @staticmethod
+    def unit_vectors(latitude: npt.ArrayLike,
+                     longitude: npt.ArrayLike) -> np.ndarray:
+        r_lat, r_lon = np.radians(np.asarray(latitude, dtype=float)), np.radians(
+            np.asarray(longitude, dtype=float))
+        return np.stack([np.cos(r_lat) * np.cos(r_lon),
+                         np.cos(r_lat) * np.sin(r_lon),
+                         np.sin(r_lat)], axis=-1)
+
+    def query(self,
+              latitude: npt.ArrayLike,
+              longitude: npt.ArrayLike,
+              k: int = 3) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the great-circle distances (km) and positions of the k nearest stations,
+        closest first, with shape (number of coordinates, k)
+        """
+        k = min(k, len(self.v_station_ID))
+        chord, index = self.tree.query(np.atleast_2d(self.unit_vectors(latitude, longitude)), k=k)
+        chord, index = np.reshape(chord, (-1, k)), np.reshape(index, (-1, k))
+        distance = 2 * Constants.earth_radius * np.arcsin(np.clip(chord / 2, 0, 1))
+        return distance, index
+
+
+class StationCoverage:
+    """
+    Which years of weather each station has, per weather source (the NOAA archive URL or the
+    local cache folder). Years found available are remembered for good, years found missing
+    only until negative_ttl has passed, as a station may still publish them. With a path the
+    index is kept in a JSON file, merged with what other processes saved in the meantime.
+    """
+
+    def __init__(self,
+                 path: os.PathLike | str | None = None,
+                 negative_ttl: pd.Timedelta = pd.Timedelta(days=7)):
+        self.path = None if path is None else str(path)
+        self.negative_ttl = negative_ttl
+        # {source: {station_ID: {year: None if available, else the expiry time (epoch seconds)}}}
+        self.sources: dict[str, dict[str, dict[int, float | None]]] = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        if self.path is not None and os.path.exists(self.path):
+            self.merge(self.read(self.path))
+
+    def __getstate__(self):
+        # Copied with the Weather objects that share it, without the lock
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def read(path: str) -> dict:
+        with open(path, encoding='utf-8') as infile:
+            d_json = json.load(infile)
+        return {source: {station_ID: {int(year): expiry for year, expiry in d_years.items()}
+                         for station_ID, d_years in d_stations.items()}
+                for source, d_stations in d_json.items()}
+
+    def merge(self, sources: dict) -> None:
+        """Adds entries from another index, available years win over missing ones"""
+        for source, d_stations in sources.items():
+            for station_ID, d_years in d_stations.items():
+                d_known = self.sources.setdefault(source, {}).setdefault(station_ID, {})
+                for year, expiry in d_years.items():
+                    if year not in d_known or (d_known[year] is not None and
+                                               (expiry is None or expiry > d_known[year])):
+                        d_known[year] = expiry
+
+    def is_missing(self,
+                   source: str,
+                   station_ID: str,
+                   year: int) -> bool:
+        expiry = self.sources.get(source, {}).get(station_ID, {}).get(year)
+        return expiry is not None and expiry > time.time()
+
+    def is_usable(self,
+                  source: str,
+                  station_ID: str,
+                  years: range) -> bool:
+        """Whether none of the years is known to be missing"""
+        return not any(self.is_missing(source, station_ID, year) for year in years)
+
+    def mark_available(self,
+                       source: str,
+                       station_ID: str,
+                       years: range) -> None:
+        with self.lock:
+            d_years = self.sources.setdefault(source, {}).setdefault(station_ID, {})
+            for year in years:
+                if year not in d_years or d_years[year] is not None:
+                    d_years[year] = None
+                    self.changed = True
+
+    def mark_missing(self,
+                     source: str,
+                     station_ID: str,
+                     year: int) -> None:
+        with self.lock:
+            self.sources.setdefault(source, {}).setdefault(station_ID, {})[year] = (
+                time.time() + self.negative_ttl.total_seconds())
+            self.changed = True
+
+    def save(self) -> None:
+        """Writes the index to its JSON file, if it has one and anything changed"""
+        if self.path is None or not self.changed:
+            return
+        with self.lock:
+            if os.path.exists(self.path):
+                self.merge(self.read(self.path))
+            d_json = {source: {station_ID: {str(year): expiry for year, expiry in d_years.items()}
+                               for station_ID, d_years in d_stations.items()}
+                      for source, d_stations in self.sources.items()}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            # Write next to the target and swap it in, so readers never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as outfile:
+                json.dump(d_json, outfile)
+            os.replace(tmp, self.path)
+            self.changed = False
+
+
+class IsdStream:
+    """
+    Incremental parser for gzip compressed ISD files. Feed it the compressed bytes as they
+    arrive; complete lines are parsed chunk by chunk and only the partial last line is held back.
+    """
+
+    def __init__(self):
+        # wbits=31 expects a gzip header and trailer
+        self.decompressor = zlib.decompressobj(wbits=31)
+        self.tail = b''
+        self.v_records = []
+
+    def feed(self, chunk: bytes) -> None:
+        data = self.decompressor.decompress(chunk)
+        while self.decompressor.eof and self.decompressor.unused_data:
+            # Concatenated gzip members
+            unused_data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(wbits=31)
+            data += self.decompressor.decompress(unused_data)
+        data = self.tail + data
+        last_line_end = data.rfind(b'\n') + 1
+        self.tail = data[last_line_end:]
+        if last_line_end:
+            self.v_records.append(Weather.parse_isd_records(data[:last_line_end]))
+
+    def result(self) -> tuple[np.ndarray, np.ndarray]:
+        if not self.decompressor.eof:
+            raise EOFError('Truncated gzip stream')
+        self.v_records.append(Weather.parse_isd_records(self.tail + self.decompressor.flush()))
+        self.tail = b''
+        return (np.concatenate([r[0] for r in self.v_records]),
+                np.concatenate([r[1] for r in self.v_records]))
 
 
 class Weather:
     """Class to hold weather information. Takes a list of coordinates as input"""
 
     def __init__(self,
-                 coord: list[float]):
+                 coord: list[float],
+                 n_stations: int = 3,
+                 weather_prefetch: 'WeatherPrefetch | None' = None,
+                 station_coverage: StationCoverage | None = None):
         self.coord = coord
         self.latitude, self.longitude = coord  # geo-coded address
+        self.n_stations = n_stations  # Nearest stations to try, closest first
+        # Shared station-year series, downloads go through it when given
+        self.weather_prefetch = weather_prefetch
+        # Station-years known to be available or missing, shared by default
+        self.station_coverage = (Weather.default_station_coverage if station_coverage is None
+                                 else station_coverage)
         self.find_closest_weather_station()
 
+    @classmethod
+    def from_temperatures(cls,
+                          v_T_F: npt.ArrayLike,
+                          df_periods: pd.DataFrame,
+                          coord: list[float] | None = None) -> 'Weather':
+        """Weather holding precomputed billing period temperatures (F), one per period"""
+        weather = cls.__new__(cls)
+        weather.coord = coord
+        weather.process(df_periods.copy())
+        weather.v_T_F = np.asarray(v_T_F, dtype=float)
+        if len(weather.v_T_F) != len(df_periods):
+            raise ValueError("Expected " + str(len(df_periods)) + " period temperatures, got " +
+                             str(len(weather.v_T_F)))
+        weather.v_T_C = (weather.v_T_F - 32) / 1.8
+        # As aggregate_weather leaves them
+        weather.v_start_dates = cls.to_datetime64(weather.v_start_dates)
+        weather.v_end_dates = cls.to_datetime64(weather.v_end_dates)
+        return weather
+
     def process(self,
                 df_periods: pd.DataFrame) -> None:
         df_periods['start_dates'] = pd.to_datetime(
@@ -52,175 +277,452 @@ class Weather:
         distance = 2 * Constants.earth_radius * np.arcsin(np.sqrt(temp))
         return (distance)
 
+    @staticmethod
+    def find_closest_weather_stations(v_coord: npt.ArrayLike,
+                                      k: int = 3,
+                                      df_weather_station_list: pd.DataFrame = Constants.df_us_weather_station
+                                      ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds the k closest weather stations for many (latitude, longitude) coordinates in one
+        query. Returns station IDs, station names and distances (km), each shaped (len(v_coord), k).
+        """
+        v_coord = np.reshape(np.asarray(v_coord, dtype=float), (-1, 2))
+        station_index = StationIndex.get(df_weather_station_list)
+        distance, index = station_index.query(v_coord[:, 0], v_coord[:, 1], k)
+        return station_index.v_station_ID[index], station_index.v_station_name[index], distance
+
     def find_closest_weather_station(self, df_weather_station_list=Constants.df_us_weather_station):
-        self.v_coord = np.asarray(
-            df_weather_station_list[['latitude', 'longitude']].values)
-        # Find the closest and second closest weather station (backup if the closest doesn't work)
-        v_distance = [Weather.haversine_distance(self.latitude, self.longitude, coord[0], coord[1])
-                      for coord in self.v_coord]
-        closest_index = np.argmin(v_distance)
-        second_closest_index = np.argpartition(v_distance, 2)[2]
-        third_closest_index = np.argpartition(v_distance, 3)[2]
-
-        self.closest_weather_station_ID = df_weather_station_list.loc[closest_index, 'station_ID']
-        self.closest_weather_station_name = df_weather_station_list.loc[
-            closest_index, 'station_name']
-        self.second_closest_weather_station_ID = df_weather_station_list.loc[
-            second_closest_index, 'station_ID']
-        self.second_closest_weather_station_name = df_weather_station_list.loc[
-            second_closest_index, 'station_name']
-        self.third_closest_weather_station_ID = df_weather_station_list.loc[
-            third_closest_index, 'station_ID']
-        self.third_closest_weather_station_name = df_weather_station_list.loc[
-            third_closest_index, 'station_name']
+        # Find the closest weather stations, the others are backups if the closest doesn't work
+        v_station_ID, v_station_name, v_distance = self.find_closest_weather_stations(
+            [self.latitude, self.longitude], self.n_stations, df_weather_station_list)
+        self.v_station_ID = list(v_station_ID[0])
+        self.v_station_name = list(v_station_name[0])
+        self.v_station_distance = list(v_distance[0])
+
+        self.closest_weather_station_ID = self.v_station_ID[0]
+        self.closest_weather_station_name = self.v_station_name[0]
+        if len(self.v_station_ID) > 1:
+            self.second_closest_weather_station_ID = self.v_station_ID[1]
+            self.second_closest_weather_station_name = self.v_station_name[1]
+        if len(self.v_station_ID) > 2:
+            self.third_closest_weather_station_ID = self.v_station_ID[2]
+            self.third_closest_weather_station_name = self.v_station_name[2]
 
     def download_weather_NOAA(self):
         print("Downloading weather data...")
-        try:
-            self.v_T_F, self.v_T_C = self.process_downloaded_weather(
-                self.closest_weather_station_ID)
-        except:
-            try:
-                print("Weather from the closest weather station not available...")
-                print(
-                    "Trying to download the third second data from the third closest weather station.")
-                self.v_T_F, self.v_T_C = self.process_downloaded_weather(
-                    self.second_closest_weather_station_ID)
-            except:
-                print("Weather from the second closest weather station not available...")
-                print(
-                    "Trying to download the third weather data from the third closest weather station.")
-                self.v_T_F, self.v_T_C = self.process_downloaded_weather(
-                    self.third_closest_weather_station_ID)
+        self.v_T_F, self.v_T_C = self.try_weather_stations(
+            self.process_downloaded_weather, self.download_source())
 
     def use_downloaded_weather(self):
         s_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        self.v_T_F, self.v_T_C = self.try_weather_stations(
+            lambda station_ID: self.process_cached_weather(station_ID, s_path),
+            os.path.join(s_path, 'Data'))
+
+    def download_source(self) -> str:
+        return self.noaa_source if self.weather_prefetch is None else self.weather_prefetch.source
+
+    def usable_station_IDs(self,
+                           source: str) -> list[str]:
+        """The nearest stations, closest first, without those known to miss a year of the periods"""
+        years = range(self.start_year, self.end_year + 1)
+        return [station_ID for station_ID in self.v_station_ID
+                if self.station_coverage.is_usable(source, station_ID, years)]
+
+    def try_weather_stations(self, get_weather, source):
+        """
+        Calls get_weather(station_ID) for the nearest usable stations in turn until one succeeds.
+        Stations known to miss data in source are skipped without trying them.
+        """
+        v_station_ID = self.usable_station_IDs(source)
         try:
-            self.v_T_F, self.v_T_C = self.process_cached_weather(
-                self.closest_weather_station_ID, s_path)
-        except:
+            if not v_station_ID:
+                raise Exception("None of the weather stations " + str(self.v_station_ID) +
+                                " has weather for " + str(self.start_year) + "-" +
+                                str(self.end_year) + " in " + source)
+            if v_station_ID[0] != self.v_station_ID[0]:
+                print("Skipping weather stations known to miss data: " +
+                      str([s for s in self.v_station_ID if s not in v_station_ID]))
+            for i, station_ID in enumerate(v_station_ID):
+                try:
+                    return get_weather(station_ID)
+                except Exception:
+                    if i == len(v_station_ID) - 1:
+                        raise
+                    print("Weather from weather station " + str(station_ID) + " not available...")
+                    print("Trying the next closest weather station: " +
+                          str(v_station_ID[i + 1]))
+        finally:
+            self.station_coverage.save()
+
+    @staticmethod
+    def is_missing_error(error: Exception) -> bool:
+        """Whether a fetch failed because the data does not exist, rather than e.g. a timeout"""
+        return (isinstance(error, (FileNotFoundError, error_perm)) or
+                (isinstance(error, HTTPError) and error.code == 404))
+
+    def fetch_station_years(self,
+                            source: str,
+                            weather_station_ID: str,
+                            fetch_year) -> list:
+        """
+        Returns fetch_year(year) for each year of the billing periods, recording in the station
+        coverage which years are available and which are missing
+        """
+        v_records = []
+        for year in range(self.start_year, self.end_year + 1):
             try:
-                print("Weather from the closest weather station not available...")
-                print(
-                    "Trying to process the third second data from the third closest weather station.")
-                self.v_T_F, self.v_T_C = self.process_cached_weather(
-                    self.second_closest_weather_station_ID, s_path)
-            except:
-                print("Weather from the second closest weather station not available...")
-                print(
-                    "Trying to process the third weather data from the third closest weather station.")
-                self.v_T_F, self.v_T_C = self.process_cached_weather(
-                    self.third_closest_weather_station_ID, s_path)
+                v_records.append(fetch_year(year))
+            except Exception as error:
+                if self.is_missing_error(error):
+                    self.station_coverage.mark_missing(source, weather_station_ID, year)
+                raise
+        self.station_coverage.mark_available(
+            source, weather_station_ID, range(self.start_year, self.end_year + 1))
+        return v_records
 
     def process_cached_weather(self,
                                weather_station_ID: str,
                                s_path: str) -> tuple[npt.ArrayLike, npt.ArrayLike]:
+        """
+        Uses the columnar store in Data/WeatherStore when it covers the billing periods, and the
+        per-year CSV files in Data/Weather otherwise (see better.weather_store to convert them)
+        """
+        store = WeatherStore(os.path.join(s_path, 'Data', 'WeatherStore'))
+        start, end = min(self.v_start_dates), max(self.v_end_dates)
+        if store.covers(weather_station_ID, start, end):
+            daily = store.read_daily(weather_station_ID, start, end)
+        else:
+            def read_year(year):
+                print("Process weather data for year: " + str(year))
+                # Read pre-processed weather files from weather file folders
+                file_name = (s_path + "/Data/Weather/" + str(year) + "/" +
+                             str(year) + "_" + weather_station_ID + '.csv')
+                return pd.read_csv(file_name)
+
+            v_df = self.fetch_station_years(os.path.join(s_path, 'Data'), weather_station_ID, read_year)
+            df_new = pd.concat(v_df, ignore_index=True)
+            daily = WeatherStore.summarize_daily(df_new['Datetime'].astype('datetime64[ns]'),
+                                                 df_new['Temperature'])
+
+        v_T_F, v_T_C = self.aggregate_weather(daily)
 
-        df_new: pd.DataFrame = pd.DataFrame()
+        return v_T_F, v_T_C
 
-        for year in range(self.start_year, self.end_year + 1):
-            print("Process weather data for year: " + str(year))
-            # Read pre-processed weather files from weather file folders
-            file_name = (s_path + "/Data/Weather/" + str(year) + "/" +
-                         str(year) + "_" + weather_station_ID + '.csv')
+    def process_downloaded_weather(self,
+                                   weather_station_ID: str) -> tuple[npt.ArrayLike, npt.ArrayLike]:
+        if self.weather_prefetch is not None:
+            def fetch_year(year):
+                return self.weather_prefetch.get(weather_station_ID, year, year)
+        else:
+            def fetch_year(year):
+                print("--->" + str(year))
+                return WeatherStore.summarize_daily(
+                    *self.fetch_isd_year(weather_station_ID, year, self.noaa_source))
+
+        # ISD files hold one UTC year each, so the daily summaries do not overlap
+        daily = np.concatenate(self.fetch_station_years(
+            self.download_source(), weather_station_ID, fetch_year))
+        v_T_F, v_T_C = self.aggregate_weather(daily)
+        return (v_T_F, v_T_C)
 
-            if (year == self.start_year):
-                df_new: pd.DataFrame = pd.read_csv(file_name)
-            else:
-                df_new: pd.DataFrame = df_new.append(pd.read_csv(
-                    file_name), ignore_index=True)  # type: ignore
+    # In memory station coverage shared by the Weather objects of this process, replace it with
+    # StationCoverage(path) to keep it across runs
+    default_station_coverage = StationCoverage()
 
-        df_new['Datetime'] = df_new['Datetime'].astype('datetime64[ns]')
-        df_new['Date'] = df_new['Datetime'].dt.date
+    # Where the yearly ISD files live, as <noaa_source>/<year>/<station_ID>-<year>.gz. An
+    # ftp:// or http(s):// URL, or a local folder holding a copy of the archive.
+    noaa_source = 'ftp://ftp.ncdc.noaa.gov/pub/data/noaa'
 
-        v_T_F, v_T_C = self.aggregate_weather(df_new)
+    @staticmethod
+    def fetch_isd_year(station_ID: str,
+                       year: int,
+                       source: str = noaa_source,
+                       chunk_size: int = 1 << 16,
+                       ftp: FTP | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Streams one station-year of ISD records from source through a gzip decompressor into
+        the parser, without writing the file to disk. Returns (datetime64[m], temperature in F).
+        An ftp:// source reuses the logged in session ftp when given.
+        """
+        stream = IsdStream()
+        file_name = station_ID + '-' + str(year) + '.gz'
+        url = urlparse(source)
+        if url.scheme == 'ftp':
+            session = ftp if ftp is not None else Weather.ftp_login(source)
+            try:
+                session.cwd(url.path.rstrip('/') + '/' + str(year))
+                session.retrbinary('RETR ' + file_name, stream.feed, blocksize=chunk_size)
+            finally:
+                if ftp is None:
+                    session.close()
+        elif url.scheme in ('http', 'https'):
+            with urlopen(source.rstrip('/') + '/' + str(year) + '/' + file_name) as response:
+                for chunk in iter(lambda: response.read(chunk_size), b''):
+                    stream.feed(chunk)
+        else:
+            with open(os.path.join(source, str(year), file_name), 'rb') as infile:
+                for chunk in iter(lambda: infile.read(chunk_size), b''):
+                    stream.feed(chunk)
+        return stream.result()
 
-        return v_T_F, v_T_C
+    @staticmethod
+    def ftp_login(source: str) -> FTP:
+        ftp = FTP(urlparse(source).hostname)
+        ftp.login()
+        return ftp
 
-    def process_downloaded_weather(self,
-                                   weather_station_ID: str) -> tuple[npt.ArrayLike, npt.ArrayLike]:
+    # Air temperature quality codes flagging suspect or erroneous values
+    isd_rejected_qc_codes = b'2367'
 
-        # Helper functions
-        def download_sub_hourly_weather(station_ID, year):
-            ftp = FTP('ftp.ncdc.noaa.gov')
-            ftp.login()
-            ftp_path = '/pub/data/noaa/' + str(year)  # Hourly
-            ftp.cwd(ftp_path)
-            # Save gz files locally
-            file_name_noaa = 'RETR ' + station_ID + '-' + str(year) + '.gz'
-            file_name_local = station_ID + '-' + str(year) + '.gz'
-            ftp.retrbinary(file_name_noaa, open(file_name_local, 'wb').write)
-
-        def save_as_csv(stationID, year):
-            file_name_gz = stationID + '-' + str(year) + '.gz'
-            file_name_csv = stationID + '-' + str(year) + '.csv'
-            with gzip.open(file_name_gz, 'rb') as infile:
-                with open(file_name_csv, 'wb') as outfile:
-                    for line in infile:
-                        outfile.write(line)
-            os.remove(file_name_gz)
-
-        def get_ish_report_helper(raw_rpt):
-            return (ish_report().loads(raw_rpt))
-
-        def get_ish_report_datetime_helper(raw_rpt):
-            return (raw_rpt.datetime)
-
-        def get_ish_report_temperature_helper(raw_rpt):
-            return (raw_rpt.air_temperature.get_fahrenheit())
+    @staticmethod
+    def parse_isd_records(raw: bytes) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Parses NOAA Integrated Surface Database (ISD) records, one per line, without building a
+        report object per line. Only the fixed-width mandatory section is read: date (columns
+        16-23), UTC time (24-27), air temperature in tenths of a degree Celsius (88-92, signed)
+        and its quality code (93). Missing (+9999) and suspect or erroneous temperatures become NaN.
+        Returns (datetime64[m] timestamps, temperatures in Fahrenheit).
+        """
+        buffer = np.frombuffer(raw, dtype=np.uint8)
+        ends = np.flatnonzero(buffer == ord('\n'))
+        if len(buffer) > 0 and (len(ends) == 0 or ends[-1] != len(buffer) - 1):
+            ends = np.append(ends, len(buffer))
+        starts = np.concatenate([[0], ends[:-1] + 1]) if len(ends) else ends
+        # Skip blank or truncated lines, the mandatory section is 105 characters long
+        starts = starts[ends - starts >= 93]
+
+        def column(first, last):
+            return buffer[starts[:, None] + np.arange(first, last)]
+
+        def number(first, last):
+            digits = column(first, last).astype(np.int64) - ord('0')
+            return digits @ (10 ** np.arange(last - first - 1, -1, -1))
+
+        year, month, day = number(15, 19), number(19, 21), number(21, 23)
+        minutes = number(23, 25) * 60 + number(25, 27)
+        v_datetime = (((year - 1970) * 12 + month - 1).astype('datetime64[M]').astype('datetime64[D]')
+                      + (day - 1)).astype('datetime64[m]') + minutes
+
+        temperature = number(88, 92).astype(float)
+        sign = np.where(column(87, 88)[:, 0] == ord('-'), -1.0, 1.0)
+        qc = column(92, 93)[:, 0]
+        missing = (temperature == 9999) | np.isin(
+            qc, np.frombuffer(Weather.isd_rejected_qc_codes, dtype=np.uint8))
+        v_temperature_F = np.where(missing, np.nan, sign * temperature / 10 * 1.8 + 32)
+        return v_datetime, v_temperature_F
 
-        for year in range(self.start_year, self.end_year + 1):
-            print("--->" + str(year))
-            download_sub_hourly_weather(weather_station_ID, year)
-            save_as_csv(weather_station_ID, year)
-            raw_csv = weather_station_ID + '-' + str(year) + '.csv'
-            if (year == self.start_year):
-                df_raw = pd.read_csv(raw_csv, names=['Old'])
-            else:
-                df_raw = df_raw.append(pd.read_csv(raw_csv, names=['Old']),
-                                       ignore_index=True)
-            # Cleaning up
-            os.remove(raw_csv)
-        # Parse ish text data to readable weather data
-        print("Processing downloaded data...")
-        v_rpt = list(map(get_ish_report_helper, df_raw['Old']))
-        v_noaa_datetime = np.array(
-            list(map(get_ish_report_datetime_helper, v_rpt)))
-        v_noaa_temperature_F = np.array(
-            list(map(get_ish_report_temperature_helper, v_rpt)))
-        # Sanitize the array
-        v_noaa_temperature_F = pd.to_numeric(
-            v_noaa_temperature_F, errors='coerce')
-        df_new = pd.DataFrame(
-            {'Datetime': v_noaa_datetime, 'Temperature': v_noaa_temperature_F})
-        df_new['Date'] = df_new['Datetime'].dt.date
-        v_T_F, v_T_C = self.aggregate_weather(df_new)
-        return (v_T_F, v_T_C)
+    @staticmethod
+    def to_datetime64(v_dates: npt.ArrayLike) -> np.ndarray:
+        """Timestamps as naive UTC datetime64[ns]"""
+        v_dates = pd.DatetimeIndex(v_dates)
+        if v_dates.tz is not None:
+            v_dates = v_dates.tz_convert('UTC').tz_localize(None)
+        return v_dates.to_numpy(dtype='datetime64[ns]')
 
-    def aggregate_weather(self,
-                          df_daily: pd.DataFrame) -> tuple[npt.ArrayLike, npt.ArrayLike]:
-        """Takes dataframe of hourly temperature data with """
-        # Get daily weather data
+    @staticmethod
+    def aggregate_daily_periods(daily: np.ndarray,
+                                v_start_dates: npt.ArrayLike,
+                                v_end_dates: npt.ArrayLike,
+                                base_temperatures_F: list[float] | None = None) -> pd.DataFrame:
+        """
+        Aggregates a station's daily summary (see WeatherStore.daily_dtype) to billing periods
+        of whole days, start and end day inclusive. Unlike the hourly aggregation this replaced,
+        which stopped at the midnight reading that opens the end date, the end day counts in
+        full, as it does in the bill. The period mean weights each day by its
+        number of readings, so it equals the mean of the readings. Returns one row per period with
+        the mean temperature, the number of readings and of days with readings and, for each base
+        temperature b, the heating (hdd_b) and cooling (cdd_b) degree-days of the daily means.
+        """
+        daily = daily[np.argsort(daily['day'], kind='stable')]
+        v_day = daily['day']
+        first_day = Weather.to_datetime64(v_start_dates).astype('datetime64[D]').astype(np.int64)
+        last_day = Weather.to_datetime64(v_end_dates).astype('datetime64[D]').astype(np.int64)
+        lo = np.searchsorted(v_day, first_day, side='left')
+        hi = np.searchsorted(v_day, last_day, side='right')
+
+        def period_sums(v):
+            prefix = np.concatenate([[0], np.cumsum(v)])
+            return prefix[hi] - prefix[np.minimum(lo, hi)]
+
+        v_mean = daily['mean'].astype(float)
+        count = period_sums(daily['count'].astype(np.int64))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            d_periods = {'mean_T_F': np.where(count > 0, period_sums(v_mean * daily['count']) / count, np.nan),
+                         'count': count,
+                         'days': np.maximum(hi - lo, 0)}
+        for b in base_temperatures_F or []:
+            d_periods['hdd_' + str(b)] = period_sums(np.maximum(b - v_mean, 0))
+            d_periods['cdd_' + str(b)] = period_sums(np.maximum(v_mean - b, 0))
+        return pd.DataFrame(d_periods)
 
+    def aggregate_weather(self,
+                          daily: np.ndarray) -> tuple[npt.ArrayLike, npt.ArrayLike]:
+        """Takes a daily temperature summary and averages it over the billing periods"""
         # Remove time zone information
-        self.v_start_dates = np.array(self.v_start_dates, dtype=np.datetime64)
-        self.v_end_dates = np.array(self.v_end_dates, dtype=np.datetime64)
-        df_daily['Datetime'] = np.array(
-            df_daily['Datetime'], dtype=np.datetime64)
-
-        df_daily = df_daily.loc[(df_daily['Datetime'] >= min(self.v_start_dates)) &
-                                (df_daily['Datetime'] <= max(self.v_end_dates))]
+        self.v_start_dates = self.to_datetime64(self.v_start_dates)
+        self.v_end_dates = self.to_datetime64(self.v_end_dates)
 
         # Aggregate the weather data to the billing periods level.
-        v_avg_period_T_F = np.empty(0, dtype=float)
-        v_start_dates = np.array(self.v_start_dates)
-        v_end_dates = np.array(self.v_end_dates)
-        v_temp_datetime = np.array(df_daily['Datetime'], dtype=np.datetime64)
-        for i in range(len(self.v_start_dates)):
-            df_temp = df_daily.loc[(v_temp_datetime >= v_start_dates[i]) &
-                                   (v_temp_datetime <= v_end_dates[i])]
-            v_avg_period_T_F = np.append(
-                v_avg_period_T_F, df_temp['Temperature'].mean())
+        self.df_period_weather = self.aggregate_daily_periods(daily,
+                                                              self.v_start_dates,
+                                                              self.v_end_dates)
+        v_avg_period_T_F = self.df_period_weather['mean_T_F'].to_numpy()
         v_avg_period_T_C = (v_avg_period_T_F - 32) / 1.8
 
         return (v_avg_period_T_F, v_avg_period_T_C)
+
+
+class WeatherPrefetch:
+    """
+    Downloads the weather a whole portfolio needs up front. Plan the billing periods of every
+    building with plan, then fetch downloads each (station, year) once on a bounded thread
+    pool, each thread reusing one FTP session, and keeps its daily summary. Weather objects
+    given this prefetch read the shared, read-only summaries from it; station-years that were not planned (e.g. backup
+    stations) are downloaded on first use and kept as well.
+    """
+
+    def __init__(self,
+                 source: str | None = None,
+                 max_workers: int = 4):
+        self.source = Weather.noaa_source if source is None else source
+        self.max_workers = max_workers
+        self.planned: set[tuple[str, int]] = set()
+        self.series: dict[tuple[str, int], np.ndarray] = {}
+        self.failed: dict[tuple[str, int], Exception] = {}
+        self.sessions = threading.local()
+        self.open_sessions: list[FTP] = []
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # Shared by every building, copies of a Weather keep pointing at the same series
+        return self
+
+    def __getstate__(self):
+        # Sent to worker processes with the series fetched so far, without the sessions and
+        # the lock. Download errors do not all survive pickling, their messages do.
+        state = self.__dict__.copy()
+        del state['sessions'], state['open_sessions'], state['lock']
+        state['failed'] = {station_year: OSError(str(error))
+                           for station_year, error in self.failed.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for daily in self.series.values():
+            daily.setflags(write=False)
+        self.sessions = threading.local()
+        self.open_sessions = []
+        self.lock = threading.Lock()
+
+    def plan(self,
+             station_ID: str,
+             v_start_dates: npt.ArrayLike,
+             v_end_dates: npt.ArrayLike) -> None:
+        """Adds the station-years covering the billing periods"""
+        v_start_dates = Weather.to_datetime64(v_start_dates)
+        v_end_dates = Weather.to_datetime64(v_end_dates)
+        if len(v_start_dates) == 0:
+            return
+        start_year = pd.Timestamp(v_start_dates.min()).year
+        end_year = pd.Timestamp(v_end_dates.max()).year
+        self.planned.update((station_ID, year) for year in range(start_year, end_year + 1))
+
+    def plan_weather(self,
+                     weather: Weather,
+                     df_periods: pd.DataFrame) -> None:
+        """
+        Plans the closest station of weather over the billing periods in df_periods, skipping
+        stations its coverage knows to be missing some of the years
+        """
+        v_start_dates = Weather.to_datetime64(df_periods['start_dates'])
+        v_end_dates = Weather.to_datetime64(df_periods['end_dates'])
+        if len(v_start_dates) == 0:
+            return
+        years = range(pd.Timestamp(v_start_dates.min()).year, pd.Timestamp(v_end_dates.max()).year + 1)
+        for station_ID in weather.v_station_ID:
+            if weather.station_coverage.is_usable(self.source, station_ID, years):
+                self.plan(station_ID, v_start_dates, v_end_dates)
+                return
+
+    def session(self) -> FTP | None:
+        """The calling thread's FTP session, None for http(s) and local sources"""
+        if urlparse(self.source).scheme != 'ftp':
+            return None
+        ftp = getattr(self.sessions, 'ftp', None)
+        if ftp is None:
+            ftp = Weather.ftp_login(self.source)
+            self.sessions.ftp = ftp
+            with self.lock:
+                self.open_sessions.append(ftp)
+        return ftp
+
+    def drop_session(self) -> None:
+        ftp = getattr(self.sessions, 'ftp', None)
+        if ftp is not None:
+            self.sessions.ftp = None
+            with self.lock:
+                self.open_sessions.remove(ftp)
+            ftp.close()
+
+    def fetch_one(self,
+                  station_year: tuple[str, int]) -> None:
+        station_ID, year = station_year
+        for attempt in range(2):
+            reused = getattr(self.sessions, 'ftp', None) is not None
+            try:
+                v_datetime, v_temperature_F = Weather.fetch_isd_year(
+                    station_ID, year, self.source, ftp=self.session())
+            except Exception as error:
+                # The connection may be broken, the next download opens a new one. A reused
+                # session may simply have timed out, so that is retried once on a fresh one.
+                self.drop_session()
+                if reused and attempt == 0:
+                    continue
+                self.failed[station_year] = error
+                return
+            daily = WeatherStore.summarize_daily(v_datetime, v_temperature_F)
+            daily.setflags(write=False)
+            self.series[station_year] = daily
+            return
+
+    def fetch(self) -> None:
+        """Downloads every planned station-year that is not available yet"""
+        v_pending = sorted(self.planned - self.series.keys() - self.failed.keys())
+        if not v_pending:
+            return
+        print("Downloading weather for " + str(len(v_pending)) + " station-years...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.fetch_one, v_pending))
+        self.close()
+
+    def get(self,
+            station_ID: str,
+            start_year: int,
+            end_year: int) -> np.ndarray:
+        """
+        Returns the daily summary (see WeatherStore.daily_dtype) of a station over the years.
+        Raises the download error if any of the years is not available.
+        """
+        v_records = []
+        for year in range(start_year, end_year + 1):
+            station_year = (station_ID, year)
+            if station_year not in self.series and station_year not in self.failed:
+                self.fetch_one(station_year)
+            if station_year in self.failed:
+                raise self.failed[station_year]
+            v_records.append(self.series[station_year])
+        if len(v_records) == 1:
+            return v_records[0]
+        return np.concatenate(v_records)
+
+    def close(self) -> None:
+        """Logs out of the FTP sessions opened so far"""
+        with self.lock:
+            open_sessions, self.open_sessions = self.open_sessions, []
+        for ftp in open_sessions:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+        self.sessions = threading.local()
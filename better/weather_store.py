@@ -0,0 +1,211 @@
+'''
+
+Building Efficiency Targeting Tool for Energy Retrofits (BETTER) Copyright (c) 2018, The Regents of the University of California, through Lawrence Berkeley National Laboratory (subject to receipt of any required approvals from the U.S. Dept. of Energy). All rights reserved.
+
+If you have questions about your rights to use or distribute this software, please contact Berkeley Lab's Intellectual Property Office at  IPO@lbl.gov.
+
+NOTICE.  This Software was developed
+under funding from the U.S. Department of Energy and the U.S. Government consequently retains certain rights. As such, the U.S. Government has been granted for itself and others acting on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in the Software to reproduce, distribute copies to the public, prepare derivative works, and perform publicly and display publicly, and to permit other to do so.
+
+'''
+
+import os
+import re
+import pathlib
+import argparse
+import numpy as np
+from numpy import typing as npt
+import pandas as pd
+
+
+class WeatherStore:
+    """
+    Columnar local store of hourly weather, one pair of NumPy files per station:
+    <station_ID>.time.npy holds sorted int64 epoch seconds (UTC) and
+    <station_ID>.temperature.npy the matching float32 temperatures in Fahrenheit.
+    Reads memory-map the files and return slices, so only the requested range is paged in.
+
+    <station_ID>.daily.npy holds the daily summary of the hourly records (see daily_dtype),
+    rebuilt on every write so that billing periods can be averaged from daily values.
+    """
+
+    # Daily summary of a station's records: the UTC day (days since the epoch), the mean,
+    # minimum and maximum temperature in F and the number of readings. Days without any valid
+    # reading are left out.
+    daily_dtype = np.dtype([('day', '<i4'),
+                            ('mean', '<f8'),
+                            ('min', '<f4'),
+                            ('max', '<f4'),
+                            ('count', '<i4')])
+
+    def __init__(self,
+                 root: pathlib.Path | str):
+        self.root = pathlib.Path(root)
+
+    def paths(self, station_ID: str) -> tuple[pathlib.Path, pathlib.Path]:
+        return (self.root / (station_ID + '.time.npy'),
+                self.root / (station_ID + '.temperature.npy'))
+
+    def daily_path(self, station_ID: str) -> pathlib.Path:
+        return self.root / (station_ID + '.daily.npy')
+
+    def has_station(self, station_ID: str) -> bool:
+        return all(path.exists() for path in self.paths(station_ID))
+
+    def stations(self) -> list[str]:
+        return sorted(path.name[:-len('.time.npy')] for path in self.root.glob('*.time.npy'))
+
+    @staticmethod
+    def to_epoch(v_datetime: npt.ArrayLike) -> np.ndarray:
+        """Timestamps as int64 seconds since the epoch (UTC; naive timestamps are taken as UTC)"""
+        v_datetime = pd.DatetimeIndex(v_datetime)
+        if v_datetime.tz is not None:
+            v_datetime = v_datetime.tz_convert('UTC').tz_localize(None)
+        return v_datetime.to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+    @staticmethod
+    def to_datetime(v_epoch: np.ndarray) -> np.ndarray:
+        return np.asarray(v_epoch, dtype=np.int64).astype('datetime64[s]')
+
+    @staticmethod
+    def summarize_daily(v_datetime: npt.ArrayLike,
+                        v_temperature_F: npt.ArrayLike) -> np.ndarray:
+        """Daily mean, minimum, maximum and count of temperature records, see daily_dtype"""
+        v_day = WeatherStore.to_epoch(v_datetime) // 86400
+        v_temperature_F = np.asarray(v_temperature_F, dtype=float)
+        valid = ~np.isnan(v_temperature_F)
+        v_day, v_temperature_F = v_day[valid], v_temperature_F[valid]
+        order = np.argsort(v_day, kind='stable')
+        v_day, v_temperature_F = v_day[order], v_temperature_F[order]
+
+        v_unique_day, first, count = np.unique(v_day, return_index=True, return_counts=True)
+        daily = np.empty(len(v_unique_day), dtype=WeatherStore.daily_dtype)
+        daily['day'] = v_unique_day
+        daily['count'] = count
+        if len(v_unique_day):
+            daily['mean'] = np.add.reduceat(v_temperature_F, first) / count
+            daily['min'] = np.minimum.reduceat(v_temperature_F, first)
+            daily['max'] = np.maximum.reduceat(v_temperature_F, first)
+        return daily
+
+    def read(self,
+             station_ID: str,
+             start=None,
+             end=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (epoch seconds, temperature in F) for start <= time <= end as read-only slices of
+        the memory-mapped files. Raises FileNotFoundError if the station is not in the store.
+        """
+        path_time, path_temperature = self.paths(station_ID)
+        v_time = np.load(path_time, mmap_mode='r')
+        v_temperature = np.load(path_temperature, mmap_mode='r')
+        lo = 0 if start is None else np.searchsorted(v_time, self.to_epoch([start])[0], side='left')
+        hi = len(v_time) if end is None else np.searchsorted(v_time, self.to_epoch([end])[0], side='right')
+        return v_time[lo:hi], v_temperature[lo:hi]
+
+    def read_daily(self,
+                   station_ID: str,
+                   start=None,
+                   end=None) -> np.ndarray:
+        """
+        Returns the daily summary for the days of start to end, both inclusive, as a read-only
+        slice of the memory-mapped file. Stores written before the daily layer existed get it
+        built on first use.
+        """
+        path = self.daily_path(station_ID)
+        if not path.exists():
+            v_time, v_temperature = self.read(station_ID)
+            self.save(path, self.summarize_daily(self.to_datetime(v_time), v_temperature))
+        daily = np.load(path, mmap_mode='r')
+        lo = 0 if start is None else np.searchsorted(
+            daily['day'], self.to_epoch([start])[0] // 86400, side='left')
+        hi = len(daily) if end is None else np.searchsorted(
+            daily['day'], self.to_epoch([end])[0] // 86400, side='right')
+        return daily[lo:hi]
+
+    def covers(self,
+               station_ID: str,
+               start,
+               end,
+               tolerance: pd.Timedelta = pd.Timedelta(days=1)) -> bool:
+        """
+        Whether the station's records span start to end, give or take tolerance, with a valid
+        reading on every day in between
+        """
+        if not self.has_station(station_ID):
+            return False
+        v_time = np.load(self.paths(station_ID)[0], mmap_mode='r')
+        first, last = self.to_epoch([pd.Timestamp(start) + tolerance, pd.Timestamp(end) - tolerance])
+        if len(v_time) == 0 or v_time[0] > first or v_time[-1] < last:
+            return False
+        # The daily summary holds one row per day with readings, so a gap shows as missing rows
+        n_day = max(last // 86400 - first // 86400 + 1, 0)
+        return len(self.read_daily(station_ID, self.to_datetime(first), self.to_datetime(last))) == n_day
+
+    def write(self,
+              station_ID: str,
+              v_datetime: npt.ArrayLike,
+              v_temperature_F: npt.ArrayLike) -> None:
+        """Merges records into the station's files; new values win for repeated timestamps"""
+        v_time = self.to_epoch(v_datetime)
+        v_temperature = np.asarray(v_temperature_F, dtype=np.float32)
+        if self.has_station(station_ID):
+            old_time, old_temperature = self.read(station_ID)
+            v_time = np.concatenate([v_time, old_time])
+            v_temperature = np.concatenate([v_temperature, old_temperature])
+
+        # np.unique keeps the first occurrence, i.e. the new record
+        v_time, index = np.unique(v_time, return_index=True)
+        v_temperature = v_temperature[index]
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        for path, values in zip(self.paths(station_ID), (v_time, v_temperature)):
+            self.save(path, values)
+        self.save(self.daily_path(station_ID),
+                  self.summarize_daily(self.to_datetime(v_time), v_temperature))
+
+    @staticmethod
+    def save(path: pathlib.Path,
+             values: np.ndarray) -> None:
+        # Write next to the target and swap it in, so readers never see a partial file
+        tmp = path.with_name(path.name + '.tmp.npy')
+        np.save(tmp, values)
+        os.replace(tmp, path)
+
+    def import_csv_cache(self,
+                         csv_root: pathlib.Path | str,
+                         station_IDs: list[str] | None = None) -> list[str]:
+        """
+        Converts a <csv_root>/<year>/<year>_<station_ID>.csv cache, with Datetime and
+        Temperature (F) columns, into the store. Returns the imported station IDs.
+        """
+        pattern = re.compile(r'^(\d{4})_(.+)\.csv$')
+        d_files: dict[str, list[pathlib.Path]] = {}
+        for path in sorted(pathlib.Path(csv_root).glob('*/*.csv')):
+            match = pattern.match(path.name)
+            if match and match.group(1) == path.parent.name:
+                d_files.setdefault(match.group(2), []).append(path)
+
+        imported = []
+        for station_ID, files in d_files.items():
+            if station_IDs is not None and station_ID not in station_IDs:
+                continue
+            df = pd.concat([pd.read_csv(f, usecols=['Datetime', 'Temperature']) for f in files],
+                           ignore_index=True)
+            self.write(station_ID,
+                       pd.to_datetime(df['Datetime']),
+                       pd.to_numeric(df['Temperature'], errors='coerce'))
+            imported.append(station_ID)
+            print('Imported weather station ' + station_ID + ' (' + str(len(df)) + ' records)')
+        return imported
+
+
+if __name__ == "__main__":
+    # Example: python -m better.weather_store Data/Weather Data/WeatherStore
+    parser = argparse.ArgumentParser(
+        description='Convert the per-year weather CSV cache into a columnar weather store')
+    parser.add_argument('csv_root', help='Folder holding <year>/<year>_<station_ID>.csv files')
+    parser.add_argument('store_root', help='Folder of the weather store')
+    parser.add_argument('--stations', nargs='*', help='Only import these station IDs')
+    args = parser.parse_args()
+    WeatherStore(args.store_root).import_csv_cache(args.csv_root, args.stations)
@@ -137,3 +137,41 @@ def test_savings_coefficients(test_fim: OpportunityEngine):
 
     assert {k: v['savings_coefficient']
             for k, v in savings_coefficients.items()} == expected
+
+
+def test_calculate_recommendations_utility_type(test_sample_benchmark_stats_e: dict):
+    # Electricity is 'electric' or 1, both enable the baseload measures
+    for utility_type in ('electric', 1):
+        benchmark_stats = {k: dict(v, site_coefficient=v['beta_median'] * 1.5)
+                           for k, v in test_sample_benchmark_stats_e.items()}
+        fim = OpportunityEngine(benchmark_stats, utility_type)
+        fim.set_targets(target_level='nominal')
+        recommendations = fim.calculate_recommendations()
+        assert recommendations['Reduce Lighting Load']
+        assert recommendations['Reduce Plug Loads']
+        assert not recommendations['Check Fossil Baseload']
+
+
+def test_assess(test_sample_benchmark_stats_e: dict):
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    df_site_coefficients = pd.DataFrame(
+        {k: v['beta_median'] * rng.uniform(0, 2, 200) for k, v in test_sample_benchmark_stats_e.items()})
+    df_site_coefficients = df_site_coefficients.mask(rng.random(df_site_coefficients.shape) < 0.1)
+    # Heating only model: betc equals beth and beta_cdd is 0
+    df_site_coefficients.loc[0, ['beta_cdd', 'beta_betc', 'beta_beth']] = [0, 15.0, 15.0]
+    v_utility_type = rng.choice(['electric', 'fossil_fuel'], 200)
+
+    df_targets, df_recommendations = OpportunityEngine.assess(
+        df_site_coefficients, test_sample_benchmark_stats_e, v_utility_type, 'aggressive')
+
+    assert list(df_recommendations.columns) == [rule[0] for rule in OpportunityEngine.rules]
+    for i, row in df_site_coefficients.iterrows():
+        benchmark_stats = {k: dict(v, site_coefficient=row[k])
+                           for k, v in test_sample_benchmark_stats_e.items()}
+        fim = OpportunityEngine(benchmark_stats, v_utility_type[i])
+        fim.set_targets(target_level='aggressive')
+        assert df_recommendations.loc[i].to_dict() == fim.calculate_recommendations()
+        for k, v in fim.benchmark_stats.items():
+            assert df_targets.loc[i, k] == pytest.approx(v['target'], nan_ok=True)
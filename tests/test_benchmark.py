@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import pytest
 from better.benchmark import Benchmark
@@ -28,3 +29,36 @@ def test_constructor_with_beta_betc():
     assert bm.sample_standard_deviation == 1.0
     assert bm.rating == 1
     assert bm.rating_str == 'Poor'
+
+
+def test_rate_matches_scalar_benchmark():
+    rng = np.random.default_rng(0)
+    coefficients = rng.normal(3.0, 1.5, size=(50, 5))
+    median = np.array([3.0, 2.5, 3.0, 3.5, 3.0])
+    std = np.array([1.0, 0.0, 1.0, 1.0, 2.0])
+
+    rating, rating_str, percentile = Benchmark.rate(coefficients, median, std)
+
+    for i in range(50):
+        for j, coefficient_type in enumerate(Benchmark.coefficient_types):
+            bm = Benchmark(coefficient_type, coefficients[i, j], median[j], std[j], True)
+            assert (rating[i, j], rating_str[i, j]) == (bm.rating, bm.rating_str)
+    assert percentile[:, 1] == pytest.approx(np.full(50, 50.0))
+    assert ((percentile >= 0) & (percentile <= 100)).all()
+
+
+def test_benchmark_table():
+    df_coefficients = pd.DataFrame({'beta_base': [0.2, 0.5, np.nan], 'beta_betc': [20.0, 5.0, 12.0]},
+                                   index=pd.Index([1, 2, 3], name='Model'))
+    df_stats = pd.DataFrame({'beta_median': [0.35, 11.8], 'beta_standard_deviation': [0.04, 5.0]},
+                            index=pd.Index(['beta_base', 'beta_betc'], name='coefficient'))
+    df_valid = pd.DataFrame({'beta_base': [True, True, True], 'beta_betc': [True, True, False]},
+                            index=df_coefficients.index)
+
+    df_benchmark = Benchmark.benchmark_table(df_coefficients, df_stats, df_valid)
+
+    assert list(df_benchmark['rating_str']) == ['Good', 'Good', 'Poor', 'Poor', '', '']
+    assert df_benchmark.loc[(1, 'beta_betc'), 'percentile'] > 90
+    assert np.isnan(df_benchmark.loc[(3, 'beta_base'), 'percentile'])
+    assert Benchmark.generate_benchmark_bar_html('beta_base', 'Good', 97.0).count('97%') == 2
+    assert Benchmark.generate_benchmark_bar_html('beta_base', '', np.nan) == ''
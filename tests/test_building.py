@@ -0,0 +1,202 @@
+import pickle
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from better.building import Building
+from better.model import InverseModel
+from better.geocoding import GeocodeResult, Geocoder
+from better.utility import Utility
+from better.weather import Weather, WeatherPrefetch
+
+
+class CountingGeocoder(Geocoder):
+    def __init__(self):
+        super().__init__(online=False)
+        self.v_address = []
+
+    def resolve(self, address, save=True):
+        self.v_address.append(address)
+        return GeocodeResult(37.87, -122.27, address, 'test')
+
+
+@pytest.fixture
+def utility_e():
+    return Utility('electricity', pd.DataFrame({
+        'Monthly Billing Start Date': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-03-01']),
+        'Monthly Billing End Date': pd.to_datetime(['2020-01-31', '2020-02-29', '2020-03-31']),
+        'kWh': [1000.0, 900.0, 950.0],
+        'Cost': [100.0, 90.0, 95.0]}))
+
+
+def test_building_geocodes_on_first_access():
+    geocoder = CountingGeocoder()
+    building = Building(1, 'Building 1', '1 Cyclotron Rd, Berkeley, CA', 'Office', 1000.0,
+                        geocoder=geocoder)
+    building.add_nearest_weather(cached=True)
+    building.pre_process()
+
+    assert geocoder.v_address == []
+    assert not hasattr(building, 'weather_electricity')
+    assert building.coord == [37.87, -122.27]
+    assert building.latitude == 37.87
+    assert len(geocoder.v_address) == 1
+
+
+def test_building_precomputed_coordinates_and_temperatures(utility_e):
+    geocoder = CountingGeocoder()
+    building = Building(1, 'Building 1', '1 Cyclotron Rd, Berkeley, CA', 'Office', 1000.0,
+                        geocoder=geocoder, coord=[37.0, -122.0])
+    building.add_utility(utility_e)
+    building.add_weather(temperatures_e_F=[50.0, 53.6, 59.0])
+
+    assert list(building.weather_electricity.v_T_C) == pytest.approx([10.0, 12.0, 15.0])
+    assert len(building.weather_electricity.v_start_dates) == 3
+    assert building.coord == [37.0, -122.0]
+    assert geocoder.v_address == []
+
+
+def test_building_with_pending_weather_pickles(utility_e):
+    building = Building(1, 'Building 1', '1 Cyclotron Rd, Berkeley, CA', 'Office', 1000.0,
+                        coord=[37.87, -122.27])
+    building.add_utility(utility_e)
+    building.add_nearest_weather(weather_prefetch=WeatherPrefetch())
+    assert building.has_weather('weather_electricity')
+    assert not building.has_weather('weather_fossil_fuel')
+
+    building = pickle.loads(pickle.dumps(building))
+    assert building.weather_sources['weather_electricity'][:2] == ('nearest', 'utility_electricity')
+    assert building.has_weather('weather_electricity')
+
+    building.add_weather(Weather(building.coord), cached=True)
+    building = pickle.loads(pickle.dumps(building))
+    assert building.weather_sources['weather_electricity'][0] == 'weather'
+
+    building.add_weather(temperatures_e_F=[50.0, 53.6, 59.0])
+    building = pickle.loads(pickle.dumps(building))
+    assert list(building.weather_electricity.v_T_C) == pytest.approx([10.0, 12.0, 15.0])
+    assert building.weather_sources == {}
+
+
+def test_add_utility_leaves_the_input_untouched(utility_e):
+    v_columns = list(utility_e.df_raw_data.columns)
+    buildings = [Building(i, 'Building', 'Address', 'Office', 1000.0, coord=[37.0, -122.0])
+                 for i in range(2)]
+    for building in buildings:
+        building.add_utility(utility_e)
+
+    assert list(utility_e.df_raw_data.columns) == v_columns
+    assert not hasattr(utility_e, 'df_periods')
+    assert list(buildings[1].utility_electricity.df_raw_data['kWh']) == [1000.0, 900.0, 950.0]
+
+
+def test_benchmark():
+    building = Building(1, 'Building', 'Address', 'Office', 1000.0, coord=[37.0, -122.0])
+    building.im_electricity = SimpleNamespace(
+        coeffs={'base': 0.2, 'csl': 0.01, 'ccp': 20.0, 'hsl': 0.0, 'hcp': 20.0},
+        coeff_validation={'base': True, 'csl': True, 'ccp': True, 'hsl': False, 'hcp': False})
+
+    building.benchmark()
+
+    assert building.df_benchmark_f is None
+    assert building.df_benchmark_e.loc['beta_base', 'rating_str'] == 'Good'
+    assert building.df_benchmark_e.loc['beta_hdd', 'rating_str'] == ''
+    assert 'Baseload' in building.benchmarking_bar_base_e_html
+    assert building.benchmarking_bar_hsl_e_html == ''
+    assert building.benchmarking_bar_base_f_html == ''
+
+
+def fitted_building(saving_target=2):
+    v_start = pd.date_range('2019-01-01', periods=24, freq='MS')
+    df_raw = pd.DataFrame({'Monthly Billing Start Date': v_start,
+                           'Monthly Billing End Date': v_start + pd.offsets.MonthEnd(0),
+                           'kWh': 1000.0, 'Cost': 100.0})
+    v_T_C = 14 - 12 * np.cos(np.arange(24) * np.pi / 6)
+    building = Building(1, 'Building', 'Address', 'Office', 1000.0, saving_target=saving_target,
+                        coord=[37.0, -122.0])
+    building.add_utility(Utility('electricity', df_raw), Utility('fossil fuel', df_raw))
+    building.add_weather(temperatures_e_F=v_T_C * 1.8 + 32, temperatures_f_F=v_T_C * 1.8 + 32)
+    # 5P electricity and 3P heating fossil fuel models
+    building.im_electricity = SimpleNamespace(
+        coeffs={'base': 0.5, 'csl': 0.03, 'ccp': 8.0, 'hsl': 0.02, 'hcp': 16.0},
+        model_p=np.array([16.0, 8.0, 0.5, -0.02, 0.03]))
+    building.im_fossil_fuel = SimpleNamespace(
+        coeffs={'base': 0.01, 'csl': 0.0, 'ccp': 15.0, 'hsl': 0.02, 'hcp': 15.0},
+        model_p=np.array([15.0, 15.0, 0.01, -0.02, 0.0]))
+    return building
+
+
+def test_ee_assess():
+    building = fitted_building()
+    building.ee_assess()
+
+    assert building.FIM_table_e.loc['Reduce Lighting Load', 'FIM Recommendations'] == 'X'
+    assert building.FIM_table_f.loc['Reduce Lighting Load', 'FIM Recommendations'] == ''
+    assert 'Check Fossil Baseload' in building.FIM_list
+    # Nominal targets are the medians, the heating slope keeps the sign of model_p
+    assert building.p_new_e == pytest.approx((13.3, 11.8, 0.352, -0.00609, 0.008635))
+    assert building.p_typical_f == pytest.approx((13.5, 0.0, 0.005805, -0.00698, 0.0))
+    # The 3P heating fossil fuel model has no cooling coefficients
+    assert np.isnan(building.coeff_out_f.loc['beta_cdd', 'site_coefficient'])
+
+
+def test_savings_scenarios():
+    df_scenarios = fitted_building().savings_scenarios(['conservative', 'nominal', 'aggressive', 0.5])
+
+    assert list(df_scenarios['sigma']) == [1.0, 0.0, -0.5, 0.5]
+    # Tighter targets save more
+    assert (df_scenarios.loc['aggressive', 'total_energy_savings']
+            > df_scenarios.loc['nominal', 'total_energy_savings']
+            > df_scenarios.loc[0.5, 'total_energy_savings']
+            > df_scenarios.loc['conservative', 'total_energy_savings'])
+
+    for target_level, saving_target in (('conservative', 1), ('nominal', 2), ('aggressive', 3)):
+        building = fitted_building(saving_target)
+        building.ee_assess()
+        building.calculate_savings()
+        building.disaggregate_consumption_wrapper()
+        row = df_scenarios.loc[target_level]
+        for name in ('total_energy_savings_last_year_e', 'total_energy_savings_pct_last_year_e',
+                     'total_cost_savings_e', 'total_energy_savings_last_year_f', 'total_cost_savings_f',
+                     'total_energy_savings', 'total_cost_savings', 'total_energy_savings_pct',
+                     'base_new', 'heating_new', 'cooling_new',
+                     'base_new_cost', 'heating_new_cost', 'cooling_new_cost'):
+            assert row[name] == pytest.approx(getattr(building, name)), name
+        assert row['beta_hdd_e'] == pytest.approx(-building.hsl_new_e)
+        assert row['beta_betc_e'] == pytest.approx(building.ccp_new_e)
+
+
+def test_disaggregate_consumption_stack():
+    rng = np.random.default_rng(0)
+    m_T = rng.uniform(-5, 30, (4, 12))
+    m_days = rng.integers(28, 32, (4, 12)).astype(float)
+    # Shorter billing history for the last building
+    m_T[3, 9:] = m_days[3, 9:] = np.nan
+    model_p = np.stack([rng.uniform(5, 12, (4, 3)), rng.uniform(12, 25, (4, 3)), rng.uniform(0, 1, (4, 3)),
+                        -rng.uniform(0, 0.05, (4, 3)), rng.uniform(0, 0.05, (4, 3))], axis=-1)
+    # 3P heating and 3P cooling models
+    model_p[0, 1] = [15.0, 15.0, 0.5, -0.02, 0.0]
+    model_p[1, 2] = [15.0, 15.0, 0.5, 0.0, 0.03]
+    v_area = np.array([1000.0, 2000.0, 500.0, 1500.0])
+
+    d_consumption = Building.disaggregate_consumption_stack(m_T, m_days, model_p, v_area, 0.1)
+
+    for b in range(4):
+        valid = ~np.isnan(m_T[b])
+        for k in range(3):
+            v_consumption = Building.disaggregate_consumption(m_T[b, valid], m_days[b, valid],
+                                                              model_p[b, k], v_area[b])
+            assert [d_consumption[end_use][b, k] for end_use in Building.end_uses] == pytest.approx(v_consumption)
+            # The end uses add up to the consumption the model predicts
+            v_predicted = InverseModel.piecewise_linear(m_T[b, valid], *model_p[b, k])
+            assert sum(v_consumption) == pytest.approx(np.sum(v_area[b] * m_days[b, valid] * v_predicted))
+    assert d_consumption['heating_cost'] == pytest.approx(d_consumption['heating'] * 0.1)
+
+
+def test_disaggregate_consumption_single_heating_period():
+    base, heating, cooling = Building.disaggregate_consumption(
+        np.array([5.0, 15.0, 16.0]), np.array([30.0, 30.0, 30.0]), np.array([10.0, 20.0, 0.5, -0.1, 0.1]), 100.0)
+
+    assert base == pytest.approx(0.5 * 90 * 100)
+    assert heating == pytest.approx(0.5 * 30 * 100)
+    assert cooling == 0
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from better.model import InverseModel
+from better.cache import ModelCache
+
+
+@pytest.fixture
+def test_temperature():
+    return np.array([68.12575107, 70.38140704, 71.49038076, 75.91127527, 79.23819562,
+                     80.94022825, 83.36044143, 82.32376491, 81.7343778, 79.23531421,
+                     74.43723106, 68.94813234])
+
+
+@pytest.fixture
+def test_eui_electric():
+    return np.array([0.41082736, 0.41278433, 0.42939531, 0.42957719, 0.4665275,
+                     0.496334, 0.48262927, 0.5129985, 0.47703349, 0.45208535,
+                     0.43193808, 0.396703])
+
+
+def test_key_depends_on_data_and_settings(test_temperature, test_eui_electric):
+    key = ModelCache.key(InverseModel(test_temperature, test_eui_electric))
+
+    assert key == ModelCache.key(InverseModel(list(test_temperature), list(test_eui_electric)))
+    assert key != ModelCache.key(InverseModel(test_temperature, test_eui_electric * 1.01))
+    assert key != ModelCache.key(InverseModel(test_temperature, test_eui_electric,
+                                              engine='segmented'))
+    assert key != ModelCache.key(InverseModel(test_temperature, test_eui_electric), 0.2)
+
+
+def test_fit_model_memory_and_disk_hits(tmp_path, test_temperature, test_eui_electric):
+    cache = ModelCache(tmp_path)
+    model = cache.fit_model(InverseModel(test_temperature, test_eui_electric))
+    assert cache.misses == 1 and cache.hits == 0
+    assert model.has_fit
+
+    cached = cache.fit_model(InverseModel(test_temperature, test_eui_electric))
+    assert cache.memory_hits == 1
+    assert cached is not model
+    assert cached.model_type_str == model.model_type_str
+    assert list(cached.model_p) == list(model.model_p)
+
+    # A new cache on the same directory, e.g. the next nightly run
+    cache = ModelCache(tmp_path)
+    cached = cache.fit_model(InverseModel(test_temperature, test_eui_electric))
+    assert cache.disk_hits == 1 and cache.misses == 0
+    assert list(cached.model_p) == list(model.model_p)
+
+
+def test_eviction(tmp_path, test_temperature, test_eui_electric):
+    cache = ModelCache(tmp_path, max_memory_items=2, max_disk_bytes=0)
+    for i in range(3):
+        model = InverseModel(test_temperature, test_eui_electric + i)
+        cache.put(cache.key(model), model)
+
+    assert len(cache.memory) == 2
+    assert cache.files() == []
+    assert cache.disk_bytes == 0
+
+
+def test_put_same_key_keeps_disk_bytes(tmp_path, test_temperature, test_eui_electric):
+    cache = ModelCache(tmp_path)
+    model = InverseModel(test_temperature, test_eui_electric)
+    key = cache.key(model)
+    cache.put(key, model)
+    disk_bytes = cache.stats()['disk_bytes']
+
+    cache.put(key, model)
+
+    assert disk_bytes > 0
+    assert cache.stats()['disk_bytes'] == disk_bytes == sum(f.stat().st_size for f in cache.files())
@@ -0,0 +1,144 @@
+import functools
+import gzip
+import http.server
+import multiprocessing
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+import better.demo as demo
+import better.geocoding as geocoding
+from better.building import Building
+from better.portfolio import Portfolio
+from better.weather import StationCoverage, Weather
+
+
+class CountingHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, *args, v_path, **kwargs):
+        self.v_path = v_path
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self.v_path.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def weather_server(tmp_path, monkeypatch):
+    # One 2020 ISD file for the station at Twenty Nine Palms, the paths requested are counted
+    record = ''.join(['0111', '690150', '93121', '20200101', '0056', '4', '+34300', '-116167',
+                      'FM-15', '+0005', 'KNXP ', 'V020', '160', '1', 'N', '0046', '1', '22000',
+                      '1', '9', 'N', '016093', '1', '9', '9', '+0122', '1', '+0083', '1',
+                      '10243', '1']).encode()
+    records = [record.replace(b'20200101', b'202001' + str(day).zfill(2).encode())
+               for day in range(1, 29)]
+    (tmp_path / 'noaa' / '2020').mkdir(parents=True)
+    (tmp_path / 'noaa' / '2020' / '690150-93121-2020.gz').write_bytes(
+        gzip.compress(b'\n'.join(records) + b'\n'))
+    v_path = []
+    handler = functools.partial(CountingHandler, directory=str(tmp_path / 'noaa'), v_path=v_path)
+    with http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setattr(Weather, 'noaa_source', 'http://127.0.0.1:' + str(server.server_port))
+        try:
+            yield v_path
+        finally:
+            server.shutdown()
+
+
+def use_portfolio(monkeypatch, n):
+    # n buildings next to the same station, set up without reading a workbook
+    v_building_ID = list(range(1, n + 1))
+    v_address = [str(i) + ' Main St' for i in v_building_ID]
+
+    def read_raw_data_from_xlsx(self, file_path):
+        self.df_meta = pd.DataFrame({
+            'building_ID': v_building_ID, 'building_name': [chr(64 + i) for i in v_building_ID],
+            'building_address': v_address, 'building_area': [1000.0 * i for i in v_building_ID],
+            'building_space_type_1st': 'Office', 'building_space_type_2nd': None,
+            'building_cooling_fuel_type': None, 'building_heating_fuel_type': None,
+            'currency': 'US Dollar'})
+        self.df_detail = pd.DataFrame({
+            'building_ID': np.repeat(v_building_ID, 2),
+            'bill_start_dates': pd.to_datetime(['2020-01-01', '2020-01-15'] * n),
+            'bill_end_dates': pd.to_datetime(['2020-01-14', '2020-01-28'] * n),
+            'energy_type': 'Electricity - Grid Purchased', 'energy_unit': 'kWh',
+            'energy_consumption': np.tile([1000.0, 900.0], n) * np.repeat(v_building_ID, 2),
+            'energy_cost': np.tile([100.0, 90.0], n) * np.repeat(v_building_ID, 2)})
+        self.build_index()
+
+    geocoder = geocoding.Geocoder(online=False)
+    for address in v_address:
+        geocoder.cache[geocoding.normalize_address(address)] = geocoding.GeocodeResult(
+            34.3, -116.167, address, 'test')
+    monkeypatch.setattr(Portfolio, 'read_raw_data_from_xlsx', read_raw_data_from_xlsx)
+    monkeypatch.setattr(geocoding, 'default_geocoder', geocoder)
+
+
+@pytest.fixture
+def two_building_portfolio(monkeypatch):
+    use_portfolio(monkeypatch, 2)
+    monkeypatch.setattr(Weather, 'default_station_coverage', StationCoverage())
+    # Load the weather, then stop as if no model fits
+    monkeypatch.setattr(Building, 'fit_inverse_model',
+                        lambda self, model_cache=None: print(str(self.weather_electricity.v_T_F)) and False)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_batch_fetches_each_station_year_once(tmp_path, weather_server, two_building_portfolio,
+                                                  capfd, workers):
+    if workers > 1 and multiprocessing.get_start_method() != 'fork':
+        pytest.skip('pool workers only see the test setup when forked')
+
+    demo.run_batch(1, 2, tmp_path / 'portfolio.xlsx', cached_weather=False, workers=workers)
+
+    output = capfd.readouterr().out
+    assert weather_server == ['/2020/690150-93121-2020.gz']
+    # The workers' lines may interleave
+    assert output.count('[53.96 53.96]') == 2
+    assert 'failed' not in output
+
+
+def test_run_batch_pool_isolates_failures(tmp_path, monkeypatch, capfd):
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip('pool workers only see the test setup when forked')
+    use_portfolio(monkeypatch, 3)
+
+    def run_single(bldg_id, **kwargs):
+        if bldg_id == 2:
+            raise ValueError('no bills for building 2')
+        if bldg_id == 1:
+            # Finishes last
+            time.sleep(0.5)
+        return True, SimpleNamespace(bldg_id=bldg_id, bldg_name=str(bldg_id) + '_name')
+    monkeypatch.setattr(demo, 'run_single', run_single)
+
+    v_record = demo.run_batch(1, 3, tmp_path / 'portfolio.xlsx', workers=2)
+
+    output = capfd.readouterr().out
+    assert [None if record is None else record.bldg_id for record in v_record] == [1, None, 3]
+    assert v_record[0].bldg_name == '1_name'
+    assert 'Building 2 failed' in output
+    assert 'ValueError: no bills for building 2' in output
+    assert 'Building 1 failed' not in output and 'Building 3 failed' not in output
+
+
+def test_run_batch_offline_geocoding(tmp_path, monkeypatch):
+    use_portfolio(monkeypatch, 2)
+    monkeypatch.setattr(demo, 'run_single', lambda bldg_id, **kwargs: (False, None))
+    v_online = []
+    monkeypatch.setattr(geocoding.Geocoder, 'geocode_online', lambda self, address: v_online.append(address))
+
+    geocoding.default_geocoder.online = True
+    demo.run_batch(1, 2, tmp_path / 'portfolio.xlsx', geocode_online=False)
+    assert not geocoding.default_geocoder.online
+
+    demo.run_batch(1, 2, tmp_path / 'portfolio.xlsx', geocode_cache_path=tmp_path / 'geocode.json',
+                   geocode_online=False)
+    assert not geocoding.default_geocoder.online
+    assert v_online == []
@@ -0,0 +1,77 @@
+import pickle
+import sys
+import pandas as pd
+import pytest
+from better.geocoding import GeocodeResult, Gazetteer, Geocoder, normalize_address
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    pd.DataFrame({'USPS': ['CA', 'CA', 'NY'],
+                  'NAME': ['Berkeley city', 'San Francisco city', 'Berkeley CDP'],
+                  'INTPTLAT': [37.87, 37.76, 42.0],
+                  'INTPTLONG': [-122.27, -122.44, -74.0]}).to_csv(
+        tmp_path / 'places.txt', sep='\t', index=False)
+    pd.DataFrame({'GEOID': ['94720'], 'INTPTLAT': [37.874], 'INTPTLONG': [-122.259]}).to_csv(
+        tmp_path / 'zcta.txt', sep='\t', index=False)
+    return Gazetteer([tmp_path / 'places.txt', tmp_path / 'zcta.txt'])
+
+
+def test_normalize_address():
+    assert normalize_address('1 Cyclotron Road,  Berkeley, CA') == normalize_address('1 cyclotron rd. berkeley ca')
+
+
+def test_gazetteer_lookup(gazetteer):
+    assert gazetteer.lookup('1 Cyclotron Rd, Berkeley, CA 94720').latlng == [37.874, -122.259]
+    assert gazetteer.lookup('1 Main St, Berkeley, CA 94709').latlng == [37.87, -122.27]
+    assert gazetteer.lookup('1 Main St, Berkeley, NY').latlng == [42.0, -74.0]
+    assert gazetteer.lookup('100 Market Street San Francisco CA').latlng == [37.76, -122.44]
+    assert gazetteer.lookup('1 Main St, Springfield, IL') is None
+
+
+def test_geocoder_cache_and_fallback(tmp_path, gazetteer, monkeypatch):
+    v_online = []
+    monkeypatch.setattr(Geocoder, 'geocode_online', lambda self, address: v_online.append(address) or (
+        GeocodeResult(1.0, 2.0, address, 'google') if 'Cyclotron' in address else None))
+    geocoder = Geocoder(tmp_path / 'geocode.json', gazetteer)
+
+    d_results = geocoder.resolve_many(['1 Cyclotron Rd, Berkeley, CA', '1 cyclotron road berkeley ca',
+                                       '1 Main St, Berkeley, CA'])
+
+    assert v_online == ['1 Cyclotron Rd, Berkeley, CA', '1 Main St, Berkeley, CA']
+    assert d_results['1 cyclotron road berkeley ca'].latlng == [1.0, 2.0]
+    assert d_results['1 Main St, Berkeley, CA'].provider == 'gazetteer'
+
+    geocoder = pickle.loads(pickle.dumps(Geocoder(tmp_path / 'geocode.json', online=False)))
+    assert geocoder.resolve('1 Cyclotron Road, Berkeley, CA').latlng == [1.0, 2.0]
+    assert geocoder.resolve('1 Main St, Berkeley, CA') is None
+    assert len(v_online) == 2
+
+
+def test_geocoder_without_geocoder_package(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'geocoder', None)
+    assert Geocoder().geocode_online('1 Cyclotron Rd, Berkeley, CA') is None
+
+
+def test_geocoder_remembers_misses(tmp_path, monkeypatch):
+    v_online = []
+    monkeypatch.setattr(Geocoder, 'geocode_online', lambda self, address: v_online.append(address))
+    geocoder = Geocoder(tmp_path / 'geocode.json')
+
+    assert geocoder.resolve('1 Main St, Springfield, IL') is None
+    assert geocoder.resolve('1 main street springfield il') is None
+    assert len(v_online) == 1
+
+    # The miss outlives the process, until miss_ttl has passed
+    assert Geocoder(tmp_path / 'geocode.json').resolve('1 Main St, Springfield, IL') is None
+    assert len(v_online) == 1
+    assert Geocoder(tmp_path / 'geocode.json', miss_ttl=0).resolve('1 Main St, Springfield, IL') is None
+    assert len(v_online) == 2
+
+    # A later answer replaces the miss
+    monkeypatch.setattr(Geocoder, 'geocode_online',
+                        lambda self, address: GeocodeResult(1.0, 2.0, address, 'google'))
+    Geocoder(tmp_path / 'geocode.json', miss_ttl=0).resolve('1 Main St, Springfield, IL')
+    geocoder = Geocoder(tmp_path / 'geocode.json', online=False)
+    assert geocoder.resolve('1 Main St, Springfield, IL').latlng == [1.0, 2.0]
+    assert geocoder.misses == {}
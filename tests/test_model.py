@@ -50,6 +50,34 @@ def test_piecewise_linear(test_temperature):
     assert expected == pytest.approx(list(result))
 
 
+def test_piecewise_linear_parameter_sets(test_temperature):
+    params = np.array([[76, 81, 10, -5, 5],
+                       [70, 75, 2, -1, 3],
+                       [np.nan, 75, 2, np.nan, 3],
+                       [70, np.nan, 2, -1, np.nan]])
+
+    result = InverseModel.piecewise_linear(test_temperature, *params.T)
+
+    assert result.shape == (4, len(test_temperature))
+    for row, p in zip(result, params):
+        assert list(row) == pytest.approx(list(InverseModel.piecewise_linear(test_temperature, *p)))
+
+
+def test_piecewise_linear_jacobian(test_temperature):
+    p = np.array([72.5, 79.5, 10, -5, 5])
+    step = 1e-6
+
+    jacobian = InverseModel.piecewise_linear_jacobian(test_temperature, *p)
+
+    assert jacobian.shape == (len(test_temperature), 5)
+    for i in range(5):
+        dp = np.zeros(5)
+        dp[i] = step
+        numerical = (InverseModel.piecewise_linear(test_temperature, *(p + dp)) -
+                     InverseModel.piecewise_linear(test_temperature, *(p - dp))) / (2 * step)
+        assert list(jacobian[:, i]) == pytest.approx(list(numerical), abs=1e-5)
+
+
 def test_fit_model_electric(test_temperature: npt.ArrayLike, test_eui_electric: npt.ArrayLike):
     model = InverseModel(temperature=test_temperature,
                          eui=test_eui_electric)
@@ -57,11 +85,11 @@ def test_fit_model_electric(test_temperature: npt.ArrayLike, test_eui_electric:
     has_fit = model.fit_model()
 
     assert has_fit
-    assert model.base == pytest.approx(0.4124275744214844)
-    assert model.ccp == pytest.approx(72.88651279550146)
-    assert model.hcp == pytest.approx(72.88651279550146)
+    assert model.base == pytest.approx(0.41242750000006234)
+    assert model.ccp == pytest.approx(72.88644724272818)
+    assert model.hcp == pytest.approx(72.88644724272818)
     assert model.hsl == 0
-    assert model.csl == pytest.approx(0.008314150916399145)
+    assert model.csl == pytest.approx(0.008314098918782408)
     assert model.model_type_str == '3P Cooling'
     assert model.cp_txt == '(72.9, 0.4)'
 
@@ -139,6 +167,28 @@ def test_5p_model():
     assert model.r2 == pytest.approx(0.7760372322434232)
 
 
+@pytest.mark.parametrize('eui_fixture', ['test_eui_electric', 'test_eui_fossil_fuel'])
+def test_coarse_to_fine_cp_search(test_temperature: npt.ArrayLike, eui_fixture: str, request):
+    eui = request.getfixturevalue(eui_fixture)
+    sweep = InverseModel(temperature=test_temperature,
+                         eui=eui)
+    sweep.fit_model()
+    model = InverseModel(temperature=test_temperature,
+                         eui=eui,
+                         cp_search='coarse_to_fine')
+
+    has_fit = model.fit_model()
+
+    assert has_fit
+    assert model.model_type_str == sweep.model_type_str
+    assert model.base == pytest.approx(sweep.base, rel=1e-4)
+    assert model.hcp == pytest.approx(sweep.hcp, rel=1e-4)
+    assert model.ccp == pytest.approx(sweep.ccp, rel=1e-4)
+    assert model.fits_saved > 0
+    assert model.n_fits + model.fits_saved == sweep.n_fits
+    assert sweep.fits_saved == 0
+
+
 def test_rmse(test_temperature: npt.ArrayLike, test_eui_electric: npt.ArrayLike):
     model = InverseModel(temperature=test_temperature,
                          eui=test_eui_electric)
@@ -146,3 +196,231 @@ def test_rmse(test_temperature: npt.ArrayLike, test_eui_electric: npt.ArrayLike)
     model.fit_model()
 
     assert model.rmse() == pytest.approx(0.01278258303587747)
+
+
+def fit_both_engines(temperature: npt.ArrayLike, eui: npt.ArrayLike) -> tuple[InverseModel, InverseModel]:
+    models = []
+    for engine in ['curve_fit', 'segmented']:
+        model = InverseModel(temperature=temperature,
+                             eui=eui,
+                             engine=engine)
+        model.fit_model()
+        models.append(model)
+    return models[0], models[1]
+
+
+@pytest.mark.parametrize('eui_fixture', ['test_eui_electric', 'test_eui_fossil_fuel'])
+def test_segmented_engine_matches_fit_model(test_temperature: npt.ArrayLike, eui_fixture: str, request):
+    expected, model = fit_both_engines(test_temperature, request.getfixturevalue(eui_fixture))
+
+    assert model.has_fit
+    assert model.model_type_str == expected.model_type_str
+    assert model.cp_txt == expected.cp_txt
+    assert list(model.model_p) == pytest.approx(list(expected.model_p), rel=1e-5)
+    assert model.r2 == pytest.approx(expected.r2)
+    assert [model.p_base, model.p_hsl, model.p_csl] == pytest.approx(
+        [expected.p_base, expected.p_hsl, expected.p_csl], rel=1e-3, abs=1e-6)
+
+
+@pytest.mark.parametrize('model_type, p, seed', [('3P Heating', (12, 12, 0.5, -0.03, 0), 0),
+                                                 ('3P Cooling', (18, 18, 0.5, 0, 0.03), 0),
+                                                 ('4P', (15, 15, 0.5, -0.03, 0.03), 1),
+                                                 ('5P', (10, 20, 0.5, -0.03, 0.03), 0)])
+def test_segmented_engine_model_types(model_type: str, p: tuple, seed: int):
+    rng = np.random.default_rng(seed)
+    temperature = rng.uniform(-5, 30, 24)
+    eui = InverseModel.piecewise_linear(temperature, *p) + rng.normal(0, 0.02, 24)
+
+    expected, model = fit_both_engines(temperature, eui)
+
+    assert expected.model_type_str == model_type
+    assert model.model_type_str == model_type
+    assert model.r2 == pytest.approx(expected.r2, abs=1e-3)
+    # Insignificant slopes are bounded near zero rather than dropped, as in curve_fit
+    assert [model.p_base, model.p_hsl, model.p_csl] == pytest.approx(
+        [expected.p_base, expected.p_hsl, expected.p_csl], rel=1e-3, abs=1e-6)
+
+
+def test_searchsorted_rows():
+    rng = np.random.default_rng(0)
+    x = np.sort(np.round(rng.normal(0, 10, (6, 12)), 1), axis=1)
+    # Padded rows and candidates at, between, beyond and missing from the data
+    x[1, 8:] = x[4, :] = np.inf
+    c = np.concatenate([x[:, :3], np.round(rng.normal(0, 12, (6, 5)), 1)], axis=1)
+    c[2, 4], c[3, 5], c[5, 6] = np.nan, np.inf, -np.inf
+
+    with np.errstate(invalid='ignore'):
+        assert (InverseModel.searchsorted_rows(x, c, 'left') == np.sum(x[:, None, :] < c[:, :, None], axis=2)).all()
+        assert (InverseModel.searchsorted_rows(x, c, 'right') == np.sum(x[:, None, :] <= c[:, :, None], axis=2)).all()
+
+
+def test_segmented_engine_is_least_squares_at_change_point():
+    temperature = np.array([16.49774436, 19.17597293, 20.54890511, 22.68663594, 24.98291925,
+                            27.78870968, 29.52193646, 28.97226754, 27.16207455, 23.29365079,
+                            20.12974684, 13.40963855])
+    eui = np.array([0.43714513, 0.43216608, 0.42055272, 0.40125029, 0.44447121,
+                    0.49665507, 0.49037908, 0.51118835, 0.45466266, 0.42066609,
+                    0.40706217, 0.42708896])
+
+    expected, model = fit_both_engines(temperature, eui)
+
+    # Solving the linear model directly at the selected change-points gives the same coefficients.
+    # Both engines settle on hcp > ccp here, which inverse_cp turns into a 4P model.
+    design = InverseModel.piecewise_linear_jacobian(temperature, *model.p)[:, 2:]
+    coefficients = np.linalg.lstsq(design, eui, rcond=None)[0]
+
+    assert model.p[0] > model.p[1]
+    assert model.model_type_str == expected.model_type_str == '4P'
+    assert [model.base, model.hsl, model.csl] == pytest.approx(list(coefficients))
+    # The exhaustive search is at least as good as curve_fit's
+    assert model.r2 >= expected.r2
+
+
+def test_fit_batch_matches_single_fits(test_temperature: npt.ArrayLike,
+                                       test_eui_electric: npt.ArrayLike,
+                                       test_eui_fossil_fuel: npt.ArrayLike):
+    # Unequal bill counts are padded automatically
+    temperatures = [test_temperature, test_temperature, test_temperature[:9]]
+    euis = [test_eui_electric, test_eui_fossil_fuel, test_eui_electric[:9]]
+
+    table = InverseModel.fit_batch(temperatures, euis)
+
+    assert len(table) == 3
+    assert list(table['n']) == [12, 12, 9]
+    for row, (temperature, eui) in zip(table.itertuples(), zip(temperatures, euis)):
+        model = InverseModel(temperature=temperature,
+                             eui=eui,
+                             engine='segmented')
+        model.fit_model()
+        assert row.model_type == model.model_type_str
+        assert [row.hcp, row.ccp, row.base, row.hsl, row.csl] == pytest.approx(list(model.model_p))
+        assert row.r2 == pytest.approx(model.r2)
+
+
+def test_fit_batch_matches_fit_model(test_temperature: npt.ArrayLike,
+                                     test_eui_electric: npt.ArrayLike,
+                                     test_eui_fossil_fuel: npt.ArrayLike):
+    rng = np.random.default_rng(0)
+    temperatures, euis = [test_temperature, test_temperature], [test_eui_electric, test_eui_fossil_fuel]
+    for p in [(12, 12, 0.5, -0.03, 0), (18, 18, 0.5, 0, 0.03), (10, 20, 0.5, -0.03, 0.03)]:
+        temperature = rng.uniform(-5, 30, 24)
+        temperatures.append(temperature)
+        euis.append(InverseModel.piecewise_linear(temperature, *p) + rng.normal(0, 0.02, 24))
+
+    table = InverseModel.fit_batch(temperatures, euis)
+
+    assert list(table['model_type']) == ['3P Cooling', '3P Heating', '3P Heating', '3P Cooling', '5P']
+    for row, (temperature, eui) in zip(table.itertuples(), zip(temperatures, euis)):
+        model = InverseModel(temperature=temperature,
+                             eui=eui)
+        model.fit_model()
+        assert row.model_type == model.model_type_str
+        assert row.r2 == pytest.approx(model.r2, abs=1e-3)
+        assert [row.p_base, row.p_hsl, row.p_csl] == pytest.approx(
+            [model.p_base, model.p_hsl, model.p_csl], rel=1e-3, abs=1e-6)
+
+
+def test_fit_batch_second_slope_pass():
+    # fit_model drops one slope in the first significance pass and the other only in the second
+    temperatures = [[23.5, 29.9, 7.3, 1.0, 8.7, 21.4, 10.4, 15.6, -0.5],
+                    [10.4, 22.1, 12.5, 1.4, 5.4, 15.1, 0.0, -4.5, 10.2],
+                    [11.5, 29.9, 11.0, -0.1, 12.3, 19.1, 3.8, 12.3, 1.5]]
+    euis = [[1.041, 0.974, 0.954, 1.123, 0.889, 1.103, 1.018, 0.92, 0.971],
+            [0.987, 1.13, 0.903, 1.193, 1.188, 0.829, 0.986, 1.034, 0.924],
+            [0.875, 1.048, 1.038, 1.001, 0.753, 1.01, 0.992, 1.118, 0.966]]
+
+    table = InverseModel.fit_batch(temperatures, euis)
+
+    for row, (temperature, eui) in zip(table.itertuples(), zip(temperatures, euis)):
+        model = InverseModel(temperature=np.array(temperature),
+                             eui=np.array(eui),
+                             engine='segmented')
+        v_changed = []
+        update_slope_significance = model.update_slope_significance
+
+        def update():
+            flags = (model.hsl_insignificant, model.csl_insignificant)
+            update_slope_significance()
+            v_changed.append(flags != (model.hsl_insignificant, model.csl_insignificant))
+        model.update_slope_significance = update
+        model.fit_model()
+
+        assert v_changed == [True, True]
+        assert row.has_fit
+        assert row.model_type == model.model_type_str
+        assert [row.hcp, row.ccp, row.base, row.hsl, row.csl] == pytest.approx(list(model.model_p))
+
+
+def test_fit_batch_masked_and_empty_rows(test_temperature: npt.ArrayLike, test_eui_electric: npt.ArrayLike):
+    temperature = np.stack([test_temperature, test_temperature])
+    eui = np.stack([test_eui_electric, test_eui_electric])
+    mask = np.ones_like(temperature, dtype=bool)
+    mask[1] = False
+
+    table = InverseModel.fit_batch(temperature, eui, mask=mask)
+
+    assert list(table['has_fit']) == [True, False]
+    assert list(table['model_type']) == ['3P Cooling', 'No fit']
+    assert np.isnan(table.loc[1, 'base'])
+
+
+def test_incremental_refit(test_temperature: npt.ArrayLike, test_eui_electric: npt.ArrayLike):
+    full = InverseModel(temperature=test_temperature,
+                        eui=test_eui_electric,
+                        engine='segmented')
+    full.fit_model()
+    model = InverseModel(temperature=test_temperature[:-1],
+                         eui=test_eui_electric[:-1],
+                         engine='segmented')
+    model.fit_model()
+    previous = model.model_p.copy()
+
+    has_fit = model.add_periods(test_temperature[-1:], test_eui_electric[-1:])
+
+    assert has_fit
+    assert len(model.temperature) == len(test_temperature)
+    assert model.model_type_str == full.model_type_str
+    assert model.ccp == pytest.approx(full.ccp, abs=0.1)
+    assert model.r2 == pytest.approx(full.r2, abs=1e-3)
+
+    # Dropping the new period restores the previous fit
+    model.remove_periods([-1])
+    assert list(model.model_p) == pytest.approx(list(previous))
+
+
+@pytest.mark.parametrize('p', [(12, 12, 0.5, -0.03, 0), (18, 18, 0.5, 0, 0.03), (10, 20, 0.5, -0.03, 0.03)])
+def test_incremental_refit_matches_fit_model(p: tuple):
+    rng = np.random.default_rng(0)
+    temperature = rng.uniform(-5, 30, 24)
+    eui = InverseModel.piecewise_linear(temperature, *p) + rng.normal(0, 0.02, 24)
+    model = InverseModel(temperature=temperature[:20],
+                         eui=eui[:20],
+                         engine='segmented')
+    model.fit_model()
+
+    def assert_matches_fit_model(n):
+        expected = InverseModel(temperature=temperature[:n],
+                                eui=eui[:n])
+        expected.fit_model()
+        assert model.model_type_str == expected.model_type_str
+        assert model.r2 == pytest.approx(expected.r2, abs=1e-3)
+        v_p = np.array([model.p_base, model.p_hsl, model.p_csl])
+        v_expected = np.array([expected.p_base, expected.p_hsl, expected.p_csl])
+        # The candidates are fixed by the first fit, so only significant p-values are compared
+        assert list(v_p < 0.05) == list(v_expected < 0.05)
+        assert list(v_p[v_p < 0.05]) == pytest.approx(list(v_expected[v_p < 0.05]), rel=1e-3, abs=1e-6)
+
+    model.add_periods(temperature[20:], eui[20:])
+    assert_matches_fit_model(24)
+    model.remove_periods(slice(20, None))
+    assert_matches_fit_model(20)
+
+
+def test_incremental_refit_requires_segmented_engine(test_temperature: npt.ArrayLike,
+                                                     test_eui_electric: npt.ArrayLike):
+    model = InverseModel(temperature=test_temperature,
+                         eui=test_eui_electric)
+    model.fit_model()
+
+    with pytest.raises(Exception):
+        model.add_periods(test_temperature[:1], test_eui_electric[:1])
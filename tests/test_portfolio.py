@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from better.constants import Constants
+from better.portfolio import Portfolio
+
+
+def filter_utility(df_detail, building_id, energy_type):
+    # The lookup build_index replaced: filter the bills, then convert each known unit
+    df_temp = df_detail.loc[df_detail['building_ID'] == building_id]
+    is_electricity = df_temp['energy_type'] == 'Electricity - Grid Purchased'
+    df_temp = df_temp.loc[is_electricity if energy_type == 1 else ~is_electricity].copy()
+    if df_temp.empty:
+        return None
+    for unit, factor in Constants.energy_unit_to_kWh.items():
+        df_temp.loc[df_temp['energy_unit'] == unit, 'energy_consumption'] *= factor
+    df_temp = df_temp[['bill_start_dates', 'bill_end_dates', 'energy_consumption', 'energy_cost']]
+    df_temp.columns = ["Monthly Billing Start Date", "Monthly Billing End Date", "kWh", "Cost"]
+    return df_temp
+
+
+def make_portfolio():
+    portfolio = Portfolio('Test')
+    portfolio.df_meta = pd.DataFrame({
+        'building_ID': [1, 2, 3], 'building_name': ['A', 'B', 'C'],
+        'building_address': ['1 Main St', '2 Main St', '3 Main St'],
+        'building_space_type_1st': 'Office', 'building_area': [1000.0, 2000.0, 3000.0],
+        'currency': 'US Dollar'})
+    portfolio.df_detail = pd.DataFrame({
+        'building_ID': [1, 2, 1, 2, 1, 2],
+        'bill_start_dates': pd.to_datetime(['2020-01-01', '2020-01-01', '2020-01-01',
+                                            '2020-02-01', '2020-02-01', '2020-03-01']),
+        'bill_end_dates': pd.to_datetime(['2020-01-31', '2020-01-31', '2020-01-31',
+                                          '2020-02-29', '2020-02-29', '2020-03-31']),
+        'energy_type': ['Electricity - Grid Purchased', 'Natural Gas', 'Natural Gas',
+                        'Electricity - Grid Purchased', 'Fuel Oil', 'Natural Gas'],
+        'energy_unit': ['MWh', 'Therms', 'MMBtu', 'kWh', 'Gallons', 'Cubic Meters'],
+        'energy_consumption': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        'energy_cost': [10.0, 20.0, 30.0, 40.0, 50.0, 60.0]})
+    portfolio.build_index()
+    return portfolio
+
+
+def test_build_index_matches_filter_lookup():
+    portfolio = make_portfolio()
+
+    assert portfolio.unknown_units == ['Gallons']
+    for building_id in [1, 2, 3]:
+        for energy_type in [1, 2]:
+            expected = filter_utility(portfolio.df_detail, building_id, energy_type)
+            df_utility = portfolio.get_utility_by_building_id_and_energy_type(building_id, energy_type)
+            if expected is None:
+                assert df_utility is None
+            else:
+                pd.testing.assert_frame_equal(df_utility, expected)
+    # Bills in an unknown unit are kept unconverted
+    assert portfolio.get_utility_by_building_id_and_energy_type(1, 2)['kWh'].tolist() == [
+        3.0 * Constants.MMBtu_to_kWh, 5.0]
+
+
+def test_get_building_data_by_id(capsys):
+    portfolio = make_portfolio()
+
+    building_info, df_electricity, df_fossil_fuel = portfolio.get_building_data_by_id(2)
+    assert building_info == ('B', '2 Main St', 'Office', 2000.0, 'US Dollar')
+    pd.testing.assert_frame_equal(df_electricity, filter_utility(portfolio.df_detail, 2, 1))
+    pd.testing.assert_frame_equal(df_fossil_fuel, filter_utility(portfolio.df_detail, 2, 2))
+
+    # A building without bills still has its info
+    assert portfolio.get_building_data_by_id(3) == (('C', '3 Main St', 'Office', 3000.0, 'US Dollar'),
+                                                    None, None)
+
+    assert portfolio.get_building_data_by_id(4) is None
+    assert 'Cannot find the building with ID: 4' in capsys.readouterr().out
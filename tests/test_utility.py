@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+from better.constants import Constants
+from better.utility import Utility
+
+
+def test_convert_to_kWh():
+    consumption = pd.Series([1.0, 2.0, 3.0, 4.0, 5.0])
+    units = pd.Series(['kWh', 'MWh', 'Therms', 'Gallons', None])
+
+    converted, unknown = Utility.convert_to_kWh(consumption, units)
+
+    assert list(converted) == pytest.approx([1.0, 2000.0, 3 * Constants.Therms_to_kWh, 4.0, 5.0])
+    assert unknown == ['Gallons', '<missing>']
+
+
+def test_process_converts_by_column_header():
+    df_raw_data = pd.DataFrame({
+        'Monthly Billing Start Date': pd.to_datetime(['2020-01-01', '2020-02-01']),
+        'Monthly Billing End Date': pd.to_datetime(['2020-01-31', '2020-02-29']),
+        'MWh': [1.0, 2.0],
+        'Cost': [10.0, 20.0]})
+    utility = Utility('electricity', df_raw_data)
+
+    utility.process()
+
+    assert list(utility.df_raw_data['kWh']) == [1000.0, 2000.0]
+    assert utility.unknown_units == []
+    assert list(utility.days) == [30, 28]
+    assert utility.recent_annual_consumption == 3000
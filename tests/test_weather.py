@@ -0,0 +1,176 @@
+import functools
+import gzip
+import http.server
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from better.weather import StationCoverage, StationIndex, Weather, WeatherPrefetch
+from better.weather_store import WeatherStore
+
+
+@pytest.fixture
+def isd_record():
+    # Mandatory section of an ISD record for San Francisco airport, 2020-01-01 00:56 UTC, 12.2 C
+    return ''.join(['0111', '724940', '23234', '20200101', '0056', '4', '+37619', '-122375',
+                    'FM-15', '+0005', 'KSFO ', 'V020', '160', '1', 'N', '0046', '1', '22000',
+                    '1', '9', 'N', '016093', '1', '9', '9', '+0122', '1', '+0083', '1',
+                    '10243', '1']).encode()
+
+
+def test_parse_isd_records(isd_record):
+    raw = b'\n'.join([isd_record,
+                      isd_record.replace(b'00564+37619', b'01564+37619').replace(b'+01221', b'-00561'),
+                      isd_record.replace(b'+01221', b'+99999'),
+                      isd_record.replace(b'+01221', b'+01223'),
+                      b'',
+                      isd_record[:60]])
+
+    v_datetime, v_temperature_F = Weather.parse_isd_records(raw)
+
+    assert list(v_datetime.astype(str)) == ['2020-01-01T00:56', '2020-01-01T01:56',
+                                            '2020-01-01T00:56', '2020-01-01T00:56']
+    assert v_temperature_F[:2] == pytest.approx([53.96, 21.92])
+    assert np.isnan(v_temperature_F[2:]).all()
+
+
+@pytest.fixture
+def isd_archive(tmp_path, isd_record):
+    # A stand-in for the NOAA archive, <root>/<year>/<station_ID>-<year>.gz
+    records = [isd_record.replace(b'20200101', b'202001' + str(day).zfill(2).encode())
+               for day in range(1, 29)]
+    (tmp_path / '2020').mkdir()
+    (tmp_path / '2020' / '724940-23234-2020.gz').write_bytes(
+        gzip.compress(b'\n'.join(records) + b'\n'))
+    return tmp_path
+
+
+def test_fetch_isd_year_from_folder(isd_archive):
+    v_datetime, v_temperature_F = Weather.fetch_isd_year('724940-23234', 2020, str(isd_archive),
+                                                         chunk_size=100)
+
+    assert len(v_datetime) == 28
+    assert v_datetime[-1] == np.datetime64('2020-01-28T00:56')
+    assert v_temperature_F == pytest.approx(np.full(28, 53.96))
+
+
+def test_fetch_isd_year_from_http(isd_archive):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(isd_archive))
+    with http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            v_datetime, v_temperature_F = Weather.fetch_isd_year(
+                '724940-23234', 2020, 'http://127.0.0.1:' + str(server.server_port), chunk_size=100)
+        finally:
+            server.shutdown()
+
+    assert len(v_datetime) == 28
+    assert v_temperature_F == pytest.approx(np.full(28, 53.96))
+
+
+def test_weather_prefetch_fetches_each_station_year_once(isd_archive, monkeypatch):
+    v_fetched = []
+    fetch_isd_year = Weather.fetch_isd_year
+    monkeypatch.setattr(Weather, 'fetch_isd_year',
+                        lambda *args, **kwargs: v_fetched.append(args[:2]) or fetch_isd_year(*args, **kwargs))
+    weather_prefetch = WeatherPrefetch(str(isd_archive), max_workers=2)
+    for _ in range(3):
+        weather_prefetch.plan('724940-23234', pd.to_datetime(['2020-01-01']), pd.to_datetime(['2020-01-31']))
+    weather_prefetch.plan('725300-94846', pd.to_datetime(['2020-01-01']), pd.to_datetime(['2020-01-31']))
+
+    weather_prefetch.fetch()
+    daily = weather_prefetch.get('724940-23234', 2020, 2020)
+
+    assert sorted(v_fetched) == [('724940-23234', 2020), ('725300-94846', 2020)]
+    assert len(daily) == 28
+    assert daily['mean'] == pytest.approx(np.full(28, 53.96))
+    assert not daily.flags.writeable
+    with pytest.raises(FileNotFoundError):
+        weather_prefetch.get('725300-94846', 2020, 2020)
+    assert len(v_fetched) == 2
+
+
+def test_station_coverage_expires_and_persists(tmp_path):
+    station_coverage = StationCoverage(tmp_path / 'coverage.json', negative_ttl=pd.Timedelta(days=1))
+    station_coverage.mark_available('noaa', '724940-23234', range(2019, 2021))
+    station_coverage.mark_missing('noaa', '725300-94846', 2020)
+    station_coverage.save()
+
+    station_coverage = StationCoverage(tmp_path / 'coverage.json')
+    assert station_coverage.is_usable('noaa', '724940-23234', range(2019, 2021))
+    assert not station_coverage.is_usable('noaa', '725300-94846', range(2019, 2021))
+    assert station_coverage.is_usable('cache', '725300-94846', range(2019, 2021))
+
+    station_coverage.sources['noaa']['725300-94846'][2020] -= 2 * 24 * 3600
+    assert station_coverage.is_usable('noaa', '725300-94846', range(2019, 2021))
+
+
+def test_weather_skips_stations_known_to_miss_data(isd_archive, monkeypatch):
+    v_fetched = []
+    fetch_isd_year = Weather.fetch_isd_year
+    monkeypatch.setattr(Weather, 'fetch_isd_year', staticmethod(
+        lambda *args, **kwargs: v_fetched.append(args[0]) or fetch_isd_year(*args, **kwargs)))
+    monkeypatch.setattr(Weather, 'noaa_source', str(isd_archive))
+    station_coverage = StationCoverage()
+    df_periods = pd.DataFrame({'start_dates': pd.to_datetime(['2020-01-01', '2020-01-10']),
+                               'end_dates': pd.to_datetime(['2020-01-09', '2020-01-20'])})
+    for _ in range(2):
+        weather = Weather([37.6, -122.4], station_coverage=station_coverage)
+        weather.v_station_ID[1] = '724940-23234'
+        weather.process(df_periods.copy())
+        weather.download_weather_NOAA()
+        assert weather.v_T_F == pytest.approx([53.96, 53.96])
+
+    assert v_fetched == [weather.v_station_ID[0], '724940-23234', '724940-23234']
+
+
+def test_station_index_matches_haversine():
+    rng = np.random.default_rng(0)
+    df_stations = pd.DataFrame({'station_ID': [str(i) for i in range(200)],
+                                'station_name': ['Station ' + str(i) for i in range(200)],
+                                'latitude': rng.uniform(25, 49, 200),
+                                'longitude': rng.uniform(-125, -67, 200)})
+    index = StationIndex(df_stations)
+
+    for latitude, longitude in zip(rng.uniform(25, 49, 20), rng.uniform(-125, -67, 20)):
+        distance = Weather.haversine_distance(latitude, longitude,
+                                              df_stations['latitude'], df_stations['longitude'])
+        v_distance, v_index = index.query(latitude, longitude, k=3)
+        assert list(v_index[0]) == list(np.argsort(distance)[:3])
+        assert v_distance[0] == pytest.approx(np.sort(distance)[:3])
+
+
+def test_aggregate_daily_periods():
+    v_datetime = pd.date_range('2020-01-01', '2020-03-31 23:00', freq='h')
+    v_temperature_F = 50 + 20 * np.sin(np.arange(len(v_datetime)) / 24)
+    v_temperature_F[::7] = np.nan
+    v_start_dates = pd.to_datetime(['2020-01-01', '2020-02-01', '2020-01-15'])
+    v_end_dates = pd.to_datetime(['2020-01-31', '2020-02-29', '2020-03-10'])
+    daily = WeatherStore.summarize_daily(v_datetime, v_temperature_F)
+
+    df_periods = Weather.aggregate_daily_periods(daily, v_start_dates, v_end_dates,
+                                                 base_temperatures_F=[65])
+
+    s_temperature_F = pd.Series(v_temperature_F, index=v_datetime).dropna()
+    s_daily_mean = s_temperature_F.resample('D').mean()
+    for i, (start, end) in enumerate(zip(v_start_dates, v_end_dates)):
+        v_period = s_temperature_F[start:end + pd.Timedelta(hours=23)]
+        assert df_periods['count'][i] == len(v_period)
+        assert df_periods['days'][i] == (end - start).days + 1
+        assert df_periods['mean_T_F'][i] == pytest.approx(v_period.mean())
+        assert df_periods['hdd_65'][i] == pytest.approx(np.maximum(65 - s_daily_mean[start:end], 0).sum())
+        assert df_periods['cdd_65'][i] == pytest.approx(np.maximum(s_daily_mean[start:end] - 65, 0).sum())
+
+
+def test_aggregate_daily_periods_counts_the_whole_end_day():
+    # 40F throughout, except after midnight on the end day
+    v_datetime = pd.date_range('2020-01-01', '2020-01-03 23:00', freq='h')
+    v_temperature_F = np.where(v_datetime > pd.Timestamp('2020-01-03'), 80.0, 40.0)
+    daily = WeatherStore.summarize_daily(v_datetime, v_temperature_F)
+
+    df_periods = Weather.aggregate_daily_periods(daily, pd.to_datetime(['2020-01-01']),
+                                                 pd.to_datetime(['2020-01-03']))
+
+    # The hourly aggregation it replaced read up to 2020-01-03 00:00 only, a mean of 40F
+    assert df_periods['count'][0] == 72
+    assert df_periods['mean_T_F'][0] == pytest.approx((49 * 40 + 23 * 80) / 72)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from better.weather_store import WeatherStore
+
+
+def test_write_merges_and_reads_ranges(tmp_path):
+    store = WeatherStore(tmp_path)
+    v_datetime = pd.date_range('2020-01-01', periods=48, freq='h')
+    store.write('724940', v_datetime[:30], np.arange(30.0))
+    store.write('724940', v_datetime[24:], np.arange(24.0, 48.0) + 0.5)
+
+    v_time, v_temperature = store.read('724940', '2020-01-01 20:00', '2020-01-02 02:00')
+
+    assert store.stations() == ['724940']
+    assert list(store.to_datetime(v_time)) == list(v_datetime[20:27].to_numpy('datetime64[s]'))
+    assert list(v_temperature) == [20.0, 21.0, 22.0, 23.0, 24.5, 25.5, 26.5]
+    assert store.covers('724940', '2020-01-01', '2020-01-02')
+    assert not store.covers('724940', '2020-01-01', '2020-01-05')
+    assert not store.covers('725300', '2020-01-01', '2020-01-02')
+
+    daily = store.read_daily('724940', '2020-01-02', '2020-01-02')
+    assert list(daily['day']) == [np.datetime64('2020-01-02', 'D').astype(int)]
+    assert daily['mean'][0] == np.mean(np.arange(24.0, 48.0) + 0.5)
+    assert (daily['min'][0], daily['max'][0], daily['count'][0]) == (24.5, 47.5, 24)
+
+
+def test_covers_finds_gaps(tmp_path):
+    store = WeatherStore(tmp_path)
+    v_datetime = pd.date_range('2020-01-01', '2020-12-31 23:00', freq='h')
+    v_temperature = np.full(len(v_datetime), 50.0)
+    # A week of June missing and a day of August without a valid reading
+    missing = (v_datetime >= '2020-06-10') & (v_datetime < '2020-06-17')
+    v_temperature[(v_datetime >= '2020-08-01') & (v_datetime < '2020-08-02')] = np.nan
+    store.write('724940', v_datetime[~missing], v_temperature[~missing])
+
+    assert store.covers('724940', '2020-01-01', '2020-05-31')
+    assert store.covers('724940', '2020-06-18', '2020-07-31')
+    assert not store.covers('724940', '2020-01-01', '2020-12-31')
+    assert not store.covers('724940', '2020-06-01', '2020-06-30')
+    assert not store.covers('724940', '2020-07-15', '2020-08-15')
+
+
+def test_import_csv_cache(tmp_path):
+    for year in [2019, 2020]:
+        (tmp_path / 'csv' / str(year)).mkdir(parents=True)
+        pd.DataFrame({'Datetime': pd.date_range(str(year) + '-12-31', periods=3, freq='h'),
+                      'Temperature': [30.0, None, 32.0]}).to_csv(
+            tmp_path / 'csv' / str(year) / (str(year) + '_724940.csv'), index=False)
+    store = WeatherStore(tmp_path / 'store')
+
+    assert store.import_csv_cache(tmp_path / 'csv') == ['724940']
+    v_time, v_temperature = store.read('724940')
+    assert len(v_time) == 6
+    assert np.isnan(v_temperature[1])
+    assert list(store.read_daily('724940')['count']) == [2, 2]